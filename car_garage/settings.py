@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы в метрики входили сессия и аутентификация
+    'cars.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -76,14 +79,204 @@ WSGI_APPLICATION = 'car_garage.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+# Бэкенд выбирается переменной DB_ENGINE: sqlite (по умолчанию) или postgresql.
+# SQLite подходит для одного рабочего места; когда записи сохраняют несколько
+# сотрудников одновременно, используйте PostgreSQL.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite').lower()
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'car_garage'),
+            'USER': os.environ.get('DB_USER', 'car_garage'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Проверять соединение перед повторным использованием в новом запросе
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': env_int('DB_CONNECT_TIMEOUT', 5),
+            },
+        }
     }
+    if env_bool('DB_POOL'):
+        # Пул соединений psycopg (пакет psycopg[pool]); с пулом
+        # CONN_MAX_AGE должен быть 0 - соединения держит сам пул
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': env_int('DB_POOL_MIN_SIZE', 2),
+            'max_size': env_int('DB_POOL_MAX_SIZE', 10),
+            'timeout': env_int('DB_POOL_TIMEOUT', 10),
+        }
+    else:
+        # Постоянные соединения: одно на поток, живет DB_CONN_MAX_AGE секунд
+        DATABASES['default']['CONN_MAX_AGE'] = env_int('DB_CONN_MAX_AGE', 60)
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Сколько секунд ждать снятия блокировки другим писателем
+                'timeout': env_int('DB_SQLITE_TIMEOUT', 20),
+                # Транзакция сразу берет блокировку записи, поэтому два писателя
+                # не получают "database is locked" при повышении блокировки
+                'transaction_mode': 'IMMEDIATE',
+                # WAL: чтение не блокируется записью
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            },
+            # Тестовая база - файл, а не память: так тесты проверяют те же
+            # блокировки, что и рабочая база
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
+    }
+else:
+    raise ValueError(f'Неизвестный DB_ENGINE: {DB_ENGINE}')
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+# Кэш ответов API (cars/cache.py) и сессий (default). Бэкенд выбирается
+# переменной CACHE_ENGINE: locmem (по умолчанию, память процесса), redis или
+# memcached с адресом CACHE_LOCATION. Память процесса подходит для одного
+# процесса; при нескольких процессах или серверах укажите общий бэкенд, иначе
+# сброс кэша ответов не дойдет до других процессов.
+CACHE_ENGINE = os.environ.get('CACHE_ENGINE', 'locmem').lower()
+
+if CACHE_ENGINE == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'api': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'car-garage-api',
+        },
+    }
+elif CACHE_ENGINE in ('redis', 'memcached'):
+    if CACHE_ENGINE == 'redis':
+        # Пакет redis
+        cache_backend = 'django.core.cache.backends.redis.RedisCache'
+        cache_location = os.environ.get('CACHE_LOCATION', 'redis://localhost:6379/0')
+    else:
+        # Пакет pymemcache
+        cache_backend = 'django.core.cache.backends.memcached.PyMemcacheCache'
+        cache_location = os.environ.get('CACHE_LOCATION', 'localhost:11211')
+    CACHES = {
+        'default': {
+            'BACKEND': cache_backend,
+            'LOCATION': cache_location,
+            'KEY_PREFIX': 'car-garage',
+        },
+        'api': {
+            'BACKEND': cache_backend,
+            'LOCATION': cache_location,
+            'KEY_PREFIX': 'car-garage-api',
+        },
+    }
+else:
+    raise ValueError(f'Неизвестный CACHE_ENGINE: {CACHE_ENGINE}')
+
+# Кэш общий для всех процессов
+SHARED_CACHE = CACHE_ENGINE != 'locmem'
+
+API_CACHE_ALIAS = 'api'
+API_CACHE_TIMEOUT = 300
+# Кэш ответов API (cars/cache.py). Версии данных, которые сбрасывают ответы
+# при записи, хранятся в API_CACHE_ALIAS: с кэшем процесса запись в одном
+# процессе не сбросила бы ответы других, поэтому по умолчанию ответы кэшируются
+# только с общим кэшем. API_CACHE_ENABLED=1 с locmem - для одного процесса.
+API_CACHE_ENABLED = env_bool('API_CACHE_ENABLED', SHARED_CACHE)
+
+# Потоков для построения отчетов Excel в асинхронных представлениях
+# и фоновых заданиях (cars/reports.py, cars/jobs.py, cars/deletion.py); 0 -
+# отчеты строятся в потоке запроса, а задания и фоновые удаления выполняет
+# только manage.py report_worker
+REPORT_WORKERS = env_int('REPORT_WORKERS', 2)
+
+# Автомобиль с историей больше стольких строк (записи о ремонте, запчасти,
+# склад) удаляется в фоне: DELETE отвечает 202, автомобиль сразу скрыт
+CAR_DELETE_BACKGROUND_ROWS = env_int('CAR_DELETE_BACKGROUND_ROWS', 20000)
+
+# Список админки без фильтров по таблице больше стольких строк показывает
+# число строк по статистике планировщика (ANALYZE) вместо COUNT(*)
+ADMIN_EXACT_COUNT_LIMIT = env_int('ADMIN_EXACT_COUNT_LIMIT', 100000)
+
+# Задание в статусе "выполняется" дольше этого времени (с) возвращается в очередь
+REPORT_JOB_TIMEOUT = 15 * 60
+# Готовые отчеты хранятся сутки
+REPORT_JOB_MAX_AGE = 24 * 60 * 60
+
+# Метрики запросов (cars/metrics.py): заголовок Server-Timing, журнал
+# cars.requests и гистограммы по маршрутам (/api/metrics/, только staff)
+REQUEST_METRICS = env_bool('REQUEST_METRICS', True)
+SERVER_TIMING = env_bool('SERVER_TIMING', True)
+# Запросы дольше стольких мс пишутся в журнал с уровнем WARNING
+SLOW_REQUEST_MS = env_int('SLOW_REQUEST_MS', 1000)
+# Запросы к БД дольше стольких мс пишутся в журнал cars.db
+SLOW_QUERY_MS = env_int('SLOW_QUERY_MS', 100)
+
+# Журналы приложения: строка JSON на запрос (cars.requests, уровень INFO)
+# выводится при LOG_LEVEL=INFO; по умолчанию - только медленные запросы и ошибки
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'plain',
+        },
+    },
+    'loggers': {
+        'cars': {
+            'handlers': ['console'],
+            'level': os.environ.get('LOG_LEVEL', 'WARNING').upper(),
+            'propagate': False,
+        },
+    },
 }
 
 
+# Аутентификация без запросов к БД на горячем пути (cars/authentication.py):
+# пользователь сессии и токена API берется из кэша процесса на
+# AUTH_CACHE_TTL секунд. ModelBackend оставлен для сессий, созданных до
+# включения кэша.
+#
+# Сессии читаются из кэша (в базу пишутся при изменении) только с общим
+# кэшем: с кэшем в памяти процесса выход удалял бы сессию из кэша одного
+# процесса, а другие принимали бы ее до истечения SESSION_COOKIE_AGE.
+if SHARED_CACHE:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+AUTHENTICATION_BACKENDS = [
+    'cars.authentication.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+AUTH_CACHE_TTL = env_int('AUTH_CACHE_TTL', 60)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -123,6 +316,9 @@ STATICFILES_DIRS = [
     BASE_DIR / 'cars' / 'static',
 ]
 
+# Файлы фоновых отчетов (ReportJob.file)
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', BASE_DIR / 'media'))
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8000",
@@ -133,12 +329,19 @@ CORS_ALLOW_CREDENTIALS = True
 
 # REST Framework settings
 REST_FRAMEWORK = {
+    # Сессия браузера (с проверкой CSRF) или токен API интеграций
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
+        'cars.authentication.BearerTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # JSON через orjson с тем же выводом, что у JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'cars.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 # Login URLs
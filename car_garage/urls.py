@@ -16,22 +16,33 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from cars import views
+from cars import async_views, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('login/', views.login_view, name='login'),
     path('register/', views.register_view, name='register'),
     path('logout/', views.logout_view, name='logout'),
-    path('api/cars/', views.car_list, name='car-list'),
-    path('api/cars/<int:pk>/', views.car_detail, name='car-detail'),
-    path('api/cars/<int:car_id>/repairs/', views.repair_record_list, name='repair-record-list'),
-    path('api/cars/<int:car_id>/repairs/<int:record_id>/', views.repair_record_detail, name='repair-record-detail'),
+    path('api/cars/', async_views.car_list_endpoint, name='car-list'),
+    path('api/cars/<int:pk>/', async_views.car_detail_endpoint, name='car-detail'),
+    path('api/cars/<int:car_id>/repairs/', async_views.repair_record_list_endpoint, name='repair-record-list'),
+    path('api/cars/<int:car_id>/repairs/<int:record_id>/', async_views.repair_record_detail_endpoint, name='repair-record-detail'),
+    path('api/cars/<int:car_id>/repairs/<int:record_id>/install-stock/', views.repair_record_install_stock, name='repair-record-install-stock'),
+    path('api/cars/<int:car_id>/repairs/<int:record_id>/batch/', views.repair_record_batch, name='repair-record-batch'),
     path('api/cars/<int:car_id>/repairs/<int:record_id>/parts/', views.part_create, name='part-create'),
     path('api/cars/<int:car_id>/repairs/<int:record_id>/parts/<int:part_id>/', views.part_detail, name='part-detail'),
-    path('api/cars/<int:car_id>/stock/', views.stock_part_list, name='stock-part-list'),
-    path('api/cars/<int:car_id>/stock/<int:stock_part_id>/', views.stock_part_detail, name='stock-part-detail'),
-    path('api/cars/<int:car_id>/export-report/', views.export_report_to_excel, name='export-report'),
+    path('api/cars/<int:car_id>/stock/', async_views.stock_part_list_endpoint, name='stock-part-list'),
+    path('api/cars/<int:car_id>/stock/<int:stock_part_id>/', async_views.stock_part_detail_endpoint, name='stock-part-detail'),
+    path('api/cars/<int:car_id>/import/', views.import_repair_history, name='import-repair-history'),
+    path('api/cars/<int:car_id>/stats/', async_views.car_stats_endpoint, name='car-stats'),
+    path('api/cars/<int:car_id>/export-report/', async_views.export_report_endpoint, name='export-report'),
+    path('api/fleet-report/', async_views.fleet_report_endpoint, name='fleet-report'),
+    path('api/search/', async_views.search_endpoint, name='search'),
+    path('api/sync/', async_views.sync_endpoint, name='sync'),
+    path('api/metrics/', async_views.metrics_endpoint, name='request-metrics'),
+    path('api/cars/<int:car_id>/report-jobs/', async_views.report_job_list_endpoint, name='report-job-list'),
+    path('api/cars/<int:car_id>/report-jobs/<int:job_id>/', async_views.report_job_detail_endpoint, name='report-job-detail'),
+    path('api/cars/<int:car_id>/report-jobs/<int:job_id>/download/', async_views.report_job_download_endpoint, name='report-job-download'),
     path('car/<int:car_id>/', views.car_detail_view, name='car-detail'),
     path('', views.index_view, name='index'),
 ]
@@ -1,33 +1,221 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Car, RepairRecord, Part, StockPart
+from django.contrib.auth import get_user_model
+from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection
+from django.utils.functional import cached_property
+
+from .deletion import delete_car_on_commit, delete_user_on_commit
+from .models import ApiToken, Car, RepairRecord, Part, PartCatalog, StockPart, SearchEntry
+from .search import matching_entries
+
+
+def history_summary(request, cars):
+    """Страница подтверждения удаления автомобилей cars: число объектов
+    истории по моделям вместо списка каждого объекта, который Django
+    собирает для большой истории слишком долго (см. deletion.py)"""
+    cars = list(cars)
+    model_count = {Car._meta.verbose_name_plural: len(cars)}
+    for model, lookup in ((RepairRecord, 'car__in'), (Part, 'repair_record__car__in'), (StockPart, 'car__in')):
+        count = model.objects.filter(**{lookup: cars}).count()
+        if count:
+            model_count[model._meta.verbose_name_plural] = count
+    perms_needed = {
+        model._meta.verbose_name
+        for model in (Car, RepairRecord, Part, StockPart)
+        if not request.user.has_perm(f'{model._meta.app_label}.delete_{model._meta.model_name}')
+    }
+    return [str(car) for car in cars], model_count, perms_needed, []
+
+
+def estimated_count(model):
+    """Число строк таблицы model по статистике планировщика или None, если
+    ANALYZE для нее еще не выполнялся"""
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'sqlite':
+            try:
+                # Первое число stat - строк в таблице
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            except DatabaseError:
+                return None
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    count = int(str(row[0]).split()[0])
+    return count if count >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для списка без фильтров по таблице больше
+    settings.ADMIN_EXACT_COUNT_LIMIT строк берет число строк из статистики
+    планировщика вместо COUNT(*) по всей таблице. Последние страницы такого
+    списка могут оказаться пустыми или неполными."""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_count(self.object_list.model)
+            if estimate is not None and estimate > settings.ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableMixin:
+    """Список большой таблицы: без второго COUNT(*) для «всего N» и с
+    оценкой числа строк без фильтров"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class ManufacturerFilter(admin.SimpleListFilter):
+    """Производитель из каталога. list_filter = ['catalog__manufacturer']
+    выбирал DISTINCT по всей таблице запчастей при каждом открытии списка."""
+    title = 'Производитель'
+    parameter_name = 'manufacturer'
+
+    def lookups(self, request, model_admin):
+        manufacturers = PartCatalog.objects.order_by('manufacturer').values_list('manufacturer', flat=True).distinct()
+        return [(manufacturer, manufacturer) for manufacturer in manufacturers]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(catalog__manufacturer=self.value())
+        return queryset
+
+
+class IndexedSearchMixin:
+    """Поиск по полнотекстовому индексу (search.py) вместо LIKE по search_fields.
+
+    search_fields задают поле поиска в списке и документируют, что
+    проиндексировано; search_entry_field - поле SearchEntry со ссылкой на объект.
+    """
+    search_kind = None
+    search_entry_field = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        entries = matching_entries(search_term).filter(kind=self.search_kind)
+        return queryset.filter(pk__in=entries.values(self.search_entry_field)), False
+
 
 @admin.register(Car)
-class CarAdmin(admin.ModelAdmin):
+class CarAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ['brand', 'model', 'user', 'created_at']
-    list_filter = ['created_at', 'user']
-    search_fields = ['brand', 'model', 'vin']
+    list_select_related = ['user']
+    # Вместо list_filter по пользователю (загружал всех пользователей) - поиск по точному логину
+    search_fields = ['brand', 'model', 'vin', '=user__username']
+    date_hierarchy = 'created_at'
+    autocomplete_fields = ['user']
     readonly_fields = ['created_at', 'updated_at']
 
+    def get_deleted_objects(self, objs, request):
+        return history_summary(request, objs)
+
+    # Удаление в админке выполняется внутри transaction.atomic: история
+    # удаляется пакетами после его фиксации (см. deletion.py)
+    def delete_model(self, request, obj):
+        delete_car_on_commit(obj)
+
+    def delete_queryset(self, request, queryset):
+        for car in queryset:
+            delete_car_on_commit(car)
+
 
 @admin.register(RepairRecord)
-class RepairRecordAdmin(admin.ModelAdmin):
+class RepairRecordAdmin(LargeTableMixin, IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['car', 'date', 'mileage', 'work_cost', 'created_at']
-    list_filter = ['date', 'created_at']
-    search_fields = ['car__brand', 'car__model', 'work_description']
+    list_filter = ['created_at']
+    list_select_related = ['car']
+    search_fields = ['work_description']
+    search_kind = SearchEntry.KIND_REPAIR
+    search_entry_field = 'repair_record'
+    date_hierarchy = 'date'
+    autocomplete_fields = ['car']
     readonly_fields = ['created_at', 'updated_at']
 
+    def get_queryset(self, request):
+        # str(запись) включает автомобиль: нужен и в подсказках автодополнения запчастей
+        return super().get_queryset(request).select_related('car')
+
 
 @admin.register(Part)
-class PartAdmin(admin.ModelAdmin):
+class PartAdmin(LargeTableMixin, IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['name', 'part_code', 'manufacturer', 'cost', 'repair_record']
-    list_filter = ['manufacturer']
-    search_fields = ['name', 'part_code', 'manufacturer']
+    list_filter = [ManufacturerFilter]
+    list_select_related = ['catalog', 'repair_record__car']
+    search_fields = ['name', 'catalog__part_code', 'catalog__manufacturer']
+    # Порядок добавления по первичному ключу. Индекс по created_at для списка
+    # и date_hierarchy планировщик SQLite выбирает и для запчастей записей о
+    # ремонте (repair_record_id IN (...) ORDER BY created_at) с полным
+    # просмотром таблицы вместо part_record_created_idx
+    ordering = ['-pk']
+    raw_id_fields = ['catalog']
+    autocomplete_fields = ['repair_record']
+    search_kind = SearchEntry.KIND_PART
+    search_entry_field = 'part'
     readonly_fields = ['created_at']
 
 
 @admin.register(StockPart)
-class StockPartAdmin(admin.ModelAdmin):
+class StockPartAdmin(LargeTableMixin, IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['name', 'part_code', 'manufacturer', 'cost', 'car', 'purchase_date']
-    list_filter = ['manufacturer', 'purchase_date']
-    search_fields = ['name', 'part_code', 'manufacturer']
+    list_filter = [ManufacturerFilter, 'purchase_date']
+    list_select_related = ['catalog', 'car']
+    search_fields = ['name', 'catalog__part_code', 'catalog__manufacturer', 'notes']
+    date_hierarchy = 'created_at'
+    raw_id_fields = ['catalog']
+    autocomplete_fields = ['car']
+    search_kind = SearchEntry.KIND_STOCK
+    search_entry_field = 'stock_part'
     readonly_fields = ['created_at']
+
+
+@admin.register(PartCatalog)
+class PartCatalogAdmin(admin.ModelAdmin):
+    list_display = ['manufacturer', 'part_code', 'name', 'created_at']
+    search_fields = ['=part_code', 'manufacturer']
+    readonly_fields = ['created_at']
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    """Токены выдает manage.py create_api_token (ключ показывается один раз);
+    здесь их можно только просмотреть и отозвать удалением"""
+    list_display = ['prefix', 'name', 'user', 'created_at']
+    list_select_related = ['user']
+    search_fields = ['name', 'prefix', 'user__username']
+    readonly_fields = ['user', 'name', 'prefix', 'key_hash', 'created_at']
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.unregister(get_user_model())
+
+
+@admin.register(get_user_model())
+class GarageUserAdmin(UserAdmin):
+    """Пользователи удаляются вместе с автомобилями через deletion.delete_user_on_commit()"""
+
+    def get_deleted_objects(self, objs, request):
+        users = list(objs)
+        to_delete, model_count, perms_needed, protected = history_summary(request, Car.all_objects.filter(user__in=users))
+        model_count = {self.opts.verbose_name_plural: len(users), **model_count}
+        if not self.has_delete_permission(request):
+            perms_needed.add(self.opts.verbose_name)
+        return [str(user) for user in users] + to_delete, model_count, perms_needed, protected
+
+    def delete_model(self, request, obj):
+        delete_user_on_commit(obj)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            delete_user_on_commit(user)
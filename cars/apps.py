@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CarsConfig(AppConfig):
     name = 'cars'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .metrics import install_query_wrapper
+        connection_created.connect(install_query_wrapper, dispatch_uid='cars-query-metrics')
@@ -0,0 +1,427 @@
+"""Асинхронные представления API для чтения
+
+GET-запросы к API обслуживаются асинхронными функциями на async ORM: пока
+запрос ждет БД или медленного клиента, один ASGI-процесс обслуживает другие.
+Изменяющие запросы того же маршрута передаются синхронным DRF-представлениям
+из views.py. Отчеты Excel строятся в пуле потоков (reports.abuild_report)
+и не блокирует цикл событий.
+
+Под WSGI эти представления тоже работают: Django вызывает их через async_to_sync.
+"""
+import functools
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from . import metrics, views
+from .authentication import aauthenticate
+from .cache import cached_api_response
+from .models import Car, RepairRecord, StockPart, ReportJob, SearchEntry, prefetch_parts
+from .ownership import NotOwned, aget_owned
+from .pagination import KeysetPagination
+from .renderers import render_json
+from .reports import (
+    REPORT_CONTENT_TYPE, abuild_report, abuild_repair_report, build_fleet_report, fleet_report_filename,
+    report_filename,
+)
+from .row_serializers import RowSerializer, UnsupportedSerializer
+from .search import SEARCH_LIMIT, search as search_entries
+from .sync import InvalidCursor, changes_since, parse_cursor
+from .serializers import (
+    CarSerializer, CarWithSummarySerializer, RepairRecordSerializer, StockPartSerializer, CarStatsSerializer, ReportJobSerializer,
+    SearchResultSerializer, SyncSerializer,
+)
+from .stats import compute_car_stats, filter_period, with_summary
+
+# Размер блока при отдаче файла отчета под ASGI
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    with metrics.timer('serialize'):
+        content = render_json(data)
+    return HttpResponse(content, content_type='application/json', status=status)
+
+
+def exception_response(exc, status=None):
+    return json_response({'detail': exc.detail}, status=status or exc.status_code)
+
+
+def parse_period(request):
+    """Разбирает необязательные параметры date_from/date_to (ГГГГ-ММ-ДД).
+
+    Возвращает (date_from, date_to); ValueError при неверном формате.
+    """
+    period = []
+    for param in ('date_from', 'date_to'):
+        value = request.GET.get(param)
+        period.append(datetime.strptime(value, '%Y-%m-%d').date() if value else None)
+    return tuple(period)
+
+
+def requested_car_ids(request):
+    """Список ID из параметра ?car_ids=1,2,3 (None - все автомобили).
+
+    ValueError, если ID не число.
+    """
+    car_ids = request.GET.get('car_ids')
+    if not car_ids:
+        return None
+    return [int(car_id) for car_id in car_ids.split(',') if car_id.strip()]
+
+
+def requested_fields(request):
+    """Список полей из параметра ?fields=id,brand,model (None - все поля)"""
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+async def list_response(request, queryset, serializer_class):
+    """Ответ со списком объектов с учетом ?fields= и пагинации по курсору.
+
+    Без параметров ?cursor= и ?page_size= возвращается весь список. Строки
+    читаются через .values() и сериализуются RowSerializer; сериализаторы,
+    которые он не поддерживает, работают через экземпляры моделей.
+    """
+    fields = requested_fields(request)
+    paginator = KeysetPagination()
+    try:
+        row_serializer = RowSerializer.for_queryset(serializer_class, queryset, fields)
+    except UnsupportedSerializer:
+        row_serializer = None
+
+    if row_serializer is not None:
+        # Поля сортировки нужны для курсора следующей страницы
+        ordering = [field.lstrip('-') for field in paginator.get_ordering(queryset)]
+        queryset = row_serializer.values(queryset, extra=ordering)
+    elif fields is not None:
+        # Загружаем из БД только нужные колонки и поля сортировки для курсора
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        ordering = [field.lstrip('-') for field in paginator.get_ordering(queryset)]
+        # Связи из select_related нельзя отложить, их колонки загружаются всегда
+        related = queryset.query.select_related
+        related = list(related) if isinstance(related, dict) else []
+        queryset = queryset.only(*(model_fields & set(fields)), *ordering, *related)
+
+    paginated = paginator.is_requested(request)
+    if paginated:
+        rows = await paginator.apaginate_queryset(queryset, request)
+    else:
+        rows = [row async for row in queryset]
+
+    children = await row_serializer.afetch_children(rows) if row_serializer is not None else None
+    with metrics.timer('serialize'):
+        if row_serializer is not None:
+            data = row_serializer.assemble(rows, children)
+        else:
+            data = serializer_class(rows, many=True, fields=fields).data
+        if paginated:
+            data = paginator.get_paginated_data(data)
+    return json_response(data)
+
+
+def api_endpoint(read_view, write_view=None):
+    """Представление маршрута API.
+
+    GET и HEAD обслуживает асинхронная read_view(request, user, ...) после
+    проверки сессии или токена API (authentication.aauthenticate), остальные
+    методы - синхронное DRF-представление write_view (оно же проверяет CSRF
+    для сессий). Ответы обоих учитываются в метриках запросов
+    (metrics.instrument).
+    """
+    @metrics.instrument()
+    @functools.wraps(read_view)
+    async def endpoint(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            try:
+                user = await aauthenticate(request)
+            except exceptions.AuthenticationFailed as exc:
+                # Как DRF: заголовок WWW-Authenticate дает только первый класс
+                # аутентификации (сессия), поэтому 403
+                return exception_response(exc, status=status.HTTP_403_FORBIDDEN)
+            if not user.is_authenticated:
+                # Как DRF с SessionAuthentication: без WWW-Authenticate - 403
+                return exception_response(exceptions.NotAuthenticated(), status=status.HTTP_403_FORBIDDEN)
+            try:
+                return await read_view(Request(request), user, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return exception_response(exc)
+        if write_view is None:
+            return exception_response(exceptions.MethodNotAllowed(request.method))
+        return await sync_to_async(write_view)(request, *args, **kwargs)
+    return csrf_exempt(endpoint)
+
+
+async def get_user_car(user, car_id):
+    try:
+        return await aget_owned(Car, user, car_id)
+    except NotOwned:
+        return None
+
+
+def car_not_found():
+    return json_response({'error': 'Автомобиль не найден'}, status=status.HTTP_404_NOT_FOUND)
+
+
+def not_owned_response(error):
+    """Ответ 404 для объекта, не найденного среди объектов пользователя (ownership.py)"""
+    return json_response({'error': error.message}, status=status.HTTP_404_NOT_FOUND)
+
+
+def invalid_period():
+    return json_response({'error': 'Неверный формат даты, ожидается ГГГГ-ММ-ДД'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+async def request_metrics(request, user):
+    """Метрики запросов этого процесса по маршрутам: число, ошибки,
+    гистограммы времени ответа и запросов к БД (metrics.py). Только для staff."""
+    if not user.is_staff:
+        return exception_response(exceptions.PermissionDenied())
+    return json_response(metrics.registry.snapshot())
+
+
+@cached_api_response('user')
+async def car_list(request, user):
+    """Список автомобилей пользователя.
+
+    С ?with_summary=1 у каждого автомобиля есть summary: записи о ремонте,
+    расходы, последнее обслуживание и запчасти на складе (stats.with_summary).
+    """
+    cars = Car.objects.filter(user=user)
+    if request.query_params.get('with_summary') in ('1', 'true'):
+        return await list_response(request, with_summary(cars), CarWithSummarySerializer)
+    return await list_response(request, cars, CarSerializer)
+
+
+async def car_detail(request, user, pk):
+    """Детали автомобиля"""
+    car = await get_user_car(user, pk)
+    if car is None:
+        return json_response(None, status=status.HTTP_404_NOT_FOUND)
+    return json_response(CarSerializer(car).data)
+
+
+@cached_api_response('car')
+async def repair_record_list(request, user, car_id):
+    """Список записей о ремонте для автомобиля"""
+    car = await get_user_car(user, car_id)
+    if car is None:
+        return car_not_found()
+    try:
+        date_from, date_to = parse_period(request)
+    except ValueError:
+        return invalid_period()
+    records = filter_period(RepairRecord.objects.filter(car=car), 'date', date_from, date_to)
+    fields = requested_fields(request)
+    if fields is None or 'parts' in fields:
+        records = records.prefetch_related(prefetch_parts())
+    return await list_response(request, records, RepairRecordSerializer)
+
+
+async def repair_record_detail(request, user, car_id, record_id):
+    """Детали записи о ремонте"""
+    try:
+        record = await aget_owned(RepairRecord, user, car_id, record_id,
+                                  queryset=RepairRecord.objects.prefetch_related(prefetch_parts()))
+    except NotOwned as e:
+        return not_owned_response(e)
+    return json_response(RepairRecordSerializer(record).data)
+
+
+@cached_api_response('car')
+async def stock_part_list(request, user, car_id):
+    """Список запчастей на складе для автомобиля"""
+    car = await get_user_car(user, car_id)
+    if car is None:
+        return car_not_found()
+    return await list_response(request, StockPart.objects.filter(car=car).select_related('catalog'), StockPartSerializer)
+
+
+async def stock_part_detail(request, user, car_id, stock_part_id):
+    """Детали запчасти на складе"""
+    try:
+        stock_part = await aget_owned(StockPart, user, car_id, stock_part_id,
+                                      queryset=StockPart.objects.select_related('catalog'))
+    except NotOwned as e:
+        return not_owned_response(e)
+    return json_response(StockPartSerializer(stock_part).data)
+
+
+@cached_api_response('car')
+async def car_stats(request, user, car_id):
+    """Агрегированная статистика расходов по автомобилю за период"""
+    car = await get_user_car(user, car_id)
+    if car is None:
+        return car_not_found()
+    try:
+        date_from, date_to = parse_period(request)
+    except ValueError:
+        return invalid_period()
+    stats = await sync_to_async(compute_car_stats)(car, date_from, date_to)
+    return json_response(CarStatsSerializer(stats).data)
+
+
+async def _iter_file(file):
+    try:
+        while chunk := await sync_to_async(file.read, thread_sensitive=False)(FILE_CHUNK_SIZE):
+            yield chunk
+    finally:
+        file.close()
+
+
+def file_response(request, file, filename, content_type):
+    """Ответ с открытым файлом, который закрывается после отдачи.
+
+    Под ASGI файл читается асинхронно: синхронный итератор FileResponse
+    Django перед отправкой целиком прочитал бы в память.
+    """
+    if isinstance(request, ASGIRequest):
+        file.seek(0, 2)
+        size = file.tell()
+        file.seek(0)
+        response = StreamingHttpResponse(_iter_file(file), content_type=content_type)
+        response['Content-Length'] = str(size)
+    else:
+        response = FileResponse(file, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+async def export_report_to_excel(request, user, car_id):
+    """Экспорт отчета о ремонте в Excel"""
+    car = await get_user_car(user, car_id)
+    if car is None:
+        return car_not_found()
+    try:
+        date_from, date_to = parse_period(request)
+    except ValueError:
+        return invalid_period()
+    if date_from is None or date_to is None:
+        return json_response({'error': 'Необходимо указать даты начала и окончания периода'},
+                             status=status.HTTP_400_BAD_REQUEST)
+
+    # Книга строится в пуле потоков в потоковом режиме во временный файл
+    output = await abuild_repair_report(car, date_from, date_to)
+    return file_response(request._request, output, report_filename(car, date_from, date_to), REPORT_CONTENT_TYPE)
+
+
+async def fleet_report(request, user):
+    """Сводный отчет Excel по всем или выбранным (?car_ids=) автомобилям
+    пользователя: сводный лист и по листу на автомобиль"""
+    try:
+        date_from, date_to = parse_period(request)
+    except ValueError:
+        return invalid_period()
+    if date_from is None or date_to is None:
+        return json_response({'error': 'Необходимо указать даты начала и окончания периода'},
+                             status=status.HTTP_400_BAD_REQUEST)
+    try:
+        car_ids = requested_car_ids(request)
+    except ValueError:
+        return json_response({'error': 'Неверный список автомобилей'}, status=status.HTTP_400_BAD_REQUEST)
+
+    cars = Car.objects.filter(user=user)
+    if car_ids is not None:
+        cars = cars.filter(pk__in=car_ids)
+        found = {pk async for pk in cars.values_list('pk', flat=True)}
+        missing = sorted(set(car_ids) - found)
+        if missing:
+            return json_response({'error': 'Автомобили не найдены', 'car_ids': missing},
+                                 status=status.HTTP_404_NOT_FOUND)
+
+    output = await abuild_report(build_fleet_report, cars, date_from, date_to)
+    return file_response(request._request, output, fleet_report_filename(date_from, date_to), REPORT_CONTENT_TYPE)
+
+
+async def search(request, user):
+    """Полнотекстовый поиск по записям о ремонте, запчастям и складу
+    пользователя: ?q=ремень грм[&kind=repair,part,stock][&car_id=][&limit=]"""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return json_response({'error': 'Не указан поисковый запрос'}, status=status.HTTP_400_BAD_REQUEST)
+    kinds = [kind for kind in request.GET.get('kind', '').split(',') if kind]
+    valid_kinds = {kind for kind, _ in SearchEntry.KIND_CHOICES}
+    if not set(kinds) <= valid_kinds:
+        return json_response({'error': f"Неверный тип, допустимые: {', '.join(sorted(valid_kinds))}"},
+                             status=status.HTTP_400_BAD_REQUEST)
+    try:
+        car_id = int(request.GET['car_id']) if request.GET.get('car_id') else None
+        limit = int(request.GET.get('limit', SEARCH_LIMIT))
+    except ValueError:
+        return json_response({'error': 'Параметры car_id и limit должны быть числами'},
+                             status=status.HTTP_400_BAD_REQUEST)
+
+    entries = await sync_to_async(search_entries)(user, query, kinds=kinds, car_id=car_id, limit=limit)
+    with metrics.timer('serialize'):
+        data = SearchResultSerializer(entries, many=True).data
+    return json_response(data)
+
+
+async def sync_changes(request, user):
+    """Изменения данных пользователя для клиента с локальной копией:
+    ?since=<cursor из предыдущего ответа>; без since - все данные (sync.py)"""
+    since = request.GET.get('since')
+    try:
+        since = parse_cursor(since) if since else None
+    except InvalidCursor:
+        return json_response({'error': 'Неверный курсор синхронизации'}, status=status.HTTP_400_BAD_REQUEST)
+    changes = await sync_to_async(changes_since)(user, since)
+    with metrics.timer('serialize'):
+        data = SyncSerializer(changes).data
+    return json_response(data)
+
+
+async def report_job_list(request, user, car_id):
+    """Задания на отчеты по автомобилю (новые первыми)"""
+    car = await get_user_car(user, car_id)
+    if car is None:
+        return car_not_found()
+    return await list_response(request, ReportJob.objects.filter(car=car), ReportJobSerializer)
+
+
+async def report_job_detail(request, user, car_id, job_id):
+    """Статус задания на отчет"""
+    try:
+        job = await aget_owned(ReportJob, user, car_id, job_id)
+    except NotOwned as e:
+        return not_owned_response(e)
+    return json_response(ReportJobSerializer(job).data)
+
+
+async def report_job_download(request, user, car_id, job_id):
+    """Файл готового отчета"""
+    try:
+        job = await aget_owned(ReportJob, user, car_id, job_id)
+    except NotOwned as e:
+        return not_owned_response(e)
+    if job.status != ReportJob.STATUS_DONE:
+        return json_response({'error': 'Отчет еще не готов', 'status': job.status}, status=status.HTTP_409_CONFLICT)
+    try:
+        file = await sync_to_async(job.file.storage.open, thread_sensitive=False)(job.file.name, 'rb')
+    except FileNotFoundError:
+        return json_response({'error': 'Файл отчета удален'}, status=status.HTTP_410_GONE)
+    return file_response(request._request, file, report_filename(job.car, job.date_from, job.date_to), REPORT_CONTENT_TYPE)
+
+
+car_list_endpoint = api_endpoint(car_list, views.car_list)
+car_detail_endpoint = api_endpoint(car_detail, views.car_detail)
+repair_record_list_endpoint = api_endpoint(repair_record_list, views.repair_record_list)
+repair_record_detail_endpoint = api_endpoint(repair_record_detail, views.repair_record_detail)
+stock_part_list_endpoint = api_endpoint(stock_part_list, views.stock_part_list)
+stock_part_detail_endpoint = api_endpoint(stock_part_detail, views.stock_part_detail)
+car_stats_endpoint = api_endpoint(car_stats)
+export_report_endpoint = api_endpoint(export_report_to_excel)
+fleet_report_endpoint = api_endpoint(fleet_report)
+search_endpoint = api_endpoint(search)
+sync_endpoint = api_endpoint(sync_changes)
+metrics_endpoint = api_endpoint(request_metrics)
+report_job_list_endpoint = api_endpoint(report_job_list, views.report_job_create)
+report_job_detail_endpoint = api_endpoint(report_job_detail)
+report_job_download_endpoint = api_endpoint(report_job_download)
@@ -0,0 +1,195 @@
+"""Аутентификация без обращения к базе данных на каждом запросе
+
+Пользователь сессии хранится в кэше процесса (CachedModelBackend), а с общим
+кэшем (settings.SHARED_CACHE) и сами сессии - в кэше с записью в базу
+(SESSION_ENGINE cached_db). Интеграции
+обращаются к API с заголовком Authorization: Bearer <ключ> (ApiToken,
+BearerTokenAuthentication) и не передают CSRF-токен.
+
+Пользователи и токены хранятся в кэше процесса settings.AUTH_CACHE_TTL
+секунд. Изменение или удаление пользователя и удаление токена сбрасывают
+кэш своего процесса сразу (signals.py), другие процессы узнают об этом не
+позже чем через AUTH_CACHE_TTL: на это время, например, отозванный токен
+или сессия до смены пароля в них еще действуют.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .models import ApiToken, hash_token
+
+BEARER_KEYWORD = 'Bearer'
+
+# Записей в каждом кэше процесса; при переполнении вытесняются старые
+AUTH_CACHE_SIZE = 10000
+
+_MISSING = object()
+# Значение кэша токенов: токена с таким ключом нет
+_INVALID = object()
+
+
+class TTLCache:
+    """Словарь в памяти процесса с временем жизни записей"""
+
+    def __init__(self, maxsize=AUTH_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISSING
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            return value
+
+    def set(self, key, value):
+        ttl = getattr(settings, 'AUTH_CACHE_TTL', 60)
+        if not ttl:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.monotonic() + ttl)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# ID пользователя -> пользователь (None - нет или не может войти)
+_users = TTLCache()
+# Хэш ключа токена -> ID пользователя (_INVALID - токена нет). Связь токена
+# с пользователем не меняется, пользователь берется из _users
+_tokens = TTLCache()
+
+
+def _copy(user):
+    # Каждый запрос получает свою копию: в пользователе кэшируются права
+    return copy.copy(user) if user is not None else None
+
+
+def forget_user(user_id):
+    _users.delete(user_id)
+
+
+def forget_token(key_hash):
+    _tokens.delete(key_hash)
+
+
+def clear_caches():
+    _users.clear()
+    _tokens.clear()
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend, который берет пользователя сессии из кэша процесса.
+    Проверка хэша сессии (смена пароля) остается за django.contrib.auth."""
+
+    def get_user(self, user_id):
+        user = _users.get(user_id)
+        if user is _MISSING:
+            user = super().get_user(user_id)
+            _users.set(user_id, user)
+        return _copy(user)
+
+    async def aget_user(self, user_id):
+        user = _users.get(user_id)
+        if user is _MISSING:
+            user = await super().aget_user(user_id)
+            _users.set(user_id, user)
+        return _copy(user)
+
+
+def _token_key(header):
+    """Ключ из заголовка Authorization или None, если это не Bearer"""
+    parts = header.split()
+    if not parts or parts[0].lower() != BEARER_KEYWORD.lower().encode():
+        return None
+    if len(parts) != 2:
+        raise exceptions.AuthenticationFailed('Неверный заголовок Authorization: ожидается Bearer <ключ>')
+    try:
+        return parts[1].decode('ascii')
+    except UnicodeDecodeError:
+        raise exceptions.AuthenticationFailed('Недействительный токен')
+
+
+def _cached_token_user(key_hash):
+    user_id = _tokens.get(key_hash)
+    if user_id is _MISSING or user_id is _INVALID:
+        return user_id
+    return _users.get(user_id)
+
+
+def _remember_token(key_hash, token):
+    if token is None:
+        _tokens.set(key_hash, _INVALID)
+        return _INVALID
+    user = token.user if ModelBackend().user_can_authenticate(token.user) else None
+    _tokens.set(key_hash, token.user_id)
+    _users.set(token.user_id, user)
+    return user
+
+
+def _token_user(user):
+    if user is _INVALID:
+        raise exceptions.AuthenticationFailed('Недействительный токен')
+    if user is None:
+        raise exceptions.AuthenticationFailed('Пользователь неактивен или удален')
+    return _copy(user)
+
+
+def user_for_token(key):
+    """Пользователь токена API; AuthenticationFailed, если токен не найден"""
+    key_hash = hash_token(key)
+    user = _cached_token_user(key_hash)
+    if user is _MISSING:
+        user = _remember_token(key_hash, ApiToken.objects.select_related('user').filter(key_hash=key_hash).first())
+    return _token_user(user)
+
+
+async def auser_for_token(key):
+    """user_for_token() для асинхронных представлений"""
+    key_hash = hash_token(key)
+    user = _cached_token_user(key_hash)
+    if user is _MISSING:
+        user = _remember_token(key_hash, await ApiToken.objects.select_related('user').filter(key_hash=key_hash).afirst())
+    return _token_user(user)
+
+
+class BearerTokenAuthentication(BaseAuthentication):
+    """Аутентификация DRF по заголовку Authorization: Bearer <ключ>"""
+
+    def authenticate(self, request):
+        key = _token_key(get_authorization_header(request))
+        if key is None:
+            return None
+        return user_for_token(key), None
+
+    def authenticate_header(self, request):
+        return BEARER_KEYWORD
+
+
+async def aauthenticate(request):
+    """Пользователь запроса к асинхронному представлению: по токену API, если
+    передан заголовок Authorization: Bearer, иначе по сессии. Недействительный
+    токен - AuthenticationFailed."""
+    key = _token_key(get_authorization_header(request))
+    if key is None:
+        return await request.auser()
+    return await auser_for_token(key)
@@ -0,0 +1,568 @@
+"""Нагрузочные замеры API
+
+Для каждого маршрута из car_garage/urls.py выполняется серия запросов
+тестовым клиентом и замеряются задержка (перцентили), число SQL-запросов
+на запрос и пиковая память (tracemalloc, отдельный прогон). Результат -
+JSON-отчет; два отчета (например, до и после коммита) сравниваются
+compare_reports.
+
+Изменяющие запросы выполняются в транзакции, которая откатывается после
+каждого повтора, поэтому все повторы работают с одними и теми же данными.
+Запросы идут с сессией, сценарии :token - с токеном API; после прогрева
+аутентификация берется из кэша и не дает SQL-запросов.
+Не замеряются админка и выход (завершает сессию клиента) - они попадают в
+список not_measured отчета.
+
+run_server_benchmark сравнивает пропускную способность одного процесса под
+WSGI (пул потоков-воркеров) и под ASGI (один цикл событий) на одинаковой
+смеси GET-запросов. Обработчики Django вызываются напрямую, без сетевого
+сервера; данные должны быть зафиксированы в БД.
+
+run_serialization_benchmark сравнивает скорость списков API (строк в секунду)
+на прежнем пути - экземпляры моделей, сериализатор DRF и JSONRenderer - и на
+быстром - строки .values(), RowSerializer и render_json; заодно проверяется,
+что ответы совпадают побайтно.
+"""
+import asyncio
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, resolve, reverse
+from django.utils import timezone
+
+from rest_framework.renderers import JSONRenderer
+
+from .jobs import get_or_create_report_job, process_report_job
+from .models import ApiToken, Car, RepairRecord, StockPart, prefetch_parts
+from .renderers import render_json
+from .row_serializers import RowSerializer
+from .serializers import CarSerializer, CarWithSummarySerializer, RepairRecordSerializer, StockPartSerializer
+from .stats import with_summary
+from .sync import make_cursor
+
+REPORT_VERSION = 1
+
+BENCHMARK_CACHE_ALIAS = 'benchmark'
+
+# Пороги для compare_reports
+LATENCY_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.25
+# Меньшие изменения задержки (мс) считаются шумом
+LATENCY_NOISE_MS = 5.0
+
+Scenario = namedtuple('Scenario', ['name', 'method', 'url', 'data', 'format', 'anonymous', 'staff', 'token'])
+
+
+def _scenario(name, method, url, data=None, format='json', anonymous=False, staff=False, token=False):
+    """token - запрос с токеном API вместо сессии"""
+    return Scenario(name, method, url, data, format, anonymous, staff, token)
+
+
+def _import_file():
+    rows = ['date;mileage;work_description;work_cost;part_name;part_code;manufacturer;quantity;part_cost']
+    for n in range(100):
+        rows.append(f'01.0{n % 9 + 1}.2023;{100000 + n * 100};Замена масла;2500,00;Фильтр масляный;MANN-{n};Mann;1;450,00')
+    content = '\n'.join(rows).encode('utf-8')
+    return lambda: {'file': SimpleUploadedFile('history.csv', content, content_type='text/csv')}
+
+
+def build_scenarios(car):
+    """Сценарии для всех маршрутов по автомобилю с данными"""
+    record = car.repair_records.order_by('-date', '-created_at').first()
+    part = record.parts.first()
+    stock_ids = list(car.stock_parts.order_by('pk').values_list('pk', flat=True)[:3])
+    first_date = car.repair_records.order_by('date').values_list('date', flat=True).first()
+    period = f'?date_from={first_date.isoformat()}&date_to={record.date.isoformat()}'
+
+    # Имя 'car-detail' занято и API, и страницей автомобиля
+    car_url = f"{reverse('car-list')}{car.pk}/"
+    repairs_url = reverse('repair-record-list', args=[car.pk])
+    record_url = reverse('repair-record-detail', args=[car.pk, record.pk])
+    stock_url = reverse('stock-part-list', args=[car.pk])
+    stock_part_url = reverse('stock-part-detail', args=[car.pk, stock_ids[0]])
+    jobs_url = reverse('report-job-list', args=[car.pk])
+    job, _ = get_or_create_report_job(car, first_date, record.date)
+    process_report_job(job.pk)
+
+    car_data = {'brand': 'Kia', 'model': 'Rio', 'vin': 'Z94CB41AAGR000001', 'year': 2016, 'power': 123}
+    record_data = {'date': record.date.isoformat(), 'mileage': record.mileage + 100,
+                   'work_description': 'Замена масла', 'work_cost': '2500.00'}
+    part_data = {'name': 'Фильтр масляный', 'part_code': 'W712', 'manufacturer': 'Mann', 'quantity': 1, 'cost': '450.00'}
+    stock_data = {'name': 'Свеча зажигания', 'part_code': 'BKR6E', 'manufacturer': 'NGK', 'quantity': 4, 'cost': '350.00'}
+
+    return [
+        _scenario('login-page', 'get', reverse('login'), anonymous=True),
+        _scenario('register-page', 'get', reverse('register'), anonymous=True),
+        _scenario('index-page', 'get', reverse('index')),
+        _scenario('car-page', 'get', f'/car/{car.pk}/'),
+        _scenario('car-list', 'get', reverse('car-list')),
+        _scenario('car-list:page', 'get', reverse('car-list') + '?page_size=24'),
+        _scenario('car-list:summary', 'get', reverse('car-list') + '?with_summary=1&page_size=24'),
+        _scenario('car-list:create', 'post', reverse('car-list'), car_data),
+        _scenario('car-list:token', 'get', reverse('car-list'), token=True),
+        _scenario('car-detail', 'get', car_url),
+        _scenario('car-detail:update', 'put', car_url, {**car_data, 'vin': car.vin}),
+        _scenario('car-detail:delete', 'delete', car_url),
+        _scenario('repair-record-list', 'get', repairs_url),
+        _scenario('repair-record-list:page', 'get', repairs_url + '?page_size=50'),
+        _scenario('repair-record-list:period', 'get', repairs_url + period),
+        _scenario('repair-record-list:fields', 'get', repairs_url + '?fields=id,date,mileage,work_cost'),
+        _scenario('repair-record-list:create', 'post', repairs_url, {**record_data, 'stock_part_ids': stock_ids[:1]}),
+        _scenario('repair-record-detail', 'get', record_url),
+        _scenario('repair-record-detail:token', 'get', record_url, token=True),
+        _scenario('repair-record-detail:update', 'put', record_url, record_data),
+        _scenario('repair-record-detail:delete', 'delete', record_url),
+        _scenario('repair-record-install-stock', 'post', reverse('repair-record-install-stock', args=[car.pk, record.pk]),
+                  {'stock_part_ids': stock_ids}),
+        _scenario('repair-record-batch', 'post', reverse('repair-record-batch', args=[car.pk, record.pk]), {'operations': [
+            {'op': 'update_record', 'data': {'work_cost': record_data['work_cost']}},
+            {'op': 'create_part', 'data': part_data},
+            {'op': 'update_part', 'id': part.pk, 'data': {'quantity': 2}},
+        ]}),
+        _scenario('part-create', 'post', reverse('part-create', args=[car.pk, record.pk]), part_data),
+        _scenario('part-detail:update', 'put', reverse('part-detail', args=[car.pk, record.pk, part.pk]), part_data),
+        _scenario('part-detail:update:token', 'put', reverse('part-detail', args=[car.pk, record.pk, part.pk]),
+                  part_data, token=True),
+        _scenario('part-detail:delete', 'delete', reverse('part-detail', args=[car.pk, record.pk, part.pk])),
+        _scenario('stock-part-list', 'get', stock_url),
+        _scenario('stock-part-list:create', 'post', stock_url, stock_data),
+        _scenario('stock-part-detail', 'get', stock_part_url),
+        _scenario('stock-part-detail:update', 'put', stock_part_url, stock_data),
+        _scenario('stock-part-detail:delete', 'delete', stock_part_url),
+        _scenario('import-repair-history', 'post', reverse('import-repair-history', args=[car.pk]),
+                  _import_file(), format='multipart'),
+        _scenario('car-stats', 'get', reverse('car-stats', args=[car.pk])),
+        _scenario('car-stats:period', 'get', reverse('car-stats', args=[car.pk]) + period),
+        _scenario('export-report', 'get', reverse('export-report', args=[car.pk]) + period),
+        _scenario('fleet-report', 'get', reverse('fleet-report') + period),
+        _scenario('search', 'get', reverse('search') + '?' + urlencode({'q': record.work_description.split()[0]})),
+        _scenario('search:car', 'get', reverse('search') + '?' + urlencode({'q': part.name, 'car_id': car.pk})),
+        _scenario('sync', 'get', reverse('sync')),
+        _scenario('sync:since', 'get', reverse('sync') + '?' + urlencode({'since': make_cursor(timezone.now() - timedelta(minutes=1))})),
+        _scenario('request-metrics', 'get', reverse('request-metrics'), staff=True),
+        _scenario('report-job-list', 'get', jobs_url),
+        _scenario('report-job-list:create', 'post', jobs_url,
+                  {'date_from': first_date.isoformat(), 'date_to': first_date.isoformat()}),
+        _scenario('report-job-detail', 'get', reverse('report-job-detail', args=[car.pk, job.pk])),
+        _scenario('report-job-download', 'get', reverse('report-job-download', args=[car.pk, job.pk])),
+    ]
+
+
+def _request(client, scenario):
+    data = scenario.data() if callable(scenario.data) else scenario.data
+    method = getattr(client, scenario.method)
+    if scenario.method == 'get':
+        response = client.get(scenario.url)
+    elif scenario.format == 'multipart':
+        response = method(scenario.url, data)
+    else:
+        response = method(scenario.url, data, content_type='application/json')
+    # Потоковый ответ (export-report) формируется при чтении
+    if getattr(response, 'streaming', False):
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+    return response, size
+
+
+def _run_once(client, scenario):
+    """Выполняет запрос; изменения откатываются"""
+    if scenario.method == 'get':
+        return _request(client, scenario)
+    with transaction.atomic():
+        result = _request(client, scenario)
+        transaction.set_rollback(True)
+    return result
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def measure(client, scenario, iterations=20, warmup=2):
+    for _ in range(warmup):
+        _run_once(client, scenario)
+
+    latencies = []
+    queries = []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response, size = _run_once(client, scenario)
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(len(ctx.captured_queries))
+
+    tracemalloc.start()
+    try:
+        _run_once(client, scenario)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'method': scenario.method.upper(),
+        'route': '/' + resolve(scenario.url.split('?')[0]).route,
+        'status': response.status_code,
+        'response_bytes': size,
+        'iterations': iterations,
+        'latency_ms': {
+            'min': round(min(latencies), 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p90': round(percentile(latencies, 90), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3),
+        },
+        'queries': {'min': min(queries), 'max': max(queries)},
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
+
+
+def url_routes():
+    """Шаблоны маршрутов проекта верхнего уровня (include - одним шаблоном)"""
+    return ['/' + str(pattern.pattern) for pattern in get_resolver().url_patterns]
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def run_benchmark(car, iterations=20, warmup=2, use_cache=False, dataset=None, only=None):
+    """Замеряет все сценарии для автомобиля и возвращает отчет (dict)"""
+    client = Client(HTTP_HOST='localhost')
+    client.force_login(car.user)
+    anonymous_client = Client(HTTP_HOST='localhost')
+    # Метрики доступны только staff; замер идет в откатываемой транзакции,
+    # поэтому временный пользователь не остается в базе
+    staff_client = Client(HTTP_HOST='localhost')
+    staff_client.force_login(User.objects.create_user(username=f'benchmark-staff-{car.pk}', is_staff=True))
+    # Клиент интеграции: токен API без сессии и CSRF
+    _, token_key = ApiToken.objects.issue(car.user, 'benchmark')
+    token_client = Client(HTTP_HOST='localhost', headers={'Authorization': f'Bearer {token_key}'})
+
+    # Данные сгенерированы в незафиксированной транзакции: отчет строится в
+    # потоке запроса, иначе поток пула их не увидит
+    overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'localhost'], 'REPORT_WORKERS': 0}
+    # Файлы отчетов фоновых заданий не остаются в MEDIA_ROOT
+    media_root = tempfile.TemporaryDirectory()
+    overrides['MEDIA_ROOT'] = media_root.name
+    if not use_cache:
+        # Без кэша ответов замеряется путь до базы данных
+        overrides['CACHES'] = {**settings.CACHES, BENCHMARK_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        overrides['API_CACHE_ALIAS'] = BENCHMARK_CACHE_ALIAS
+
+    results = {}
+    with media_root, override_settings(**overrides):
+        for scenario in build_scenarios(car):
+            if only and not any(scenario.name.startswith(name) for name in only):
+                continue
+            if scenario.anonymous:
+                scenario_client = anonymous_client
+            elif scenario.staff:
+                scenario_client = staff_client
+            elif scenario.token:
+                scenario_client = token_client
+            else:
+                scenario_client = client
+            results[scenario.name] = measure(scenario_client, scenario, iterations=iterations, warmup=warmup)
+
+    measured = {result['route'] for result in results.values()}
+    return {
+        'version': REPORT_VERSION,
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'response_cache': use_cache,
+            'only': only,
+            'iterations': iterations,
+            'dataset': dataset or {},
+        },
+        'routes': results,
+        'not_measured': sorted(route for route in url_routes() if route not in measured),
+    }
+
+
+def compare_reports(baseline, current, latency_threshold=LATENCY_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """Список регрессий current относительно baseline.
+
+    Регрессия - больше SQL-запросов, рост p95 задержки или пиковой памяти
+    больше порога (доля), изменившийся код ответа или маршрут, пропавший из
+    отчета (кроме не выбранных в current параметром only).
+    """
+    regressions = []
+    only = current['meta'].get('only')
+    for name, old in baseline['routes'].items():
+        new = current['routes'].get(name)
+        if new is None:
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            regressions.append({'route': name, 'metric': 'missing', 'baseline': None, 'current': None})
+            continue
+        if new['status'] != old['status']:
+            regressions.append({'route': name, 'metric': 'status', 'baseline': old['status'], 'current': new['status']})
+        if new['queries']['max'] > old['queries']['max']:
+            regressions.append({'route': name, 'metric': 'queries',
+                                'baseline': old['queries']['max'], 'current': new['queries']['max']})
+        old_p95, new_p95 = old['latency_ms']['p95'], new['latency_ms']['p95']
+        if new_p95 - old_p95 > LATENCY_NOISE_MS and new_p95 > old_p95 * (1 + latency_threshold):
+            regressions.append({'route': name, 'metric': 'latency_p95_ms', 'baseline': old_p95, 'current': new_p95})
+        old_memory, new_memory = old['peak_memory_kb'], new['peak_memory_kb']
+        if new_memory > old_memory * (1 + memory_threshold):
+            regressions.append({'route': name, 'metric': 'peak_memory_kb', 'baseline': old_memory, 'current': new_memory})
+    return regressions
+
+
+def server_benchmark_urls(car):
+    """Смесь GET-запросов для сравнения WSGI и ASGI"""
+    record = car.repair_records.order_by('-date', '-created_at').first()
+    first_date = car.repair_records.order_by('date').values_list('date', flat=True).first()
+    period = f'date_from={first_date.isoformat()}&date_to={record.date.isoformat()}'
+    return [
+        reverse('car-list'),
+        reverse('repair-record-list', args=[car.pk]) + '?page_size=50',
+        reverse('repair-record-list', args=[car.pk]),
+        reverse('repair-record-detail', args=[car.pk, record.pk]),
+        reverse('stock-part-list', args=[car.pk]),
+        reverse('car-stats', args=[car.pk]) + f'?{period}',
+        reverse('export-report', args=[car.pk]) + f'?{period}',
+    ]
+
+
+def session_cookie(user):
+    client = Client()
+    client.force_login(user)
+    return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+
+def _wsgi_get(app, url, cookie):
+    path, _, query = url.partition('?')
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update({
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'HTTP_HOST': 'localhost', 'HTTP_COOKIE': cookie,
+    })
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split()[0]))
+
+    start = time.perf_counter()
+    result = app(environ, start_response)
+    try:
+        for _ in result:
+            pass
+    finally:
+        # Закрытие ответа отправляет request_finished (закрытие соединений с БД)
+        if hasattr(result, 'close'):
+            result.close()
+    return statuses[0], (time.perf_counter() - start) * 1000
+
+
+async def _asgi_get(app, url, cookie):
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+    }
+    body_sent = False
+    finished = asyncio.Event()
+    statuses = []
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Клиент не отключается, пока не получит ответ целиком
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            finished.set()
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return statuses[0], (time.perf_counter() - start) * 1000
+
+
+def _server_result(mode, concurrency, elapsed, results):
+    latencies = [latency for _, latency in results]
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests': len(results),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(results) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3),
+        },
+        'statuses': {str(code): count for code, count in sorted(Counter(code for code, _ in results).items())},
+    }
+
+
+def benchmark_wsgi(urls, cookie, requests, workers):
+    """Один WSGI-процесс с workers потоками (как gunicorn --threads)"""
+    app = WSGIHandler()
+    plan = [urls[n % len(urls)] for n in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda url: _wsgi_get(app, url, cookie), plan))
+    return _server_result('wsgi', workers, time.perf_counter() - start, results)
+
+
+def benchmark_asgi(urls, cookie, requests, concurrency):
+    """Один ASGI-процесс: concurrency одновременных запросов в одном цикле событий"""
+    app = ASGIHandler()
+    plan = [urls[n % len(urls)] for n in range(requests)]
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(url):
+            async with semaphore:
+                return await _asgi_get(app, url, cookie)
+
+        return await asyncio.gather(*(limited(url) for url in plan))
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    return _server_result('asgi', concurrency, time.perf_counter() - start, results)
+
+
+def run_server_benchmark(car, requests=200, concurrency=20, wsgi_workers=4, use_cache=False, dataset=None):
+    """Сравнивает пропускную способность WSGI и ASGI на одной смеси запросов"""
+    urls = server_benchmark_urls(car)
+    cookie = session_cookie(car.user)
+
+    overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'localhost']}
+    if not use_cache:
+        overrides['CACHES'] = {**settings.CACHES, BENCHMARK_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        overrides['API_CACHE_ALIAS'] = BENCHMARK_CACHE_ALIAS
+
+    with override_settings(**overrides):
+        # Прогрев: импорт модулей, первые соединения
+        benchmark_wsgi(urls, cookie, len(urls), 1)
+        wsgi = benchmark_wsgi(urls, cookie, requests, wsgi_workers)
+        asgi = benchmark_asgi(urls, cookie, requests, concurrency)
+
+    return {
+        'version': REPORT_VERSION,
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'response_cache': use_cache,
+            'report_workers': settings.REPORT_WORKERS,
+            'dataset': dataset or {},
+        },
+        'urls': urls,
+        'wsgi': wsgi,
+        'asgi': asgi,
+        'asgi_to_wsgi_throughput': round(asgi['throughput_rps'] / wsgi['throughput_rps'], 2),
+    }
+
+
+def serialization_cases(car):
+    """Списки API для сравнения сериализации: (имя, queryset, сериализатор),
+    queryset - как в представлениях async_views.py"""
+    cars = Car.objects.filter(user_id=car.user_id)
+    return [
+        ('cars', cars, CarSerializer),
+        ('cars:with_summary', with_summary(cars), CarWithSummarySerializer),
+        ('repairs', RepairRecord.objects.filter(car=car).prefetch_related(prefetch_parts()), RepairRecordSerializer),
+        ('stock', StockPart.objects.filter(car=car).select_related('catalog'), StockPartSerializer),
+    ]
+
+
+def render_models(queryset, serializer_class):
+    """Прежний путь: экземпляры моделей и JSONRenderer DRF"""
+    return JSONRenderer().render(serializer_class(list(queryset), many=True).data)
+
+
+def render_rows(queryset, serializer_class):
+    """Быстрый путь list_response: строки .values() и render_json"""
+    row_serializer = RowSerializer.for_queryset(serializer_class, queryset)
+    return render_json(row_serializer.serialize(list(row_serializer.values(queryset))))
+
+
+def _best_time(render, queryset, serializer_class, iterations):
+    best = None
+    content = None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        content = render(queryset, serializer_class)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, content
+
+
+def run_serialization_benchmark(car, iterations=3, dataset=None):
+    """Строк в секунду на прежнем и быстром пути для списков пользователя и
+    автомобиля car (лучшее время из iterations, вместе с чтением из БД)"""
+    results = {}
+    for name, queryset, serializer_class in serialization_cases(car):
+        rows = queryset.count()
+        before, expected = _best_time(render_models, queryset, serializer_class, iterations)
+        after, content = _best_time(render_rows, queryset, serializer_class, iterations)
+        results[name] = {
+            'rows': rows,
+            'response_kb': round(len(content) / 1024, 1),
+            'before_rows_per_s': round(rows / before) if before else None,
+            'after_rows_per_s': round(rows / after) if after else None,
+            'speedup': round(before / after, 2) if after else None,
+            'identical': content == expected,
+        }
+    return {
+        'version': REPORT_VERSION,
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': iterations,
+            'dataset': dataset or {},
+        },
+        'lists': results,
+    }
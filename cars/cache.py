@@ -0,0 +1,178 @@
+"""Кэширование ответов API с поддержкой ETag
+
+Ответы списков хранятся в кэше settings.API_CACHE_ALIAS с ключом по
+пользователю, представлению и строке запроса. В ключ входит "версия" области
+данных: пользователя (список автомобилей) или автомобиля (ремонты, склад,
+статистика). Изменения ремонтов и склада меняют обе версии, потому что список
+автомобилей может содержать итоги по ним. При изменении данных сигналы
+моделей (см. signals.py) меняют версию, и все прежние ключи этой области
+перестают использоваться - удалять каждый вариант ответа (fields, cursor,
+период) не нужно.
+
+Версия меняется сразу и еще раз после фиксации транзакции: ответ, собранный
+по незафиксированному состоянию, не переживет коммит.
+
+Ответы кэшируются только при settings.API_CACHE_ENABLED (по умолчанию - с
+общим кэшем, SHARED_CACHE): версии в кэше процесса меняет только тот процесс,
+где изменены данные. Без кэша ответов ETag считается по собранному ответу, и
+If-None-Match по-прежнему получает 304.
+"""
+import functools
+import hashlib
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from rest_framework import status
+
+from .models import Car
+
+
+def get_cache():
+    return caches[getattr(settings, 'API_CACHE_ALIAS', 'default')]
+
+
+def caching_enabled():
+    return getattr(settings, 'API_CACHE_ENABLED', False)
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def car_scope(car_id):
+    return f'car:{car_id}'
+
+
+def _version_key(scope):
+    return f'api-version:{scope}'
+
+
+def get_version(scope):
+    cache = get_cache()
+    version = cache.get(_version_key(scope))
+    if version is None:
+        # Версии уникальны, поэтому вытесненная из кэша версия не может
+        # снова открыть доступ к старым записям
+        version = uuid.uuid4().hex
+        cache.add(_version_key(scope), version, timeout=None)
+        # Если другой процесс успел записать свою версию, используем ее
+        version = cache.get(_version_key(scope)) or version
+    return version
+
+
+def _bump(scopes):
+    cache = get_cache()
+    cache.set_many({_version_key(scope): uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+
+def invalidate(*scopes):
+    """Сбрасывает закэшированные ответы для областей данных"""
+    if not caching_enabled():
+        return
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def _owner_key(car_id):
+    return f'api-car-owner:{car_id}'
+
+
+def car_owner(car_id):
+    """ID владельца автомобиля. Хранится в кэше, чтобы сброс ответов при
+    изменении ремонтов и склада не требовал запроса к БД."""
+    cache = get_cache()
+    user_id = cache.get(_owner_key(car_id))
+    if user_id is None:
+        # С автомобилями, удаляемыми в фоне: их кэш тоже сбрасывается
+        user_id = Car.all_objects.filter(pk=car_id).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            cache.set(_owner_key(car_id), user_id, timeout=None)
+    return user_id
+
+
+def invalidate_car(car_id, user_id=None):
+    """Сбрасывает ответы по автомобилю и списку автомобилей владельца: в
+    списке с ?with_summary=1 есть итоги по ремонтам и складу"""
+    if user_id is not None:
+        # Владелец нужен и без кэша ответов: его берет sync.py
+        get_cache().set(_owner_key(car_id), user_id, timeout=None)
+    if not caching_enabled():
+        return
+    if user_id is None:
+        user_id = car_owner(car_id)
+    scopes = [car_scope(car_id)]
+    if user_id is not None:
+        scopes.append(user_scope(user_id))
+    invalidate(*scopes)
+
+
+def _response_key(request, view_name, user_id, scopes):
+    versions = ':'.join(get_version(scope) for scope in scopes)
+    location = hashlib.md5(f'{request.get_host()}{request.get_full_path()}'.encode('utf-8')).hexdigest()
+    return f'api-response:{view_name}:{user_id}:{versions}:{location}'
+
+
+def _lookup(request, view_name, user_id, scopes):
+    key = _response_key(request, view_name, user_id, scopes)
+    return key, get_cache().get(key)
+
+
+def _store(key, etag, content):
+    get_cache().set(key, (etag, content), getattr(settings, 'API_CACHE_TIMEOUT', 300))
+
+
+def _etag(content):
+    return '"%s"' % hashlib.md5(content).hexdigest()
+
+
+def _etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    return header.strip() == '*' or etag in [tag.strip() for tag in header.split(',')]
+
+
+def cached_api_response(scope):
+    """Кэширует успешные JSON-ответы асинхронного представления чтения
+    (async_views.py) и отвечает 304 по If-None-Match.
+
+    scope='user' - ответ зависит от автомобилей пользователя,
+    scope='car' - от данных автомобиля kwargs['car_id'].
+    Представление вызывается как view(request, user, ...) уже после
+    аутентификации. В кэше хранится готовое тело ответа; обращения к кэшу
+    выполняются одним вызовом sync_to_async на чтение и одним на запись.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, user, *args, **kwargs):
+            if scope == 'user':
+                scopes = [user_scope(user.pk)]
+            else:
+                scopes = [car_scope(kwargs['car_id'])]
+            key = cached = None
+            if caching_enabled():
+                key, cached = await sync_to_async(_lookup)(request, view.__name__, user.pk, scopes)
+            if cached is None:
+                response = await view(request, user, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                etag = _etag(response.content)
+                if key is not None:
+                    await sync_to_async(_store)(key, etag, response.content)
+            else:
+                etag, content = cached
+                response = HttpResponse(content, content_type='application/json')
+
+            if _etag_matches(request, etag):
+                response = HttpResponseNotModified()
+            response['ETag'] = etag
+            # Браузер хранит ответ, но каждый раз сверяет его по ETag
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,156 @@
+"""Удаление автомобилей и пользователей с большой историей
+
+car.delete() собирает каскад через Collector: из-за сигналов post_delete
+(кэш, поиск, итоги, синхронизация) каждая запись о ремонте, запчасть и
+запчасть на складе загружается в память и удаляется отдельно, а SQLite всё
+это время держит блокировку записи.
+
+Здесь история удаляется пакетами: записи о ремонте по DELETE_BATCH_SIZE
+вместе с их запчастями и строками поискового индекса, затем склад - каждый
+пакет в своей короткой транзакции прямым DELETE без загрузки объектов.
+Сигналы для этих строк не отправляются, их действие выполняется один раз на
+автомобиль:
+- автомобиль сразу скрывается (Car.deleting_since, Car.objects его не видит)
+  и сбрасывается кэш ответов - частично удаленная история не видна;
+- итоги (CarRollup, CarMonthRollup) удаляются вместе с автомобилем;
+- клиентам синхронизации достаточно отметки об удалении автомобиля.
+В конце car.delete() удаляет сам автомобиль и то, что осталось (задания на
+отчеты с файлами, строки, добавленные во время удаления), с обычными
+сигналами.
+
+Удаление с историей больше settings.CAR_DELETE_BACKGROUND_ROWS строк
+выполняется в фоне: пул потоков веб-процесса (REPORT_WORKERS) или
+manage.py report_worker, который подбирает и скрытые автомобили, оставшиеся
+после перезапуска.
+"""
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sync
+from .cache import invalidate_car
+from .models import Car, Part, RepairRecord, SearchEntry, StockPart
+from .reports import report_executor
+
+# Записей о ремонте (вместе с их запчастями) или запчастей на складе в
+# одной транзакции удаления
+DELETE_BATCH_SIZE = 500
+
+
+def history_size(car):
+    """Строк истории автомобиля: записи о ремонте, запчасти, склад"""
+    return (
+        RepairRecord.objects.filter(car=car).count()
+        + Part.objects.filter(repair_record__car=car).count()
+        + StockPart.objects.filter(car=car).count()
+    )
+
+
+def hide_car(car):
+    """Скрывает автомобиль до удаления истории"""
+    if car.deleting_since is None:
+        car.deleting_since = timezone.now()
+        Car.all_objects.filter(pk=car.pk).update(deleting_since=car.deleting_since)
+    invalidate_car(car.pk, car.user_id)
+
+
+def _raw_delete(queryset):
+    # DELETE без загрузки объектов и без сигналов (см. описание модуля)
+    return queryset._raw_delete(queryset.db)
+
+
+def delete_history(car_id, batch_size=DELETE_BATCH_SIZE):
+    """Удаляет записи о ремонте, запчасти и склад автомобиля пакетами;
+    возвращает число удаленных строк (без строк поискового индекса)"""
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            record_ids = list(RepairRecord.objects.filter(car_id=car_id).values_list('pk', flat=True)[:batch_size])
+            if not record_ids:
+                break
+            _raw_delete(SearchEntry.objects.filter(Q(repair_record_id__in=record_ids) | Q(part__repair_record_id__in=record_ids)))
+            deleted += _raw_delete(Part.objects.filter(repair_record_id__in=record_ids))
+            deleted += _raw_delete(RepairRecord.objects.filter(pk__in=record_ids))
+    while True:
+        with transaction.atomic():
+            stock_ids = list(StockPart.objects.filter(car_id=car_id).values_list('pk', flat=True)[:batch_size])
+            if not stock_ids:
+                break
+            _raw_delete(SearchEntry.objects.filter(stock_part_id__in=stock_ids))
+            deleted += _raw_delete(StockPart.objects.filter(pk__in=stock_ids))
+    return deleted
+
+
+def delete_car(car, batch_size=DELETE_BATCH_SIZE):
+    """Удаляет автомобиль с историей пакетами (см. описание модуля)"""
+    hide_car(car)
+    delete_history(car.pk, batch_size)
+    with transaction.atomic(), sync.batch():
+        car.delete()
+
+
+def schedule_car_deletion(car):
+    """Скрывает автомобиль сразу, удаляет в фоне после фиксации транзакции"""
+    hide_car(car)
+    car_id = car.pk
+    transaction.on_commit(lambda: enqueue_car_deletion(car_id))
+
+
+def enqueue_car_deletion(car_id):
+    """Передает удаление пулу потоков веб-процесса (при REPORT_WORKERS > 0);
+    иначе его выполнит manage.py report_worker"""
+    if settings.REPORT_WORKERS:
+        report_executor().submit(_delete_in_worker, car_id)
+
+
+def _delete_in_worker(car_id):
+    close_old_connections()
+    try:
+        delete_hidden_car(car_id)
+    finally:
+        close_old_connections()
+
+
+def delete_hidden_car(car_id):
+    """Удаляет скрытый автомобиль; False - если его уже удалил другой воркер"""
+    car = Car.all_objects.filter(pk=car_id, deleting_since__isnull=False).first()
+    if car is None:
+        return False
+    delete_car(car)
+    return True
+
+
+def delete_hidden_cars():
+    """Удаляет все скрытые автомобили (в том числе оставшиеся после
+    перезапуска); возвращает их число"""
+    car_ids = Car.all_objects.filter(deleting_since__isnull=False).order_by('deleting_since').values_list('pk', flat=True)
+    return sum(delete_hidden_car(car_id) for car_id in list(car_ids))
+
+
+def delete_car_on_commit(car):
+    """Скрывает автомобиль сразу, а удаляет после фиксации текущей
+    транзакции. Внутри transaction.atomic (админка) пакеты delete_car() были
+    бы точками сохранения одной транзакции, и блокировка записи держалась бы
+    до конца удаления."""
+    hide_car(car)
+    transaction.on_commit(lambda: delete_car(car))
+
+
+def delete_user(user, batch_size=DELETE_BATCH_SIZE):
+    """Удаляет пользователя со всеми автомобилями: автомобили скрываются,
+    их история удаляется пакетами, остальное - user.delete()"""
+    cars = list(Car.all_objects.filter(user=user))
+    for car in cars:
+        hide_car(car)
+    for car in cars:
+        delete_history(car.pk, batch_size)
+    with transaction.atomic(), sync.batch():
+        user.delete()
+
+
+def delete_user_on_commit(user):
+    """delete_car_on_commit() для пользователя со всеми автомобилями"""
+    for car in Car.all_objects.filter(user=user):
+        hide_car(car)
+    transaction.on_commit(lambda: delete_user(user))
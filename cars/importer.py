@@ -0,0 +1,252 @@
+"""Массовый импорт истории ремонтов из CSV/XLSX
+
+Файл читается построчно (csv или openpyxl в режиме read_only), каждая строка
+проверяется правилами RepairRecordSerializer/PartSerializer, а записи и
+запчасти вставляются пачками через bulk_create, каждая пачка - в своей
+транзакции. Память не зависит от размера файла.
+
+Формат: первая строка - заголовок. Строка с заполненными полями ремонта
+(дата, пробег, работы, стоимость работ) начинает новую запись о ремонте;
+поля запчасти в той же строке добавляют к ней запчасть. Строка с пустыми
+полями ремонта добавляет еще одну запчасть к предыдущей записи.
+"""
+import csv
+import io
+from datetime import date, datetime
+
+from django.db import transaction
+from openpyxl import load_workbook
+from rest_framework import serializers
+
+from .cache import invalidate_car
+from .models import RepairRecord, Part, PartCatalog
+from .rollups import rollup_new_objects
+from .search import index_new_objects
+from .serializers import RepairRecordSerializer, PartSerializer
+
+IMPORT_BATCH_SIZE = 1000
+
+# Сколько ошибок возвращать в отчете (общее количество считается всегда)
+MAX_REPORTED_ERRORS = 1000
+
+RECORD_COLUMNS = ['date', 'mileage', 'work_description', 'work_cost']
+PART_COLUMNS = ['name', 'part_code', 'manufacturer', 'quantity', 'cost']
+
+# Допустимые заголовки колонок -> поле
+HEADER_ALIASES = {
+    'date': 'date',
+    'дата': 'date',
+    'mileage': 'mileage',
+    'пробег': 'mileage',
+    'пробег (км)': 'mileage',
+    'work_description': 'work_description',
+    'выполненные работы': 'work_description',
+    'work_cost': 'work_cost',
+    'стоимость работ': 'work_cost',
+    'part_name': 'name',
+    'наименование': 'name',
+    'part_code': 'part_code',
+    'код детали': 'part_code',
+    'manufacturer': 'manufacturer',
+    'производитель': 'manufacturer',
+    'quantity': 'quantity',
+    'количество': 'quantity',
+    'part_cost': 'cost',
+    'cost': 'cost',
+    'стоимость за единицу': 'cost',
+}
+
+DECIMAL_COLUMNS = {'work_cost', 'cost'}
+
+
+class ImportFormatError(Exception):
+    """Файл не удается разобрать (неизвестный формат или заголовок)"""
+
+
+def _normalize_header(header):
+    columns = []
+    for title in header:
+        key = str(title).strip().lower() if title is not None else ''
+        columns.append(HEADER_ALIASES.get(key))
+    missing = [column for column in RECORD_COLUMNS if column not in columns]
+    if missing:
+        raise ImportFormatError(f"В заголовке нет обязательных колонок: {', '.join(missing)}")
+    return columns
+
+
+def _normalize_value(column, value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if value is None:
+        return ''
+    value = str(value).strip()
+    if column == 'date' and value.count('.') == 2:
+        # Формат ДД.ММ.ГГГГ, как в отчетах
+        try:
+            return datetime.strptime(value, '%d.%m.%Y').date().isoformat()
+        except ValueError:
+            return value
+    if column in DECIMAL_COLUMNS:
+        return value.replace(' ', '').replace('\xa0', '').replace(',', '.')
+    return value
+
+
+def _rows_from_table(table_rows):
+    """(номер строки, {поле: значение}) для строк таблицы с заголовком"""
+    table_rows = iter(table_rows)
+    try:
+        header = next(table_rows)
+    except StopIteration:
+        raise ImportFormatError("Файл пуст")
+    columns = _normalize_header(header)
+    for row_number, values in enumerate(table_rows, start=2):
+        row = {}
+        for column, value in zip(columns, values):
+            if column is not None:
+                row[column] = _normalize_value(column, value)
+        if any(row.values()):
+            yield row_number, row
+
+
+def _iter_csv(file):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    try:
+        yield from _rows_from_table(csv.reader(text, dialect))
+    finally:
+        # Не даем обертке закрыть исходный файл
+        text.detach()
+
+
+def _iter_xlsx(file):
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from _rows_from_table(wb.worksheets[0].iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def iter_import_rows(file, filename):
+    """Построчно читает CSV или XLSX (по расширению файла)"""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return _iter_csv(file)
+    if name.endswith('.xlsx'):
+        return _iter_xlsx(file)
+    raise ImportFormatError("Поддерживаются только файлы .csv и .xlsx")
+
+
+class HistoryImporter:
+    """Проверяет строки и пачками сохраняет записи о ремонте и запчасти"""
+
+    def __init__(self, car, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+        self.car = car
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        # Один экземпляр сериализатора на весь импорт: поля строятся один раз
+        self.record_serializer = RepairRecordSerializer()
+        self.part_serializer = PartSerializer()
+        self.rows_processed = 0
+        self.records_created = 0
+        self.parts_created = 0
+        self.errors_count = 0
+        self.errors = []
+        self._batch = []
+
+    def add_error(self, row_number, errors):
+        self.errors_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def validate(self, serializer, row, columns):
+        data = {column: row[column] for column in columns if row.get(column, '') != ''}
+        try:
+            return serializer.run_validation(data), None
+        except serializers.ValidationError as e:
+            return None, e.detail
+
+    def process(self, rows):
+        current = None  # (запись, список запчастей) или None, если запись с ошибкой
+        current_row = None
+        for row_number, row in rows:
+            self.rows_processed += 1
+            has_record = any(row.get(column) for column in RECORD_COLUMNS)
+            has_part = any(row.get(column) for column in PART_COLUMNS)
+
+            if has_record:
+                current_row = row_number
+                record_data, errors = self.validate(self.record_serializer, row, RECORD_COLUMNS)
+                if errors:
+                    self.add_error(row_number, errors)
+                    current = None
+                    continue
+                current = (RepairRecord(car=self.car, **record_data), [])
+                self._batch.append(current)
+                if len(self._batch) > self.batch_size:
+                    # Последняя запись может еще получить запчасти из следующих строк
+                    self.flush(keep_last=True)
+            elif current is None:
+                if current_row is None:
+                    self.add_error(row_number, {'non_field_errors': ['Запчасть указана без записи о ремонте']})
+                else:
+                    self.add_error(row_number, {'non_field_errors': [f'Запись о ремонте в строке {current_row} содержит ошибки']})
+                continue
+
+            if has_part:
+                part_data, errors = self.validate(self.part_serializer, row, PART_COLUMNS)
+                if errors:
+                    self.add_error(row_number, errors)
+                    continue
+                current[1].append(Part(**part_data))
+
+        self.flush()
+        return self.result()
+
+    def flush(self, keep_last=False):
+        batch = self._batch[:-1] if keep_last else self._batch
+        self._batch = self._batch[-1:] if keep_last else []
+        if not batch:
+            return
+        if not self.dry_run:
+            with transaction.atomic():
+                records = RepairRecord.objects.bulk_create([record for record, _ in batch])
+                parts = []
+                for record, (_, record_parts) in zip(records, batch):
+                    for part in record_parts:
+                        part.repair_record = record
+                        parts.append(part)
+                PartCatalog.objects.assign(parts)
+                Part.objects.bulk_create(parts, batch_size=self.batch_size)
+                # bulk_create не отправляет post_save
+                index_new_objects(records, batch_size=self.batch_size)
+                index_new_objects(parts, batch_size=self.batch_size)
+                rollup_new_objects(records, parts)
+                invalidate_car(self.car.pk)
+        self.records_created += len(batch)
+        self.parts_created += sum(len(record_parts) for _, record_parts in batch)
+
+    def result(self):
+        return {
+            'dry_run': self.dry_run,
+            'rows_processed': self.rows_processed,
+            'records_created': self.records_created,
+            'parts_created': self.parts_created,
+            'errors_count': self.errors_count,
+            'errors': self.errors,
+        }
+
+
+def import_history(car, file, filename, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+    """Импортирует историю ремонтов автомобиля из файла; возвращает отчет.
+
+    ImportFormatError - если файл не удается разобрать.
+    """
+    importer = HistoryImporter(car, batch_size=batch_size, dry_run=dry_run)
+    return importer.process(iter_import_rows(file, filename))
@@ -0,0 +1,149 @@
+"""Фоновое построение отчетов Excel
+
+Очередь хранится в БД (модель ReportJob), внешний брокер не нужен. Задание
+захватывается условным UPDATE (status pending -> running), поэтому одно
+задание не выполнят два воркера, в каком бы процессе они ни работали.
+
+Воркеры:
+- пул потоков веб-процесса (reports.report_executor): новое задание
+  отправляется туда после фиксации транзакции, если REPORT_WORKERS > 0;
+- команда manage.py report_worker - отдельный процесс, который также
+  подбирает задания, оставшиеся после перезапуска.
+
+Одинаковые запросы (автомобиль, период) при неизменных данных обслуживает
+одно задание: в задании хранится версия данных автомобиля (car_data_version),
+которую меняет любое изменение записей и запчастей. Версия считается по БД, а
+не берется из кэша ответов: кэш процесса у каждого процесса свой.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Part, RepairRecord, ReportJob
+from .reports import build_repair_report, report_executor, report_filename
+
+ACTIVE_STATUSES = [ReportJob.STATUS_PENDING, ReportJob.STATUS_RUNNING, ReportJob.STATUS_DONE]
+
+
+def car_data_version(car):
+    """Версия данных автомобиля для отчета: число и время последнего
+    изменения (updated_at) записей о ремонте и запчастей. Добавление,
+    изменение и удаление меняют версию в любом процессе."""
+    records = RepairRecord.objects.filter(car_id=car.pk).aggregate(count=Count('pk'), changed=Max('updated_at'))
+    parts = Part.objects.filter(repair_record__car_id=car.pk).aggregate(count=Count('pk'), changed=Max('updated_at'))
+    state = repr((car.updated_at, sorted(records.items()), sorted(parts.items())))
+    return hashlib.md5(state.encode('utf-8')).hexdigest()
+
+
+def get_or_create_report_job(car, date_from, date_to):
+    """Задание на отчет за период; возвращает (job, created).
+
+    Если для текущей версии данных задание уже есть (в очереди, выполняется
+    или готово), возвращается оно.
+    """
+    data_version = car_data_version(car)
+    lookup = {'car': car, 'date_from': date_from, 'date_to': date_to, 'data_version': data_version}
+    job = ReportJob.objects.filter(status__in=ACTIVE_STATUSES, **lookup).first()
+    if job is not None:
+        return job, False
+    try:
+        with transaction.atomic():
+            job = ReportJob.objects.create(**lookup)
+    except IntegrityError:
+        # Такое же задание только что создал параллельный запрос
+        return ReportJob.objects.get(status__in=ACTIVE_STATUSES, **lookup), False
+    transaction.on_commit(lambda: enqueue_report_job(job.pk))
+    return job, True
+
+
+def enqueue_report_job(job_id):
+    """Передает задание пулу потоков веб-процесса (при REPORT_WORKERS > 0)"""
+    if settings.REPORT_WORKERS:
+        report_executor().submit(_process_in_worker, job_id)
+
+
+def _process_in_worker(job_id):
+    close_old_connections()
+    try:
+        process_report_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def claim_job(job_id):
+    """Переводит задание в running; False - если его уже захватил другой воркер"""
+    return ReportJob.objects.filter(pk=job_id, status=ReportJob.STATUS_PENDING).update(
+        status=ReportJob.STATUS_RUNNING, started_at=timezone.now(),
+    ) == 1
+
+
+def process_report_job(job_id):
+    """Захватывает и выполняет задание; возвращает его или None, если захватить не удалось"""
+    if not claim_job(job_id):
+        return None
+    job = ReportJob.objects.select_related('car').get(pk=job_id)
+    try:
+        output = build_repair_report(job.car, job.date_from, job.date_to)
+        try:
+            job.file.save(report_filename(job.car, job.date_from, job.date_to), File(output), save=False)
+        finally:
+            output.close()
+    except Exception as e:
+        ReportJob.objects.filter(pk=job.pk).update(
+            status=ReportJob.STATUS_FAILED, error=str(e), finished_at=timezone.now(),
+        )
+        job.refresh_from_db()
+        return job
+
+    updated = ReportJob.objects.filter(pk=job.pk, status=ReportJob.STATUS_RUNNING).update(
+        status=ReportJob.STATUS_DONE, file=job.file.name, finished_at=timezone.now(),
+    )
+    if not updated:
+        # Задание вернули в очередь (например, по таймауту) - файл не нужен
+        job.file.delete(save=False)
+    job.refresh_from_db()
+    return job
+
+
+def process_next_job():
+    """Выполняет старейшее задание из очереди; None - если очередь пуста"""
+    while True:
+        job_id = (
+            ReportJob.objects
+            .filter(status=ReportJob.STATUS_PENDING)
+            .order_by('created_at')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        job = process_report_job(job_id)
+        if job is not None:
+            return job
+        # Задание захватил другой воркер - берем следующее
+
+
+def requeue_stuck_jobs(timeout=None):
+    """Возвращает в очередь задания, которые выполняются дольше таймаута
+    (воркер был остановлен посреди работы)"""
+    timeout = timeout if timeout is not None else settings.REPORT_JOB_TIMEOUT
+    return ReportJob.objects.filter(
+        status=ReportJob.STATUS_RUNNING,
+        started_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=ReportJob.STATUS_PENDING, started_at=None)
+
+
+def purge_report_jobs(max_age=None):
+    """Удаляет завершенные задания старше max_age секунд (файлы удаляет
+    сигнал post_delete)"""
+    max_age = max_age if max_age is not None else settings.REPORT_JOB_MAX_AGE
+    jobs = ReportJob.objects.filter(
+        status__in=[ReportJob.STATUS_DONE, ReportJob.STATUS_FAILED],
+        finished_at__lt=timezone.now() - timedelta(seconds=max_age),
+    )
+    return jobs.delete()[0]
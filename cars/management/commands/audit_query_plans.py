@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cars.query_audit import analyze, audit_car, audit_query_plans
+from cars.seeding import seed_garage
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Проверяет планы запросов API (EXPLAIN) и завершается с ошибкой при полном просмотре таблиц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--existing', action='store_true',
+                            help='Проверить на существующих данных вместо сгенерированных')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--cars', type=int, default=5, help='Автомобилей на пользователя')
+        parser.add_argument('--repairs', type=int, default=500, help='Записей о ремонте на автомобиль')
+        parser.add_argument('--parts', type=int, default=3, help='Запчастей на запись о ремонте')
+
+    def handle(self, *args, **options):
+        if options['existing']:
+            car = audit_car()
+            if car is None:
+                raise CommandError('В базе нет автомобилей')
+            problems = audit_query_plans(car)
+        else:
+            # Сгенерированные данные откатываются вместе с транзакцией
+            try:
+                with transaction.atomic():
+                    users = seed_garage(
+                        users=options['users'],
+                        cars_per_user=options['cars'],
+                        repairs_per_car=options['repairs'],
+                        parts_per_repair=options['parts'],
+                    )
+                    analyze()
+                    problems = audit_query_plans(users[0].cars.first())
+                    raise Rollback
+            except Rollback:
+                pass
+
+        for problem in problems:
+            self.stderr.write(f"[{problem['route']}] {problem['url']}: полный просмотр {', '.join(problem['tables'])}")
+            self.stderr.write(f"  {problem['sql']}")
+            for line in problem['plan']:
+                self.stderr.write(f"    {line}")
+        if problems:
+            raise CommandError(f'Запросов с полным просмотром таблиц: {len(problems)}')
+        self.stdout.write(self.style.SUCCESS('Полных просмотров таблиц не найдено'))
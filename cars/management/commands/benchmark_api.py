@@ -0,0 +1,114 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cars.benchmark import LATENCY_THRESHOLD, MEMORY_THRESHOLD, compare_reports, run_benchmark
+from cars.query_audit import analyze, audit_car
+from cars.seeding import seed_garage
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержку, число SQL-запросов и память для всех маршрутов API и сохраняет JSON-отчет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--existing', action='store_true',
+                            help='Замерить на существующих данных вместо сгенерированных')
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--cars', type=int, default=3, help='Автомобилей на пользователя')
+        parser.add_argument('--repairs', type=int, default=300, help='Записей о ремонте на автомобиль')
+        parser.add_argument('--parts', type=int, default=3, help='Запчастей на запись о ремонте')
+        parser.add_argument('--stock', type=int, default=20, help='Запчастей на складе автомобиля')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора данных')
+        parser.add_argument('--iterations', type=int, default=20, help='Повторов каждого запроса')
+        parser.add_argument('--warmup', type=int, default=2, help='Прогревочных повторов (не учитываются)')
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Замерить только сценарии с этим префиксом (можно несколько)')
+        parser.add_argument('--with-cache', action='store_true', help='Не отключать кэш ответов API')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию - вывод в консоль)')
+        parser.add_argument('--compare', help='JSON-отчет для сравнения; при регрессиях команда завершается с ошибкой')
+        parser.add_argument('--latency-threshold', type=float, default=LATENCY_THRESHOLD,
+                            help='Допустимый рост p95 задержки (доля)')
+        parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD,
+                            help='Допустимый рост пиковой памяти (доля)')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должен быть не меньше 1')
+        benchmark_options = {
+            'iterations': options['iterations'],
+            'warmup': options['warmup'],
+            'use_cache': options['with_cache'],
+            'only': options['routes'],
+        }
+
+        if options['existing']:
+            car = audit_car()
+            if car is None:
+                raise CommandError('В базе нет автомобилей')
+            # Изменяющие запросы откатываются, данные не меняются
+            with transaction.atomic():
+                report = run_benchmark(car, dataset={'existing': True}, **benchmark_options)
+                transaction.set_rollback(True)
+        else:
+            dataset = {
+                'users': options['users'],
+                'cars_per_user': options['cars'],
+                'repairs_per_car': options['repairs'],
+                'parts_per_repair': options['parts'],
+                'stock_parts_per_car': options['stock'],
+                'seed': options['seed'],
+            }
+            # Сгенерированные данные откатываются вместе с транзакцией
+            try:
+                with transaction.atomic():
+                    users = seed_garage(
+                        users=dataset['users'],
+                        cars_per_user=dataset['cars_per_user'],
+                        repairs_per_car=dataset['repairs_per_car'],
+                        parts_per_repair=dataset['parts_per_repair'],
+                        stock_parts_per_car=dataset['stock_parts_per_car'],
+                        seed=dataset['seed'],
+                    )
+                    analyze()
+                    report = run_benchmark(users[0].cars.first(), dataset=dataset, **benchmark_options)
+                    raise Rollback
+            except Rollback:
+                pass
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(content)
+            self.print_summary(report)
+        else:
+            self.stdout.write(content)
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            if baseline['meta'].get('dataset') != report['meta']['dataset']:
+                self.stderr.write(self.style.WARNING('Отчеты получены на разных наборах данных'))
+            regressions = compare_reports(baseline, report, latency_threshold=options['latency_threshold'],
+                                          memory_threshold=options['memory_threshold'])
+            for regression in regressions:
+                self.stderr.write(
+                    f"[{regression['route']}] {regression['metric']}: {regression['baseline']} -> {regression['current']}"
+                )
+            if regressions:
+                raise CommandError(f'Регрессий: {len(regressions)}')
+            self.stdout.write(self.style.SUCCESS('Регрессий не найдено'))
+
+    def print_summary(self, report):
+        self.stdout.write(f"{'сценарий':<32} {'код':>4} {'p50 мс':>9} {'p95 мс':>9} {'запросов':>9} {'память КБ':>10}")
+        for name, result in report['routes'].items():
+            self.stdout.write(
+                f"{name:<32} {result['status']:>4} {result['latency_ms']['p50']:>9.2f} "
+                f"{result['latency_ms']['p95']:>9.2f} {result['queries']['max']:>9} {result['peak_memory_kb']:>10.1f}"
+            )
+        if report['not_measured']:
+            self.stdout.write(f"Не замерялись: {', '.join(report['not_measured'])}")
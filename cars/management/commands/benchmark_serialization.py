@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cars.benchmark import run_serialization_benchmark
+from cars.query_audit import analyze, audit_car
+from cars.seeding import seed_garage
+
+# Зерна данных: автомобили для списка автомобилей и один автомобиль с
+# историей ремонтов и складом
+CARS_SEED = 921
+HISTORY_SEED = 922
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость сериализации списков API (строк в секунду) до и после быстрого пути'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--existing', action='store_true',
+                            help='Замерить на существующих данных вместо сгенерированных')
+        parser.add_argument('--cars', type=int, default=10000, help='Автомобилей у пользователя')
+        parser.add_argument('--repairs', type=int, default=10000, help='Записей о ремонте у автомобиля')
+        parser.add_argument('--parts', type=int, default=2, help='Запчастей на запись о ремонте')
+        parser.add_argument('--stock', type=int, default=10000, help='Запчастей на складе автомобиля')
+        parser.add_argument('--iterations', type=int, default=3, help='Повторов каждого замера (берется лучший)')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию - вывод в консоль)')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должен быть не меньше 1')
+
+        if options['existing']:
+            car = audit_car()
+            if car is None:
+                raise CommandError('В базе нет автомобилей')
+            report = run_serialization_benchmark(car, iterations=options['iterations'], dataset={'existing': True})
+        else:
+            dataset = {
+                'cars': options['cars'],
+                'repairs': options['repairs'],
+                'parts_per_repair': options['parts'],
+                'stock': options['stock'],
+            }
+            # Сгенерированные данные откатываются вместе с транзакцией
+            try:
+                with transaction.atomic():
+                    user = seed_garage(cars_per_user=dataset['cars'], repairs_per_car=0, parts_per_repair=0,
+                                       stock_parts_per_car=0, seed=CARS_SEED)[0]
+                    history = seed_garage(repairs_per_car=dataset['repairs'], parts_per_repair=dataset['parts_per_repair'],
+                                          stock_parts_per_car=dataset['stock'], seed=HISTORY_SEED)[0]
+                    # Автомобиль с историей - у того же пользователя, что и остальные
+                    car = history.cars.get()
+                    car.user = user
+                    car.save(update_fields=['user'])
+                    analyze()
+                    report = run_serialization_benchmark(car, iterations=options['iterations'], dataset=dataset)
+                    raise Rollback
+            except Rollback:
+                pass
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(content)
+        else:
+            self.stdout.write(content)
+
+        self.stdout.write(f"{'список':<20} {'строк':>7} {'до, строк/с':>12} {'после, строк/с':>15} {'ускорение':>10}")
+        for name, result in report['lists'].items():
+            self.stdout.write(
+                f"{name:<20} {result['rows']:>7} {result['before_rows_per_s']:>12} "
+                f"{result['after_rows_per_s']:>15} {result['speedup']:>10}"
+            )
+        mismatched = [name for name, result in report['lists'].items() if not result['identical']]
+        if mismatched:
+            raise CommandError(f"Ответы быстрого пути отличаются: {', '.join(mismatched)}")
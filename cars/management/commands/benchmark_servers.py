@@ -0,0 +1,81 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from cars.benchmark import run_server_benchmark
+from cars.query_audit import analyze, audit_car
+from cars.seeding import seed_garage
+
+# Зерно данных сравнения, чтобы не пересекаться с другими сгенерированными пользователями
+SERVER_BENCHMARK_SEED = 911
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность API под WSGI и ASGI и сохраняет JSON-отчет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--existing', action='store_true',
+                            help='Замерить на существующих данных вместо сгенерированных')
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--cars', type=int, default=2, help='Автомобилей на пользователя')
+        parser.add_argument('--repairs', type=int, default=300, help='Записей о ремонте на автомобиль')
+        parser.add_argument('--parts', type=int, default=3, help='Запчастей на запись о ремонте')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов в каждом режиме')
+        parser.add_argument('--concurrency', type=int, default=20, help='Одновременных запросов под ASGI')
+        parser.add_argument('--wsgi-workers', type=int, default=4, help='Потоков-воркеров под WSGI')
+        parser.add_argument('--with-cache', action='store_true', help='Не отключать кэш ответов API')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию - вывод в консоль)')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests должен быть не меньше 1')
+        benchmark_options = {
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'wsgi_workers': options['wsgi_workers'],
+            'use_cache': options['with_cache'],
+        }
+
+        if options['existing']:
+            car = audit_car()
+            if car is None:
+                raise CommandError('В базе нет автомобилей')
+            report = run_server_benchmark(car, dataset={'existing': True}, **benchmark_options)
+        else:
+            dataset = {
+                'users': options['users'],
+                'cars_per_user': options['cars'],
+                'repairs_per_car': options['repairs'],
+                'parts_per_repair': options['parts'],
+                'seed': SERVER_BENCHMARK_SEED,
+            }
+            # Запросы выполняются в других потоках, поэтому данные фиксируются
+            # в БД и удаляются после замера
+            users = seed_garage(
+                users=dataset['users'],
+                cars_per_user=dataset['cars_per_user'],
+                repairs_per_car=dataset['repairs_per_car'],
+                parts_per_repair=dataset['parts_per_repair'],
+                seed=SERVER_BENCHMARK_SEED,
+            )
+            try:
+                analyze()
+                report = run_server_benchmark(users[0].cars.first(), dataset=dataset, **benchmark_options)
+            finally:
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(content)
+        else:
+            self.stdout.write(content)
+
+        for mode in ('wsgi', 'asgi'):
+            result = report[mode]
+            self.stdout.write(
+                f"{mode.upper()}: {result['throughput_rps']} запр/с, p50 {result['latency_ms']['p50']} мс, "
+                f"p95 {result['latency_ms']['p95']} мс, коды {result['statuses']}"
+            )
+        self.stdout.write(f"ASGI/WSGI: {report['asgi_to_wsgi_throughput']}")
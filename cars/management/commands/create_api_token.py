@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from cars.models import ApiToken
+
+
+class Command(BaseCommand):
+    help = ('Выдает пользователю токен API (заголовок Authorization: Bearer <ключ>); '
+            'ключ выводится один раз, отзыв - удалением токена в админке')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', default='', help='Название токена (например, имя интеграции)')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"Пользователь {options['username']} не найден")
+        token, key = ApiToken.objects.issue(user, options['name'])
+        self.stderr.write(f'Токен {token.prefix}… выдан пользователю {user.username}; сохраните ключ, он больше не будет показан')
+        self.stdout.write(key)
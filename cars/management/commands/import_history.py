@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cars.importer import IMPORT_BATCH_SIZE, ImportFormatError, import_history
+from cars.models import Car
+
+
+class Command(BaseCommand):
+    help = 'Импорт истории ремонтов и запчастей автомобиля из CSV/XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('car_id', type=int, help='ID автомобиля')
+        parser.add_argument('path', help='Путь к файлу .csv или .xlsx')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                            help='Сколько записей о ремонте вставлять за одну транзакцию')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только проверить файл, ничего не сохраняя')
+
+    def handle(self, *args, **options):
+        try:
+            car = Car.objects.get(pk=options['car_id'])
+        except Car.DoesNotExist:
+            raise CommandError(f"Автомобиль {options['car_id']} не найден")
+
+        try:
+            with open(options['path'], 'rb') as file:
+                result = import_history(
+                    car, file, options['path'],
+                    batch_size=options['batch_size'],
+                    dry_run=options['dry_run'],
+                )
+        except OSError as e:
+            raise CommandError(f"Не удалось открыть файл: {e}")
+        except ImportFormatError as e:
+            raise CommandError(str(e))
+
+        for error in result['errors']:
+            messages = '; '.join(
+                f"{field}: {', '.join(str(message) for message in field_errors)}"
+                for field, field_errors in error['errors'].items()
+            )
+            self.stderr.write(f"Строка {error['row']}: {messages}")
+        if result['errors_count'] > len(result['errors']):
+            self.stderr.write(f"... и еще {result['errors_count'] - len(result['errors'])} ошибок")
+
+        prefix = 'Проверено (без сохранения)' if result['dry_run'] else 'Импортировано'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}: строк {result['rows_processed']}, записей о ремонте {result['records_created']}, "
+            f"запчастей {result['parts_created']}, ошибок {result['errors_count']}"
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from cars.sync import TOMBSTONE_TTL, prune_tombstones
+
+
+class Command(BaseCommand):
+    help = (f'Удаление отметок об удалении объектов старше {TOMBSTONE_TTL.days} дней; '
+            'клиенты с более старым курсором синхронизации получают все данные заново')
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f"Удалено отметок: {deleted}"))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cars.models import Car
+from cars.rollups import ROLLUP_BATCH_SIZE, check_rollups, rebuild_rollups
+
+# Сколько расхождений выводить при --check
+MAX_REPORTED = 20
+
+
+class Command(BaseCommand):
+    help = 'Пересчет итогов расходов по автомобилям или проверка их согласованности (--check)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--car', type=int, action='append', dest='car_ids',
+                            help='ID автомобиля (можно указать несколько раз); по умолчанию - все')
+        parser.add_argument('--check', action='store_true',
+                            help='Только сравнить итоги с записями о ремонте и запчастями')
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE,
+                            help='Для скольких автомобилей считать итоги за один проход')
+
+    def handle(self, *args, **options):
+        cars = Car.objects.all()
+        if options['car_ids']:
+            cars = cars.filter(pk__in=options['car_ids'])
+
+        if options['check']:
+            problems = check_rollups(cars, batch_size=options['batch_size'])
+            for problem in problems[:MAX_REPORTED]:
+                month = f" {problem['month']:%Y-%m}" if problem['month'] else ''
+                self.stdout.write(
+                    f"Автомобиль {problem['car_id']}{month}, {problem['field']}: "
+                    f"ожидается {problem['expected']}, в итогах {problem['actual']}"
+                )
+            if problems:
+                raise CommandError(f"Расхождений в итогах: {len(problems)}. Исправить: manage.py rebuild_rollups")
+            self.stdout.write(self.style.SUCCESS('Итоги согласованы'))
+            return
+
+        cars_count, months_count = rebuild_rollups(cars, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Автомобилей: {cars_count}, строк по месяцам: {months_count}"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from cars.models import Car
+from cars.search import INDEX_BATCH_SIZE, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестроение поискового индекса по ремонтам, запчастям и складу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--car', type=int, action='append', dest='car_ids',
+                            help='ID автомобиля (можно указать несколько раз); по умолчанию - все')
+        parser.add_argument('--batch-size', type=int, default=INDEX_BATCH_SIZE,
+                            help='Сколько строк индекса вставлять за один запрос')
+
+    def handle(self, *args, **options):
+        cars = Car.objects.all()
+        if options['car_ids']:
+            cars = cars.filter(pk__in=options['car_ids'])
+        count = rebuild_index(cars, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Строк в индексе: {count}"))
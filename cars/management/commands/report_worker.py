@@ -0,0 +1,76 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cars.deletion import delete_hidden_cars
+from cars.jobs import process_next_job, purge_report_jobs, requeue_stuck_jobs
+
+# Как часто возвращать зависшие задания в очередь и удалять старые (секунды)
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Выполнение фоновых заданий на отчеты Excel из очереди в БД и фоновых удалений автомобилей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Количество потоков, выполняющих задания')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='Пауза между проверками пустой очереди, секунды')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить задания, которые уже в очереди, и завершиться')
+
+    def handle(self, *args, **options):
+        self.maintenance()
+        if options['once']:
+            processed = self.drain()
+            self.stdout.write(self.style.SUCCESS(f"Выполнено заданий: {processed}"))
+            return
+
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.work, args=(stop, options['poll']), daemon=True)
+            for _ in range(max(options['workers'], 1))
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Воркер отчетов запущен, потоков: {len(threads)}")
+        try:
+            while True:
+                time.sleep(MAINTENANCE_INTERVAL)
+                close_old_connections()
+                self.maintenance()
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def maintenance(self):
+        requeued = requeue_stuck_jobs()
+        purged = purge_report_jobs()
+        if requeued or purged:
+            self.stdout.write(f"Возвращено в очередь: {requeued}, удалено старых: {purged}")
+        # Скрытые автомобили, которые не удалил пул веб-процесса (REPORT_WORKERS=0, перезапуск)
+        deleted = delete_hidden_cars()
+        if deleted:
+            self.stdout.write(f"Удалено автомобилей в фоне: {deleted}")
+
+    def drain(self):
+        processed = 0
+        while process_next_job() is not None:
+            processed += 1
+        return processed
+
+    def work(self, stop, poll):
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                job = process_next_job()
+            except Exception as e:
+                self.stderr.write(f"Ошибка воркера: {e}")
+                job = None
+            if job is None:
+                stop.wait(poll)
+        close_old_connections()
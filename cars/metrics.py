@@ -0,0 +1,297 @@
+"""Метрики запросов: время ответа, запросы к БД, сериализация, размер ответа
+
+RequestMetricsMiddleware (middleware.py) заводит на каждый запрос
+RequestMetrics в контекстной переменной; она видна и в потоках
+sync_to_async, где выполняются запросы к БД асинхронных представлений.
+Запросы к БД считает обертка query_wrapper, которая ставится на каждое
+соединение (apps.py). Время сериализации отмечают timer('serialize') и
+декоратор instrument.
+
+По завершении запроса метрики:
+- уходят в заголовок Server-Timing (settings.SERVER_TIMING);
+- пишутся строкой JSON в журнал cars.requests: INFO, медленные (дольше
+  settings.SLOW_REQUEST_MS) - WARNING;
+- добавляются в гистограммы процесса по маршрутам (registry, /api/metrics/).
+
+Запросы к БД дольше settings.SLOW_QUERY_MS пишутся в журнал cars.db.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('cars.requests')
+db_logger = logging.getLogger('cars.db')
+
+# Границы корзин гистограмм: время ответа (мс) и число запросов к БД
+DURATION_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Сколько символов SQL писать в журнал медленных запросов
+SLOW_SQL_MAX_LENGTH = 1000
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestMetrics:
+    """Метрики одного запроса"""
+
+    def __init__(self, request):
+        self.method = request.method
+        self.path = request.path
+        # Имя маршрута из instrument(name); по умолчанию - url_name
+        self.route = None
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.timings = {}
+        # Запросы к БД приходят и из потоков sync_to_async
+        self._lock = threading.Lock()
+
+    def add_query(self, duration):
+        with self._lock:
+            self.queries += 1
+            self.db_time += duration
+
+    def add_timing(self, name, duration):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + duration
+
+    def route_name(self, request):
+        if self.route:
+            return self.route
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        return match.url_name or match.view_name
+
+    def summary(self, request, response):
+        """Итог запроса для журнала и гистограмм"""
+        if response.streaming:
+            # Размер отдаваемого потоком файла известен только из заголовка
+            size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+        else:
+            size = len(response.content)
+        return {
+            'route': self.route_name(request),
+            'method': self.method,
+            'path': self.path,
+            'status': response.status_code,
+            'duration_ms': _ms(time.perf_counter() - self.started),
+            'db_queries': self.queries,
+            'db_ms': _ms(self.db_time),
+            **{f'{name}_ms': _ms(duration) for name, duration in self.timings.items()},
+            'response_bytes': size,
+        }
+
+
+def current():
+    """RequestMetrics текущего запроса или None"""
+    return _current.get()
+
+
+@contextmanager
+def request_context(request):
+    metrics = RequestMetrics(request)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timer(name):
+    """Добавляет время блока к метрике name текущего запроса"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_timing(name, time.perf_counter() - started)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """Обертка выполнения SQL (connection.execute_wrappers): счетчик запросов
+    текущего запроса и журнал медленных запросов"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_query(duration)
+        slow_ms = getattr(settings, 'SLOW_QUERY_MS', None)
+        if slow_ms is not None and duration * 1000 >= slow_ms:
+            db_logger.warning(json.dumps({
+                'event': 'slow_query',
+                'path': metrics.path if metrics is not None else None,
+                'duration_ms': _ms(duration),
+                'many': many,
+                'sql': sql[:SLOW_SQL_MAX_LENGTH],
+            }, ensure_ascii=False))
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """Обработчик connection_created: обертка ставится один раз на соединение"""
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+def _render(response):
+    # Ответ DRF отрисовывается обработчиком Django уже после представления;
+    # здесь это делается заранее, чтобы время попало в сериализацию
+    if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+        with timer('serialize'):
+            response.render()
+    return response
+
+
+def instrument(name=None):
+    """Декоратор представления (синхронного или асинхронного): name - имя
+    маршрута в метриках вместо url_name; отрисовка ответа DRF учитывается
+    как время сериализации"""
+    def decorator(view):
+        def set_route():
+            metrics = _current.get()
+            if metrics is not None and name:
+                metrics.route = name
+
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                set_route()
+                return _render(await view(request, *args, **kwargs))
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                set_route()
+                return _render(view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (значения <= границы)"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def as_dict(self):
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 2),
+            'avg': round(self.sum / self.count, 2) if self.count else None,
+            'max': round(self.max, 2),
+            'buckets': buckets,
+        }
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.duration_ms = Histogram(DURATION_BUCKETS)
+        self.db_queries = Histogram(QUERY_BUCKETS)
+        self.db_ms = 0.0
+        self.serialize_ms = 0.0
+        self.response_bytes = 0
+
+    def observe(self, summary):
+        self.requests += 1
+        if summary['status'] >= 500:
+            self.errors += 1
+        self.duration_ms.observe(summary['duration_ms'])
+        self.db_queries.observe(summary['db_queries'])
+        self.db_ms += summary['db_ms']
+        self.serialize_ms += summary.get('serialize_ms', 0.0)
+        self.response_bytes += summary['response_bytes'] or 0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'duration_ms': self.duration_ms.as_dict(),
+            'db_queries': self.db_queries.as_dict(),
+            'db_ms': round(self.db_ms, 2),
+            'serialize_ms': round(self.serialize_ms, 2),
+            'response_bytes': self.response_bytes,
+        }
+
+
+class MetricsRegistry:
+    """Метрики процесса по маршрутам ('GET car-list' и т.п.)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self.started_at = time.time()
+
+    def observe(self, summary):
+        key = f"{summary['method']} {summary['route']}"
+        with self._lock:
+            self._routes.setdefault(key, RouteMetrics()).observe(summary)
+
+    def snapshot(self):
+        with self._lock:
+            routes = {key: route.as_dict() for key, route in sorted(self._routes.items())}
+        return {'uptime_s': round(time.time() - self.started_at), 'routes': routes}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self.started_at = time.time()
+
+
+registry = MetricsRegistry()
+
+
+def server_timing(summary):
+    """Значение заголовка Server-Timing"""
+    entries = [f'db;dur={summary["db_ms"]};desc="{summary["db_queries"]} queries"']
+    entries += [
+        f'{key[:-3]};dur={value}' for key, value in summary.items()
+        if key.endswith('_ms') and key not in ('db_ms', 'duration_ms')
+    ]
+    entries.append(f'total;dur={summary["duration_ms"]}')
+    return ', '.join(entries)
+
+
+def finish(metrics, request, response):
+    """Записывает метрики завершенного запроса: заголовок, журнал, гистограммы"""
+    summary = metrics.summary(request, response)
+    registry.observe(summary)
+    if getattr(settings, 'SERVER_TIMING', True):
+        response['Server-Timing'] = server_timing(summary)
+    slow_ms = getattr(settings, 'SLOW_REQUEST_MS', None)
+    level = logging.WARNING if slow_ms is not None and summary['duration_ms'] >= slow_ms else logging.INFO
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({'event': 'request', **summary}, ensure_ascii=False))
+    return response
@@ -0,0 +1,33 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    """Собирает метрики каждого запроса (metrics.py). Работает и под WSGI, и
+    под ASGI без переключения между потоком и циклом событий. Отключается
+    settings.REQUEST_METRICS = False."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with metrics.request_context(request) as request_metrics:
+            response = self.get_response(request)
+        return metrics.finish(request_metrics, request, response)
+
+    async def __acall__(self, request):
+        with metrics.request_context(request) as request_metrics:
+            response = await self.get_response(request)
+        return metrics.finish(request_metrics, request, response)
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0007_part_quantity_stockpart_quantity_alter_part_cost_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='car_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='part',
+            index=models.Index(fields=['repair_record', '-created_at'], name='part_record_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repairrecord',
+            index=models.Index(fields=['car', '-date', '-created_at', '-id'], name='repair_car_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockpart',
+            index=models.Index(fields=['car', '-created_at', '-id'], name='stock_car_created_idx'),
+        ),
+    ]
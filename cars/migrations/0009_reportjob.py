@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_from', models.DateField(verbose_name='Начало периода')),
+                ('date_to', models.DateField(verbose_name='Конец периода')),
+                ('data_version', models.CharField(max_length=32, verbose_name='Версия данных')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готов'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('file', models.FileField(blank=True, upload_to='reports/%Y/%m/', verbose_name='Файл отчета')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начато')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to='cars.car', verbose_name='Автомобиль')),
+            ],
+            options={
+                'verbose_name': 'Задание на отчет',
+                'verbose_name_plural': 'Задания на отчеты',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='report_job_queue_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'failed'), _negated=True), fields=('car', 'date_from', 'date_to', 'data_version'), name='report_job_dedup')],
+            },
+        ),
+    ]
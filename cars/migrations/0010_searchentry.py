@@ -0,0 +1,84 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'cars_searchentry_fts'
+
+# FTS5 с внешним содержимым: текст хранится в cars_searchentry.terms,
+# триггеры переносят в индекс каждое изменение строки. Если миграция
+# изменит поля SearchEntry, SQLite пересоздаст таблицу и удалит триггеры -
+# такую миграцию нужно дополнить их повторным созданием.
+SQLITE_FTS_SQL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"terms, content='cars_searchentry', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER cars_searchentry_fts_insert AFTER INSERT ON cars_searchentry BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, terms) VALUES (new.id, new.terms); END",
+    f"CREATE TRIGGER cars_searchentry_fts_delete AFTER DELETE ON cars_searchentry BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, terms) VALUES ('delete', old.id, old.terms); END",
+    f"CREATE TRIGGER cars_searchentry_fts_update AFTER UPDATE ON cars_searchentry BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, terms) VALUES ('delete', old.id, old.terms); "
+    f"INSERT INTO {FTS_TABLE}(rowid, terms) VALUES (new.id, new.terms); END",
+]
+
+SQLITE_DROP_FTS_SQL = [
+    'DROP TRIGGER IF EXISTS cars_searchentry_fts_update',
+    'DROP TRIGGER IF EXISTS cars_searchentry_fts_delete',
+    'DROP TRIGGER IF EXISTS cars_searchentry_fts_insert',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def postgres_fts_index():
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    # Выражение должно совпадать с search._pg_vector()
+    return GinIndex(SearchVector('text', config='russian'), name='search_entry_text_fts')
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQLITE_FTS_SQL:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('cars', 'SearchEntry'), postgres_fts_index())
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for sql in SQLITE_DROP_FTS_SQL:
+            schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('cars', 'SearchEntry'), postgres_fts_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0009_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('repair', 'Запись о ремонте'), ('part', 'Запчасть'), ('stock', 'Запчасть на складе')], max_length=10, verbose_name='Тип')),
+                ('date', models.DateField(blank=True, null=True, verbose_name='Дата')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('terms', models.TextField(verbose_name='Основы слов')),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='cars.car', verbose_name='Автомобиль')),
+                ('part', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entry', to='cars.part', verbose_name='Запчасть')),
+                ('repair_record', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='cars.repairrecord', verbose_name='Запись о ремонте')),
+                ('stock_part', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_entry', to='cars.stockpart', verbose_name='Запчасть на складе')),
+            ],
+            options={
+                'verbose_name': 'Строка поискового индекса',
+                'verbose_name_plural': 'Поисковый индекс',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('kind', 'repair')), fields=('repair_record',), name='search_entry_repair_uniq')],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
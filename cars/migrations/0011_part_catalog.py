@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+
+    dependencies = [
+        ('cars', '0010_searchentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartCatalog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_code', models.CharField(max_length=100, verbose_name='Код детали')),
+                ('manufacturer', models.CharField(max_length=100, verbose_name='Производитель')),
+                ('name', models.CharField(blank=True, max_length=200, verbose_name='Наименование')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+            ],
+            options={
+                'verbose_name': 'Позиция каталога запчастей',
+                'verbose_name_plural': 'Каталог запчастей',
+                'ordering': ['manufacturer', 'part_code'],
+                'constraints': [models.UniqueConstraint(fields=('part_code', 'manufacturer'), name='part_catalog_code_uniq')],
+            },
+        ),
+        migrations.AddField(
+            model_name='part',
+            name='catalog',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='parts', to='cars.partcatalog', verbose_name='Позиция каталога'),
+        ),
+        migrations.AddField(
+            model_name='stockpart',
+            name='catalog',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stock_parts', to='cars.partcatalog', verbose_name='Позиция каталога'),
+        ),
+    ]
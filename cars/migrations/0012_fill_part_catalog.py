@@ -0,0 +1,93 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:05
+
+from django.db import migrations, transaction
+
+# Сколько запчастей переносить в каталог за одну пачку
+BATCH_SIZE = 2000
+
+
+def resolve_catalog(PartCatalog, keys):
+    """{(производитель, код): наименование} -> {(производитель, код): id позиции}"""
+    codes = {part_code for _, part_code in keys}
+
+    def fetch():
+        return {
+            (manufacturer, part_code): pk
+            for pk, manufacturer, part_code in
+            PartCatalog.objects.filter(part_code__in=codes).values_list('pk', 'manufacturer', 'part_code')
+            if (manufacturer, part_code) in keys
+        }
+
+    entries = fetch()
+    missing = [key for key in keys if key not in entries]
+    if missing:
+        PartCatalog.objects.bulk_create(
+            [PartCatalog(manufacturer=manufacturer, part_code=part_code, name=keys[(manufacturer, part_code)])
+             for manufacturer, part_code in missing],
+            ignore_conflicts=True,
+        )
+        entries = fetch()
+    return entries
+
+
+def fill_catalog(apps, schema_editor):
+    """Переносит производителя и код запчастей в каталог пачками по BATCH_SIZE.
+
+    Каждая пачка - отдельная транзакция: блокировки держатся недолго, а на
+    PostgreSQL отложенные проверки внешних ключей не копятся до ALTER TABLE
+    в 0013. Прерванный перенос продолжается с запчастей без позиции каталога.
+    """
+    PartCatalog = apps.get_model('cars', 'PartCatalog')
+    alias = schema_editor.connection.alias
+    for model_name in ('Part', 'StockPart'):
+        model = apps.get_model('cars', model_name)
+        last_pk = 0
+        while True:
+            with transaction.atomic(using=alias):
+                rows = list(
+                    model.objects.filter(pk__gt=last_pk, catalog__isnull=True).order_by('pk')
+                    .values_list('pk', 'name', 'manufacturer', 'part_code')[:BATCH_SIZE]
+                )
+                if not rows:
+                    break
+                keys = {}
+                for _, name, manufacturer, part_code in rows:
+                    keys.setdefault((manufacturer.strip(), part_code.strip()), name)
+                entries = resolve_catalog(PartCatalog, keys)
+                model.objects.bulk_update(
+                    [model(pk=pk, catalog_id=entries[(manufacturer.strip(), part_code.strip())])
+                     for pk, _, manufacturer, part_code in rows],
+                    ['catalog'],
+                )
+            last_pk = rows[-1][0]
+
+
+def restore_part_fields(apps, schema_editor):
+    """Обратная миграция: производитель и код снова хранятся в запчастях"""
+    alias = schema_editor.connection.alias
+    for model_name in ('Part', 'StockPart'):
+        model = apps.get_model('cars', model_name)
+        last_pk = 0
+        while True:
+            with transaction.atomic(using=alias):
+                parts = list(model.objects.filter(pk__gt=last_pk).select_related('catalog').order_by('pk')[:BATCH_SIZE])
+                if not parts:
+                    break
+                for part in parts:
+                    part.manufacturer = part.catalog.manufacturer
+                    part.part_code = part.catalog.part_code
+                model.objects.bulk_update(parts, ['manufacturer', 'part_code'])
+            last_pk = parts[-1].pk
+
+
+class Migration(migrations.Migration):
+    # Каждая пачка - отдельная транзакция (см. fill_catalog)
+    atomic = False
+
+    dependencies = [
+        ('cars', '0011_part_catalog'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_catalog, restore_part_fields, atomic=False),
+    ]
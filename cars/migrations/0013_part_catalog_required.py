@@ -0,0 +1,61 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0012_fill_part_catalog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='part',
+            name='catalog',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='parts', to='cars.partcatalog', verbose_name='Позиция каталога'),
+        ),
+        migrations.AlterField(
+            model_name='stockpart',
+            name='catalog',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='stock_parts', to='cars.partcatalog', verbose_name='Позиция каталога'),
+        ),
+        # Значение по умолчанию нужно обратной миграции, чтобы вернуть колонки
+        migrations.AlterField(
+            model_name='part',
+            name='manufacturer',
+            field=models.CharField(default='', max_length=100, verbose_name='Производитель'),
+        ),
+        migrations.AlterField(
+            model_name='part',
+            name='part_code',
+            field=models.CharField(default='', max_length=100, verbose_name='Код детали'),
+        ),
+        migrations.AlterField(
+            model_name='stockpart',
+            name='manufacturer',
+            field=models.CharField(default='', max_length=100, verbose_name='Производитель'),
+        ),
+        migrations.AlterField(
+            model_name='stockpart',
+            name='part_code',
+            field=models.CharField(default='', max_length=100, verbose_name='Код детали'),
+        ),
+        migrations.RemoveField(
+            model_name='part',
+            name='manufacturer',
+        ),
+        migrations.RemoveField(
+            model_name='part',
+            name='part_code',
+        ),
+        migrations.RemoveField(
+            model_name='stockpart',
+            name='manufacturer',
+        ),
+        migrations.RemoveField(
+            model_name='stockpart',
+            name='part_code',
+        ),
+    ]
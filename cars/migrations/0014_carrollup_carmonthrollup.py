@@ -0,0 +1,105 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:10
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncMonth
+
+MONEY_FIELD = models.DecimalField(max_digits=14, decimal_places=2)
+
+
+def fill_rollups(apps, schema_editor):
+    """Считает итоги по существующим записям о ремонте и запчастям
+    (то же, что rollups.rebuild_rollups)"""
+    RepairRecord = apps.get_model('cars', 'RepairRecord')
+    Part = apps.get_model('cars', 'Part')
+    CarRollup = apps.get_model('cars', 'CarRollup')
+    CarMonthRollup = apps.get_model('cars', 'CarMonthRollup')
+
+    months = {}
+    cars = {}
+    records = (
+        RepairRecord.objects
+        .annotate(month=TruncMonth('date'))
+        .values('car_id', 'month')
+        .annotate(records_count=Count('id'), work_cost=Sum('work_cost'),
+                  min_mileage=Min('mileage'), max_mileage=Max('mileage'), last_date=Max('date'))
+        .order_by()
+    )
+    for row in records:
+        months[(row['car_id'], row['month'])] = CarMonthRollup(
+            car_id=row['car_id'], month=row['month'], records_count=row['records_count'], work_cost=row['work_cost'],
+            min_mileage=row['min_mileage'], max_mileage=row['max_mileage'],
+        )
+        car = cars.setdefault(row['car_id'], CarRollup(car_id=row['car_id'], work_cost=Decimal('0.00'),
+                                                       parts_cost=Decimal('0.00')))
+        car.records_count += row['records_count']
+        car.work_cost += row['work_cost']
+        car.last_mileage = max(car.last_mileage or 0, row['max_mileage'])
+        car.last_service_date = max(car.last_service_date or row['last_date'], row['last_date'])
+
+    parts = (
+        Part.objects
+        .annotate(car_id=F('repair_record__car_id'), month=TruncMonth('repair_record__date'))
+        .values('car_id', 'month')
+        .annotate(parts_count=Count('id'), parts_cost=Sum(F('cost') * F('quantity'), output_field=MONEY_FIELD))
+        .order_by()
+    )
+    for row in parts:
+        month = months[(row['car_id'], row['month'])]
+        month.parts_count = row['parts_count']
+        month.parts_cost = row['parts_cost']
+        cars[row['car_id']].parts_count += row['parts_count']
+        cars[row['car_id']].parts_cost += row['parts_cost']
+
+    CarRollup.objects.bulk_create(cars.values(), batch_size=1000)
+    CarMonthRollup.objects.bulk_create(months.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0013_part_catalog_required'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarRollup',
+            fields=[
+                ('car', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='cars.car', verbose_name='Автомобиль')),
+                ('records_count', models.IntegerField(default=0, verbose_name='Записей о ремонте')),
+                ('parts_count', models.IntegerField(default=0, verbose_name='Запчастей')),
+                ('work_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Стоимость работ')),
+                ('parts_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Стоимость запчастей')),
+                ('last_mileage', models.IntegerField(blank=True, null=True, verbose_name='Последний пробег (км)')),
+                ('last_service_date', models.DateField(blank=True, null=True, verbose_name='Дата последнего обслуживания')),
+            ],
+            options={
+                'verbose_name': 'Итоги по автомобилю',
+                'verbose_name_plural': 'Итоги по автомобилям',
+            },
+        ),
+        migrations.CreateModel(
+            name='CarMonthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('records_count', models.IntegerField(default=0, verbose_name='Записей о ремонте')),
+                ('parts_count', models.IntegerField(default=0, verbose_name='Запчастей')),
+                ('work_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Стоимость работ')),
+                ('parts_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Стоимость запчастей')),
+                ('min_mileage', models.IntegerField(blank=True, null=True, verbose_name='Минимальный пробег (км)')),
+                ('max_mileage', models.IntegerField(blank=True, null=True, verbose_name='Максимальный пробег (км)')),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='month_rollups', to='cars.car', verbose_name='Автомобиль')),
+            ],
+            options={
+                'verbose_name': 'Итоги по автомобилю за месяц',
+                'verbose_name_plural': 'Итоги по автомобилям за месяц',
+                'ordering': ['car', 'month'],
+                'constraints': [models.UniqueConstraint(fields=('car', 'month'), name='car_month_rollup_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
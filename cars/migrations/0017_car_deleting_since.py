@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0016_apitoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='deleting_since',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Удаляется с'),
+        ),
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(condition=models.Q(('deleting_since__isnull', False)), fields=['deleting_since'], name='car_deleting_idx'),
+        ),
+    ]
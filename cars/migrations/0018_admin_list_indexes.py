@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cars', '0017_car_deleting_since'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['-created_at', '-id'], name='car_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repairrecord',
+            index=models.Index(fields=['-date', '-created_at', '-id'], name='repair_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockpart',
+            index=models.Index(fields=['-created_at', '-id'], name='stock_created_idx'),
+        ),
+    ]
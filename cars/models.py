@@ -1,6 +1,16 @@
+import hashlib
+import secrets
+
 from django.db import models
 from django.contrib.auth.models import User
 
+class VisibleCarManager(models.Manager):
+    """Автомобили без тех, что удаляются в фоне (deletion.py)"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleting_since__isnull=True)
+
+
 class Car(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cars')
     brand = models.CharField(max_length=100, verbose_name='Марка')
@@ -14,11 +24,28 @@ class Car(models.Model):
     notes = models.TextField(blank=True, null=True, verbose_name='Заметки')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+    # Автомобиль скрыт и удаляется в фоне вместе с историей (deletion.py)
+    deleting_since = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Удаляется с')
+
+    # Car.objects не видит удаляемые автомобили, Car.all_objects - все
+    objects = VisibleCarManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = 'Автомобиль'
         verbose_name_plural = 'Автомобили'
         ordering = ['-created_at']
+        indexes = [
+            # Список автомобилей пользователя: filter(user=...) в порядке -created_at (id - для курсора)
+            models.Index(fields=['user', '-created_at', '-id'], name='car_user_created_idx'),
+            # Синхронизация (sync.py): измененные с момента курсора
+            models.Index(fields=['user', 'updated_at'], name='car_user_updated_idx'),
+            # Админка: список всех автомобилей в порядке -created_at и date_hierarchy
+            models.Index(fields=['-created_at', '-id'], name='car_created_idx'),
+            # Очередь фонового удаления: частичный индекс только по скрытым автомобилям
+            models.Index(fields=['deleting_since'], name='car_deleting_idx',
+                         condition=models.Q(deleting_since__isnull=False)),
+        ]
 
     def __str__(self):
         return f"{self.brand} {self.model}"
@@ -38,46 +65,414 @@ class RepairRecord(models.Model):
         verbose_name = 'Запись о ремонте'
         verbose_name_plural = 'Записи о ремонте'
         ordering = ['-date', '-created_at']
+        indexes = [
+            # Ремонты автомобиля в порядке -date, -created_at (id - для курсора) и выборки по периоду
+            models.Index(fields=['car', '-date', '-created_at', '-id'], name='repair_car_date_idx'),
+            models.Index(fields=['car', 'updated_at'], name='repair_car_updated_idx'),
+            # Админка: все записи в порядке -date, -created_at и date_hierarchy по дате
+            models.Index(fields=['-date', '-created_at', '-id'], name='repair_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.car} - {self.date} ({self.mileage} км)"
 
 
-class Part(models.Model):
+def catalog_key(manufacturer, part_code):
+    """Ключ позиции каталога: производитель и код без крайних пробелов"""
+    return (manufacturer or '').strip(), (part_code or '').strip()
+
+
+class PartCatalogManager(models.Manager):
+    def get_entry(self, manufacturer, part_code, name=''):
+        """Позиция каталога по производителю и коду; создается при отсутствии"""
+        manufacturer, part_code = catalog_key(manufacturer, part_code)
+        # get_or_create сам повторяет чтение, если позицию параллельно создал другой запрос
+        return self.get_or_create(manufacturer=manufacturer, part_code=part_code, defaults={'name': name})[0]
+
+    def resolve(self, keys):
+        """{(производитель, код): наименование} -> {(производитель, код): позиция}.
+
+        Недостающие позиции создаются одним bulk_create; всего три запроса
+        на пачку независимо от ее размера.
+        """
+        keys = {catalog_key(*key): name for key, name in keys.items()}
+        if not keys:
+            return {}
+        codes = {part_code for _, part_code in keys}
+
+        def fetch():
+            return {
+                (entry.manufacturer, entry.part_code): entry
+                for entry in self.filter(part_code__in=codes)
+                if (entry.manufacturer, entry.part_code) in keys
+            }
+
+        entries = fetch()
+        missing = [key for key in keys if key not in entries]
+        if missing:
+            self.bulk_create(
+                [self.model(manufacturer=manufacturer, part_code=part_code, name=keys[(manufacturer, part_code)])
+                 for manufacturer, part_code in missing],
+                ignore_conflicts=True,
+            )
+            entries = fetch()
+        return entries
+
+    def assign(self, objects):
+        """Подбирает позиции каталога для несохраненных Part/StockPart перед bulk_create"""
+        objects = [obj for obj in objects if obj.has_pending_catalog()]
+        entries = self.resolve({obj.pending_catalog_key(): obj.name for obj in objects})
+        for obj in objects:
+            obj.catalog = entries[obj.pending_catalog_key()]
+            obj.clear_pending_catalog()
+
+
+class PartCatalog(models.Model):
+    """Позиция каталога запчастей: производитель + код детали.
+
+    На нее ссылаются запчасти в ремонтах и на складе, поэтому выборки по
+    коду детали и аналитика по позиции - соединения по индексу, а не
+    сравнение строк в каждой запчасти.
+    """
+    part_code = models.CharField(max_length=100, verbose_name='Код детали')
+    manufacturer = models.CharField(max_length=100, verbose_name='Производитель')
+    # Наименование, с которым позиция впервые попала в каталог
+    name = models.CharField(max_length=200, blank=True, verbose_name='Наименование')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+
+    objects = PartCatalogManager()
+
+    class Meta:
+        verbose_name = 'Позиция каталога запчастей'
+        verbose_name_plural = 'Каталог запчастей'
+        ordering = ['manufacturer', 'part_code']
+        constraints = [
+            # Код первым: индекс обслуживает и поиск только по коду детали
+            models.UniqueConstraint(fields=['part_code', 'manufacturer'], name='part_catalog_code_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.manufacturer} {self.part_code}"
+
+
+class CatalogPartMixin:
+    """part_code и manufacturer запчасти читаются из позиции каталога.
+
+    Присвоенные значения (в том числе Part(part_code=..., manufacturer=...))
+    запоминаются, и позиция каталога подбирается при save(); перед
+    bulk_create это делает PartCatalog.objects.assign().
+    """
+    # Имена для .values() вместо свойств (row_serializers.py)
+    VALUE_LOOKUPS = {
+        'part_code': 'catalog__part_code',
+        'manufacturer': 'catalog__manufacturer',
+    }
+
+    def _catalog_value(self, field):
+        pending = self.__dict__.get('_pending_catalog', {})
+        if field in pending:
+            return pending[field]
+        if self.catalog_id is None:
+            return ''
+        return getattr(self.catalog, field)
+
+    def _set_catalog_value(self, field, value):
+        self.__dict__.setdefault('_pending_catalog', {})[field] = value
+
+    @property
+    def part_code(self):
+        return self._catalog_value('part_code')
+
+    @part_code.setter
+    def part_code(self, value):
+        self._set_catalog_value('part_code', value)
+
+    @property
+    def manufacturer(self):
+        return self._catalog_value('manufacturer')
+
+    @manufacturer.setter
+    def manufacturer(self, value):
+        self._set_catalog_value('manufacturer', value)
+
+    def has_pending_catalog(self):
+        return bool(self.__dict__.get('_pending_catalog'))
+
+    def pending_catalog_key(self):
+        return catalog_key(self.manufacturer, self.part_code)
+
+    def clear_pending_catalog(self):
+        self.__dict__.pop('_pending_catalog', None)
+
+    def save(self, *args, **kwargs):
+        if self.has_pending_catalog():
+            key = self.pending_catalog_key()
+            if self.catalog_id is None or key != (self.catalog.manufacturer, self.catalog.part_code):
+                self.catalog = PartCatalog.objects.get_entry(*key, name=self.name)
+            self.clear_pending_catalog()
+        super().save(*args, **kwargs)
+
+
+class Part(CatalogPartMixin, models.Model):
     """Запчасть, использованная при ремонте"""
     repair_record = models.ForeignKey(RepairRecord, on_delete=models.CASCADE, related_name='parts', verbose_name='Запись о ремонте')
     name = models.CharField(max_length=200, verbose_name='Наименование')
-    part_code = models.CharField(max_length=100, verbose_name='Код детали')
-    manufacturer = models.CharField(max_length=100, verbose_name='Производитель')
+    catalog = models.ForeignKey(PartCatalog, on_delete=models.PROTECT, related_name='parts', verbose_name='Позиция каталога')
     quantity = models.IntegerField(default=1, verbose_name='Количество')
     cost = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Стоимость за единицу')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
 
     class Meta:
         verbose_name = 'Запчасть'
         verbose_name_plural = 'Запчасти'
         ordering = ['-created_at']
+        indexes = [
+            # Запчасти записей о ремонте (prefetch_related('parts')) в порядке -created_at
+            models.Index(fields=['repair_record', '-created_at'], name='part_record_created_idx'),
+            # Синхронизация: у запчасти нет автомобиля, отбор идет от времени изменения
+            models.Index(fields=['updated_at'], name='part_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.part_code})"
 
 
-class StockPart(models.Model):
+def prefetch_parts():
+    """prefetch_related для записей о ремонте: запчасти вместе с позициями
+    каталога одним запросом"""
+    return models.Prefetch('parts', queryset=Part.objects.select_related('catalog'))
+
+
+class StockPart(CatalogPartMixin, models.Model):
     """Запчасть на складе (куплена, но еще не установлена)"""
     car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name='stock_parts', verbose_name='Автомобиль')
     name = models.CharField(max_length=200, verbose_name='Наименование')
-    part_code = models.CharField(max_length=100, verbose_name='Код детали')
-    manufacturer = models.CharField(max_length=100, verbose_name='Производитель')
+    catalog = models.ForeignKey(PartCatalog, on_delete=models.PROTECT, related_name='stock_parts', verbose_name='Позиция каталога')
     quantity = models.IntegerField(default=1, verbose_name='Количество')
     cost = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Стоимость за единицу')
     purchase_date = models.DateField(verbose_name='Дата покупки', null=True, blank=True)
     notes = models.TextField(blank=True, null=True, verbose_name='Заметки')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
 
     class Meta:
         verbose_name = 'Запчасть на складе'
         verbose_name_plural = 'Запчасти на складе'
         ordering = ['-created_at']
+        indexes = [
+            # Склад автомобиля в порядке -created_at (id - для курсора)
+            models.Index(fields=['car', '-created_at', '-id'], name='stock_car_created_idx'),
+            models.Index(fields=['car', 'updated_at'], name='stock_car_updated_idx'),
+            # Админка: весь склад в порядке -created_at и date_hierarchy
+            models.Index(fields=['-created_at', '-id'], name='stock_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.part_code}) - {self.car}"
+
+
+class CarRollup(models.Model):
+    """Итоги расходов по автомобилю, которые поддерживаются приращениями
+    (см. rollups.py)"""
+    car = models.OneToOneField(Car, on_delete=models.CASCADE, primary_key=True, related_name='rollup', verbose_name='Автомобиль')
+    records_count = models.IntegerField(default=0, verbose_name='Записей о ремонте')
+    parts_count = models.IntegerField(default=0, verbose_name='Запчастей')
+    work_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Стоимость работ')
+    parts_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Стоимость запчастей')
+    last_mileage = models.IntegerField(null=True, blank=True, verbose_name='Последний пробег (км)')
+    last_service_date = models.DateField(null=True, blank=True, verbose_name='Дата последнего обслуживания')
+
+    class Meta:
+        verbose_name = 'Итоги по автомобилю'
+        verbose_name_plural = 'Итоги по автомобилям'
+
+    @property
+    def total_cost(self):
+        return self.work_cost + self.parts_cost
+
+    def __str__(self):
+        return f"{self.car_id}: {self.records_count} записей, {self.total_cost}"
+
+
+class CarMonthRollup(models.Model):
+    """Итоги расходов по автомобилю за месяц (см. rollups.py)"""
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name='month_rollups', verbose_name='Автомобиль')
+    # Первое число месяца
+    month = models.DateField(verbose_name='Месяц')
+    records_count = models.IntegerField(default=0, verbose_name='Записей о ремонте')
+    parts_count = models.IntegerField(default=0, verbose_name='Запчастей')
+    work_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Стоимость работ')
+    parts_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Стоимость запчастей')
+    min_mileage = models.IntegerField(null=True, blank=True, verbose_name='Минимальный пробег (км)')
+    max_mileage = models.IntegerField(null=True, blank=True, verbose_name='Максимальный пробег (км)')
+
+    class Meta:
+        verbose_name = 'Итоги по автомобилю за месяц'
+        verbose_name_plural = 'Итоги по автомобилям за месяц'
+        ordering = ['car', 'month']
+        constraints = [
+            # Индекс и для выборки месяцев автомобиля за период
+            models.UniqueConstraint(fields=['car', 'month'], name='car_month_rollup_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.car_id} {self.month:%Y-%m}: {self.records_count} записей"
+
+
+class ReportJob(models.Model):
+    """Задание на построение отчета Excel в фоне (см. jobs.py)"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готов'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name='report_jobs', verbose_name='Автомобиль')
+    date_from = models.DateField(verbose_name='Начало периода')
+    date_to = models.DateField(verbose_name='Конец периода')
+    # Версия данных автомобиля при постановке задания (cache.car_scope):
+    # готовый файл отдается повторно, пока версия не изменилась
+    data_version = models.CharField(max_length=32, verbose_name='Версия данных')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='Статус')
+    file = models.FileField(upload_to='reports/%Y/%m/', blank=True, verbose_name='Файл отчета')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начато')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершено')
+
+    class Meta:
+        verbose_name = 'Задание на отчет'
+        verbose_name_plural = 'Задания на отчеты'
+        ordering = ['-created_at']
+        indexes = [
+            # Очередь: старейшие задания в статусе pending
+            models.Index(fields=['status', 'created_at'], name='report_job_queue_idx'),
+        ]
+        constraints = [
+            # Одинаковые запросы при неизменных данных - одно задание
+            models.UniqueConstraint(
+                fields=['car', 'date_from', 'date_to', 'data_version'],
+                condition=~models.Q(status='failed'),
+                name='report_job_dedup',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.car} {self.date_from} - {self.date_to} ({self.get_status_display()})"
+
+
+class SearchEntry(models.Model):
+    """Строка полнотекстового индекса (см. search.py): запись о ремонте,
+    запчасть или запчасть на складе вместе с данными для выдачи"""
+    KIND_REPAIR = 'repair'
+    KIND_PART = 'part'
+    KIND_STOCK = 'stock'
+    KIND_CHOICES = [
+        (KIND_REPAIR, 'Запись о ремонте'),
+        (KIND_PART, 'Запчасть'),
+        (KIND_STOCK, 'Запчасть на складе'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name='Тип')
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name='search_entries', verbose_name='Автомобиль')
+    # Строки индекса удаляются каскадом вместе с объектами
+    repair_record = models.ForeignKey(RepairRecord, on_delete=models.CASCADE, null=True, blank=True,
+                                      related_name='search_entries', verbose_name='Запись о ремонте')
+    part = models.OneToOneField(Part, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='search_entry', verbose_name='Запчасть')
+    stock_part = models.OneToOneField(StockPart, on_delete=models.CASCADE, null=True, blank=True,
+                                      related_name='search_entry', verbose_name='Запчасть на складе')
+    date = models.DateField(null=True, blank=True, verbose_name='Дата')
+    text = models.TextField(verbose_name='Текст')
+    # Основы слов текста для FTS5 (SQLite); PostgreSQL индексирует text
+    terms = models.TextField(verbose_name='Основы слов')
+
+    class Meta:
+        verbose_name = 'Строка поискового индекса'
+        verbose_name_plural = 'Поисковый индекс'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['repair_record'],
+                condition=models.Q(kind='repair'),
+                name='search_entry_repair_uniq',
+            ),
+        ]
+
+    @property
+    def object_id(self):
+        return self.part_id or self.stock_part_id or self.repair_record_id
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.object_id}: {self.text[:50]}"
+
+
+class Tombstone(models.Model):
+    """Отметка об удалении автомобиля, записи о ремонте или запчасти для
+    синхронизации клиентов (см. sync.py)"""
+    KIND_CAR = 'car'
+    KIND_REPAIR = 'repair'
+    KIND_PART = 'part'
+    KIND_STOCK = 'stock'
+    KIND_CHOICES = [
+        (KIND_CAR, 'Автомобиль'),
+        (KIND_REPAIR, 'Запись о ремонте'),
+        (KIND_PART, 'Запчасть'),
+        (KIND_STOCK, 'Запчасть на складе'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones', verbose_name='Пользователь')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, verbose_name='Тип')
+    object_id = models.BigIntegerField(verbose_name='ID объекта')
+    deleted_at = models.DateTimeField(auto_now_add=True, verbose_name='Удалено')
+
+    class Meta:
+        verbose_name = 'Отметка об удалении'
+        verbose_name_plural = 'Отметки об удалении'
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.object_id}"
+
+
+def hash_token(key):
+    """Хэш ключа токена API: в базе хранится только он"""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ApiTokenManager(models.Manager):
+    def issue(self, user, name=''):
+        """Новый токен пользователя; возвращает (токен, ключ). Ключ виден
+        только здесь - в базе остается хэш."""
+        key = secrets.token_urlsafe(32)
+        token = self.create(user=user, name=name, key_hash=hash_token(key), prefix=key[:ApiToken.PREFIX_LENGTH])
+        return token, key
+
+
+class ApiToken(models.Model):
+    """Токен API для интеграций: заголовок Authorization: Bearer <ключ>
+    (authentication.py). Отзывается удалением."""
+    PREFIX_LENGTH = 8
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens', verbose_name='Пользователь')
+    name = models.CharField(max_length=100, blank=True, verbose_name='Название')
+    key_hash = models.CharField(max_length=64, unique=True, verbose_name='Хэш ключа')
+    # Начало ключа, чтобы отличать токены в админке
+    prefix = models.CharField(max_length=PREFIX_LENGTH, verbose_name='Начало ключа')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создан')
+
+    objects = ApiTokenManager()
+
+    class Meta:
+        verbose_name = 'Токен API'
+        verbose_name_plural = 'Токены API'
+
+    def __str__(self):
+        return f"{self.prefix}… ({self.name or self.user})"
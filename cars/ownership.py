@@ -0,0 +1,97 @@
+"""Объекты пользователя по вложенным маршрутам API одним запросом
+
+Маршруты /api/cars/<car_id>/repairs/<record_id>/parts/<part_id>/ и т.п.
+раньше проходили иерархию по одному запросу на уровень: автомобиль, запись
+о ремонте, запчасть. get_owned() и aget_owned() загружают только целевой
+объект, а автомобиль, запись о ремонте и принадлежность пользователю
+проверяют соединением в том же запросе; автомобиль (и запись для запчасти)
+приходит через select_related.
+
+Если объект не найден, NotOwned несет прежний текст ответа 404. Чтобы
+отличить «автомобиль не найден» от «запись не найдена», выполняется второй
+запрос - только в этом случае.
+"""
+from .models import Car, Part, RepairRecord, ReportJob, StockPart
+
+CAR_NOT_FOUND = 'Автомобиль не найден'
+
+# Путь от модели к автомобилю
+CAR_PATHS = {
+    RepairRecord: 'car',
+    StockPart: 'car',
+    ReportJob: 'car',
+    Part: 'repair_record__car',
+}
+
+# Текст ответа 404, если автомобиль пользователя есть, а объекта нет
+NOT_FOUND_MESSAGES = {
+    Car: CAR_NOT_FOUND,
+    RepairRecord: 'Запись о ремонте не найдена',
+    StockPart: 'Запчасть на складе не найдена',
+    ReportJob: 'Задание не найдено',
+}
+
+# Для запчасти ответ один на любой уровень иерархии
+PART_NOT_FOUND = 'Не найдено'
+
+
+class NotOwned(Exception):
+    """Объект не найден среди объектов пользователя; message - текст ответа 404"""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def owned_queryset(model, user, car_id, record_id=None, queryset=None):
+    """Объекты model автомобиля car_id пользователя user (для запчастей -
+    записи record_id) с автомобилем через select_related"""
+    if queryset is None:
+        queryset = model._default_manager.all()
+    if model is Car:
+        return queryset.filter(pk=car_id, user=user)
+    path = CAR_PATHS[model]
+    queryset = queryset.select_related(path).filter(**{
+        f'{path}_id': car_id,
+        f'{path}__user': user,
+        # Автомобиль, удаляемый в фоне, скрыт вместе с историей (deletion.py)
+        f'{path}__deleting_since__isnull': True,
+    })
+    if record_id is not None:
+        queryset = queryset.filter(repair_record_id=record_id)
+    return queryset
+
+
+def _target(model, user, car_id, pk, record_id, queryset):
+    queryset = owned_queryset(model, user, car_id, record_id, queryset)
+    return queryset if model is Car else queryset.filter(pk=pk)
+
+
+def _user_car(user, car_id):
+    return Car.objects.filter(pk=car_id, user=user)
+
+
+def get_owned(model, user, car_id, pk=None, record_id=None, queryset=None):
+    """Объект model с ключом pk (для автомобиля - car_id) или NotOwned"""
+    try:
+        return _target(model, user, car_id, pk, record_id, queryset).get()
+    except model.DoesNotExist:
+        pass
+    if model is Part:
+        raise NotOwned(PART_NOT_FOUND)
+    if model is not Car and _user_car(user, car_id).exists():
+        raise NotOwned(NOT_FOUND_MESSAGES[model])
+    raise NotOwned(CAR_NOT_FOUND)
+
+
+async def aget_owned(model, user, car_id, pk=None, record_id=None, queryset=None):
+    """get_owned() для асинхронных представлений"""
+    try:
+        return await _target(model, user, car_id, pk, record_id, queryset).aget()
+    except model.DoesNotExist:
+        pass
+    if model is Part:
+        raise NotOwned(PART_NOT_FOUND)
+    if model is not Car and await _user_car(user, car_id).aexists():
+        raise NotOwned(NOT_FOUND_MESSAGES[model])
+    raise NotOwned(CAR_NOT_FOUND)
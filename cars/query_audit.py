@@ -0,0 +1,141 @@
+"""Проверка планов запросов API
+
+Каждый GET-маршрут из car_garage/urls.py вызывается тестовым клиентом, все
+выполненные запросы к таблицам приложения прогоняются через EXPLAIN, и
+полный просмотр таблицы (SQLite: SCAN, PostgreSQL: Seq Scan) считается
+ошибкой.
+"""
+import re
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .models import Car
+
+APP_TABLE_PREFIX = 'cars_'
+
+# Виртуальная таблица FTS5 читается по своему индексу, это не полный просмотр
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)\b(?! VIRTUAL TABLE)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+AUDIT_CACHE_ALIAS = 'query-audit'
+
+
+def audited_requests(car):
+    """(маршрут, URL) для всех GET-маршрутов API по автомобилю"""
+    record = car.repair_records.order_by('-date', '-created_at').first()
+    stock_part = car.stock_parts.first()
+    last_date = record.date.isoformat() if record else '2100-01-01'
+    requests = [
+        ('car-list', reverse('car-list')),
+        ('car-list', reverse('car-list') + '?page_size=2&fields=id,brand,model'),
+        ('car-list', reverse('car-list') + '?with_summary=1&page_size=2'),
+        # Имя 'car-detail' занято и API, и страницей автомобиля
+        ('car-detail', f"{reverse('car-list')}{car.pk}/"),
+        ('repair-record-list', reverse('repair-record-list', args=[car.pk])),
+        ('repair-record-list', reverse('repair-record-list', args=[car.pk]) + '?page_size=20'),
+        ('repair-record-list', reverse('repair-record-list', args=[car.pk]) + f'?date_from=2000-01-01&date_to={last_date}'),
+        ('stock-part-list', reverse('stock-part-list', args=[car.pk])),
+        ('stock-part-list', reverse('stock-part-list', args=[car.pk]) + '?page_size=2'),
+        ('car-stats', reverse('car-stats', args=[car.pk])),
+        ('car-stats', reverse('car-stats', args=[car.pk]) + f'?date_from=2000-01-01&date_to={last_date}'),
+        ('export-report', reverse('export-report', args=[car.pk]) + f'?date_from=2000-01-01&date_to={last_date}'),
+        ('fleet-report', reverse('fleet-report') + f'?date_from=2000-01-01&date_to={last_date}'),
+        ('report-job-list', reverse('report-job-list', args=[car.pk])),
+    ]
+    if record is not None:
+        query = record.work_description.split()[0]
+        requests.append(('search', reverse('search') + '?' + urlencode({'q': query})))
+        requests.append(('search', reverse('search') + '?' + urlencode({'q': query, 'kind': 'repair', 'car_id': car.pk})))
+    if record is not None:
+        requests.append(('repair-record-detail', reverse('repair-record-detail', args=[car.pk, record.pk])))
+    if stock_part is not None:
+        requests.append(('stock-part-detail', reverse('stock-part-detail', args=[car.pk, stock_part.pk])))
+    job = car.report_jobs.first()
+    if job is not None:
+        requests.append(('report-job-detail', reverse('report-job-detail', args=[car.pk, job.pk])))
+        requests.append(('report-job-download', reverse('report-job-download', args=[car.pk, job.pk])))
+    return requests
+
+
+def explain(sql):
+    """План запроса в виде списка строк"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN {sql}')
+        return [row[0] for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    """Таблицы приложения, которые план читает целиком"""
+    pattern = SQLITE_SCAN if connection.vendor == 'sqlite' else POSTGRES_SCAN
+    tables = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match and match.group(1).startswith(APP_TABLE_PREFIX):
+            tables.append(match.group(1))
+    return tables
+
+
+def _follow_next_page(client, url, response):
+    """Запрашивает вторую страницу, чтобы проверить и запрос с курсором"""
+    if 'page_size' not in url or response.status_code != 200:
+        return
+    next_url = response.json().get('next')
+    if next_url:
+        client.get(next_url)
+
+
+def audit_query_plans(car):
+    """Возвращает список проблем: {'route', 'url', 'sql', 'tables', 'plan'}"""
+    client = Client(HTTP_HOST='localhost')
+    client.force_login(car.user)
+
+    caches = {**settings.CACHES, AUDIT_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    problems = []
+    # Кэш ответов отключен, иначе повторные запросы не дойдут до БД; отчет
+    # строится в потоке запроса, чтобы его запросы попали в проверку
+    with override_settings(CACHES=caches, API_CACHE_ALIAS=AUDIT_CACHE_ALIAS, REPORT_WORKERS=0,
+                           ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'localhost']):
+        for route, url in audited_requests(car):
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get(url)
+                if hasattr(response, 'streaming_content'):
+                    b''.join(response.streaming_content)
+                _follow_next_page(client, url, response)
+            if response.status_code != 200:
+                raise AssertionError(f'{url} вернул {response.status_code}')
+
+            for query in ctx.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith('SELECT') or APP_TABLE_PREFIX not in sql:
+                    continue
+                plan = explain(sql)
+                tables = full_scans(plan)
+                if tables:
+                    problems.append({'route': route, 'url': url, 'sql': sql, 'tables': tables, 'plan': plan})
+    return problems
+
+
+def audit_car():
+    """Автомобиль с наибольшей историей ремонтов - для проверки по существующим данным"""
+    return (
+        Car.objects
+        .annotate(records_count=Count('repair_records'))
+        .order_by('-records_count')
+        .select_related('user')
+        .first()
+    )
+
+
+def analyze():
+    """Обновляет статистику планировщика после загрузки данных"""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
@@ -0,0 +1,42 @@
+"""JSON-рендерер на orjson с тем же выводом, что у JSONRenderer DRF
+
+DRF (настройки по умолчанию) пишет компактный JSON без экранирования
+не-ASCII символов и экранирует только U+2028/U+2029; orjson дает те же байты
+для строк, чисел, списков и словарей. Остальные типы (Decimal, даты, ленивые
+строки) orjson передает в JSONEncoder.default из DRF, поэтому они
+форматируются как раньше. Если данные orjson не принимает (например, ключи
+словаря не строки), используется JSONRenderer DRF.
+"""
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+# orjson по умолчанию сам форматирует даты и dataclass; здесь они идут в
+# JSONEncoder.default, как в DRF
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def render_json(data):
+    """Байты JSON, совпадающие с JSONRenderer().render(data)"""
+    if data is None:
+        return b''
+    try:
+        content = orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+    except (orjson.JSONEncodeError, TypeError):
+        return JSONRenderer().render(data)
+    # Как в DRF: символы, недопустимые в JavaScript-строках без экранирования
+    return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson; с отступами (Accept: ...; indent=) и
+    нестандартными настройками DRF работает как базовый класс"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        if (self.get_indent(accepted_media_type, renderer_context) is not None
+                or self.ensure_ascii or not self.compact or not self.strict or self.encoder_class is not JSONEncoder):
+            return super().render(data, accepted_media_type, renderer_context)
+        return render_json(data)
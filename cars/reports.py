@@ -0,0 +1,365 @@
+"""Формирование отчетов о ремонте в Excel
+
+Отчеты строятся в потоковом режиме: книга openpyxl создается с write_only=True,
+строки пишутся по одной из итератора, а запчасти подгружаются пачками вместе с
+записями о ремонте. Поэтому потребление памяти не зависит от размера отчета.
+
+Сводный отчет по нескольким автомобилям (build_fleet_report) строится тем же
+способом: итоги для сводного листа считаются в БД, а записи о ремонте всех
+автомобилей читаются одним потоком, отсортированным по автомобилю, и
+раскладываются по листам. Число запросов не зависит от числа автомобилей.
+"""
+import asyncio
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import attrgetter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, Sum
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+
+from .models import RepairRecord, Part, prefetch_parts
+from .stats import MONEY_FIELD, ZERO, line_cost
+
+REPORT_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Сколько записей о ремонте загружать из БД за один запрос
+REPORT_CHUNK_SIZE = 500
+
+HEADER_FILL = PatternFill(start_color="00BFA5", end_color="00BFA5", fill_type="solid")
+HEADER_FONT = Font(bold=True, color="FFFFFF", size=12)
+TITLE_FONT = Font(bold=True, size=14)
+SUBTITLE_FONT = Font(size=11)
+TOTAL_LABEL_FONT = Font(bold=True, size=12)
+TOTAL_FONT = Font(bold=True)
+BORDER = Border(
+    left=Side(style='thin'),
+    right=Side(style='thin'),
+    top=Side(style='thin'),
+    bottom=Side(style='thin')
+)
+CENTER_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+MONEY_FORMAT = '#,##0.00'
+
+HEADERS = ['Дата', 'Пробег (км)', 'Выполненные работы', 'Стоимость работ (₽)', 'Запчасти', 'Стоимость запчастей (₽)']
+COLUMN_WIDTHS = {'A': 12, 'B': 15, 'C': 40, 'D': 20, 'E': 30, 'F': 20}
+
+# Первая строка с данными (после заголовка отчета и шапки таблицы)
+FIRST_DATA_ROW = 6
+
+SUMMARY_HEADERS = ['Автомобиль', 'VIN', 'Записей о ремонте', 'Стоимость работ (₽)', 'Стоимость запчастей (₽)',
+                   'Общая стоимость (₽)']
+SUMMARY_COLUMN_WIDTHS = {'A': 30, 'B': 22, 'C': 18, 'D': 20, 'E': 24, 'F': 20}
+
+# Ограничения Excel на имя листа
+SHEET_TITLE_MAX_LENGTH = 31
+SHEET_TITLE_FORBIDDEN = re.compile(r'[\\/*?:\[\]]')
+
+
+def styled_cell(ws, value, font=None, fill=None, border=None, alignment=None, number_format=None):
+    """Ячейка для write-only листа с заданным оформлением"""
+    cell = WriteOnlyCell(ws, value=value)
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if border is not None:
+        cell.border = border
+    if alignment is not None:
+        cell.alignment = alignment
+    if number_format is not None:
+        cell.number_format = number_format
+    return cell
+
+
+def report_repairs(car, date_from, date_to):
+    """Итератор по записям о ремонте за период с подгруженными запчастями"""
+    repairs = RepairRecord.objects.filter(
+        car=car,
+        date__gte=date_from,
+        date__lte=date_to
+    ).order_by('date').prefetch_related(prefetch_parts())
+    return repairs.iterator(chunk_size=REPORT_CHUNK_SIZE)
+
+
+def iter_repair_rows(repairs):
+    """Строки таблицы отчета: (дата, пробег, работы, стоимость работ, запчасти, стоимость запчастей)"""
+    for repair in repairs:
+        parts = repair.parts.all()
+        parts_cost = sum(float(part.cost) * (part.quantity or 1) for part in parts)
+        parts_list = ', '.join([f"{part.name} ({part.part_code}) x{part.quantity or 1}" for part in parts])
+        yield (
+            repair.date.strftime('%d.%m.%Y'),
+            repair.mileage,
+            repair.work_description,
+            float(repair.work_cost),
+            parts_list if parts_list else '-',
+            float(parts_cost),
+        )
+
+
+def write_repair_sheet(ws, car, date_from, date_to, repairs):
+    """Заполняет write-only лист отчета по автомобилю.
+
+    Возвращает кортеж (стоимость работ, стоимость запчастей) за период.
+    """
+    # Ширины колонок должны быть заданы до записи первой строки
+    for column, width in COLUMN_WIDTHS.items():
+        ws.column_dimensions[column].width = width
+
+    ws.append([styled_cell(ws, f"Отчет о ремонте: {car.brand} {car.model}", font=TITLE_FONT)])
+    ws.merged_cells.add('A1:F1')
+    ws.append([styled_cell(ws, f"VIN: {car.vin}", font=SUBTITLE_FONT)])
+    ws.merged_cells.add('A2:F2')
+    ws.append([styled_cell(
+        ws,
+        f"Период: {date_from.strftime('%d.%m.%Y')} - {date_to.strftime('%d.%m.%Y')}",
+        font=SUBTITLE_FONT
+    )])
+    ws.merged_cells.add('A3:F3')
+    ws.append([])
+
+    ws.append([
+        styled_cell(ws, header, font=HEADER_FONT, fill=HEADER_FILL, border=BORDER, alignment=CENTER_ALIGNMENT)
+        for header in HEADERS
+    ])
+
+    row = FIRST_DATA_ROW
+    total_work_cost = 0
+    total_parts_cost = 0
+
+    for date, mileage, description, work_cost, parts_list, parts_cost in iter_repair_rows(repairs):
+        ws.append([
+            styled_cell(ws, date, border=BORDER),
+            styled_cell(ws, mileage, border=BORDER),
+            styled_cell(ws, description, border=BORDER),
+            styled_cell(ws, work_cost, border=BORDER, number_format=MONEY_FORMAT),
+            styled_cell(ws, parts_list, border=BORDER),
+            styled_cell(ws, parts_cost, border=BORDER, number_format=MONEY_FORMAT),
+        ])
+        total_work_cost += work_cost
+        total_parts_cost += parts_cost
+        row += 1
+
+    # Итоги
+    ws.append([])
+    row += 1
+    ws.append([
+        None,
+        None,
+        styled_cell(ws, "ИТОГО:", font=TOTAL_LABEL_FONT),
+        styled_cell(ws, float(total_work_cost), font=TOTAL_FONT, number_format=MONEY_FORMAT),
+        None,
+        styled_cell(ws, float(total_parts_cost), font=TOTAL_FONT, number_format=MONEY_FORMAT),
+    ])
+
+    row += 1
+    ws.append([
+        None,
+        None,
+        styled_cell(ws, "ОБЩАЯ СТОИМОСТЬ:", font=TOTAL_LABEL_FONT),
+        None,
+        styled_cell(ws, float(total_work_cost + total_parts_cost), font=TOTAL_LABEL_FONT, number_format=MONEY_FORMAT),
+    ])
+    ws.merged_cells.add(f'C{row}:D{row}')
+    ws.merged_cells.add(f'E{row}:F{row}')
+
+    return total_work_cost, total_parts_cost
+
+
+def build_repair_report(car, date_from, date_to):
+    """Строит отчет по автомобилю и возвращает его во временном файле.
+
+    Файл открыт и установлен на начало; закрыть его должен вызывающий код
+    (например, FileResponse при отдаче клиенту).
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Отчет о ремонте")
+    write_repair_sheet(ws, car, date_from, date_to, report_repairs(car, date_from, date_to))
+    return save_workbook(wb)
+
+
+def sheet_title(car):
+    """Уникальное имя листа автомобиля (ID в начале, не длиннее 31 символа)"""
+    title = SHEET_TITLE_FORBIDDEN.sub(' ', f"{car.pk} {car.brand} {car.model}")
+    return title[:SHEET_TITLE_MAX_LENGTH].strip()
+
+
+def fleet_totals(cars, date_from, date_to):
+    """Итоги за период по автомобилям: {car_id: (записей, работы, запчасти)}.
+
+    Два агрегирующих запроса на все автомобили сразу.
+    """
+    records = (
+        RepairRecord.objects
+        .filter(car__in=cars, date__gte=date_from, date__lte=date_to)
+        .values('car_id')
+        .annotate(records_count=Count('id'), work_cost=Sum('work_cost'))
+        .order_by()
+    )
+    parts_cost = dict(
+        Part.objects
+        .filter(repair_record__car__in=cars, repair_record__date__gte=date_from, repair_record__date__lte=date_to)
+        .values('repair_record__car_id')
+        .annotate(parts_cost=Sum(line_cost(), output_field=MONEY_FIELD))
+        .order_by()
+        .values_list('repair_record__car_id', 'parts_cost')
+    )
+    return {
+        row['car_id']: (row['records_count'], row['work_cost'] or ZERO, parts_cost.get(row['car_id']) or ZERO)
+        for row in records
+    }
+
+
+def write_summary_sheet(ws, cars, totals, date_from, date_to):
+    """Заполняет write-only сводный лист: строка на автомобиль и общий итог"""
+    for column, width in SUMMARY_COLUMN_WIDTHS.items():
+        ws.column_dimensions[column].width = width
+
+    ws.append([styled_cell(ws, "Сводный отчет о ремонте", font=TITLE_FONT)])
+    ws.merged_cells.add('A1:F1')
+    ws.append([styled_cell(ws, f"Автомобилей: {len(cars)}", font=SUBTITLE_FONT)])
+    ws.merged_cells.add('A2:F2')
+    ws.append([styled_cell(
+        ws,
+        f"Период: {date_from.strftime('%d.%m.%Y')} - {date_to.strftime('%d.%m.%Y')}",
+        font=SUBTITLE_FONT
+    )])
+    ws.merged_cells.add('A3:F3')
+    ws.append([])
+
+    ws.append([
+        styled_cell(ws, header, font=HEADER_FONT, fill=HEADER_FILL, border=BORDER, alignment=CENTER_ALIGNMENT)
+        for header in SUMMARY_HEADERS
+    ])
+
+    fleet_records = 0
+    fleet_work_cost = ZERO
+    fleet_parts_cost = ZERO
+    for car in cars:
+        records_count, work_cost, parts_cost = totals.get(car.pk, (0, ZERO, ZERO))
+        ws.append([
+            styled_cell(ws, f"{car.brand} {car.model}", border=BORDER),
+            styled_cell(ws, car.vin, border=BORDER),
+            styled_cell(ws, records_count, border=BORDER),
+            styled_cell(ws, float(work_cost), border=BORDER, number_format=MONEY_FORMAT),
+            styled_cell(ws, float(parts_cost), border=BORDER, number_format=MONEY_FORMAT),
+            styled_cell(ws, float(work_cost + parts_cost), border=BORDER, number_format=MONEY_FORMAT),
+        ])
+        fleet_records += records_count
+        fleet_work_cost += work_cost
+        fleet_parts_cost += parts_cost
+
+    ws.append([])
+    ws.append([
+        styled_cell(ws, "ИТОГО:", font=TOTAL_LABEL_FONT),
+        None,
+        styled_cell(ws, fleet_records, font=TOTAL_FONT),
+        styled_cell(ws, float(fleet_work_cost), font=TOTAL_FONT, number_format=MONEY_FORMAT),
+        styled_cell(ws, float(fleet_parts_cost), font=TOTAL_FONT, number_format=MONEY_FORMAT),
+        styled_cell(ws, float(fleet_work_cost + fleet_parts_cost), font=TOTAL_LABEL_FONT, number_format=MONEY_FORMAT),
+    ])
+
+
+def fleet_repairs(cars, date_from, date_to):
+    """Записи о ремонте всех автомобилей одним потоком, по автомобилям и датам"""
+    repairs = RepairRecord.objects.filter(
+        car__in=cars,
+        date__gte=date_from,
+        date__lte=date_to
+    ).order_by('car_id', 'date', 'id').prefetch_related(prefetch_parts())
+    return repairs.iterator(chunk_size=REPORT_CHUNK_SIZE)
+
+
+def build_fleet_report(cars, date_from, date_to):
+    """Строит сводный отчет по автомобилям (QuerySet) и возвращает его во
+    временном файле: сводный лист и по листу на каждый автомобиль.
+
+    Листы пишутся по очереди и закрываются сразу после заполнения, поэтому
+    в памяти и открытых файлах держится только текущий лист.
+    """
+    cars = cars.order_by('pk')
+    car_list = list(cars.only('id', 'user', 'brand', 'model', 'vin'))
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Сводка")
+    write_summary_sheet(ws, car_list, fleet_totals(cars, date_from, date_to), date_from, date_to)
+    ws.close()
+
+    groups = groupby(fleet_repairs(cars, date_from, date_to), key=attrgetter('car_id'))
+    group = next(groups, None)
+    for car in car_list:
+        repairs = ()
+        if group is not None and group[0] == car.pk:
+            repairs = group[1]
+        ws = wb.create_sheet(title=sheet_title(car))
+        write_repair_sheet(ws, car, date_from, date_to, repairs)
+        ws.close()
+        if repairs:
+            # Записи автомобиля прочитаны целиком - переходим к следующему
+            group = next(groups, None)
+    return save_workbook(wb)
+
+
+_report_executor = None
+_report_executor_lock = threading.Lock()
+
+
+def report_executor():
+    """Пул потоков для построения отчетов (settings.REPORT_WORKERS потоков)"""
+    global _report_executor
+    with _report_executor_lock:
+        if _report_executor is None:
+            _report_executor = ThreadPoolExecutor(max_workers=settings.REPORT_WORKERS, thread_name_prefix='report')
+    return _report_executor
+
+
+def _build_in_worker(build, *args):
+    # Поток пула живет дольше запроса: соединения с БД закрываются так же,
+    # как в конце обычного запроса
+    close_old_connections()
+    try:
+        return build(*args)
+    finally:
+        close_old_connections()
+
+
+async def abuild_report(build, *args):
+    """Вызов build(*args) (build_repair_report, build_fleet_report) для
+    асинхронных представлений.
+
+    Книга строится в пуле потоков, цикл событий в это время обслуживает
+    другие запросы. При REPORT_WORKERS = 0 отчет строится в потоке
+    синхронного кода запроса (так его видят незафиксированные данные тестов).
+    """
+    if not settings.REPORT_WORKERS:
+        return await sync_to_async(build)(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(report_executor(), _build_in_worker, build, *args)
+
+
+async def abuild_repair_report(car, date_from, date_to):
+    return await abuild_report(build_repair_report, car, date_from, date_to)
+
+
+def save_workbook(wb):
+    """Сохраняет книгу во временный файл на диске и возвращает его"""
+    output = tempfile.TemporaryFile()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+def report_filename(car, date_from, date_to):
+    return f"report_{car.brand}_{car.model}_{date_from.strftime('%Y%m%d')}_{date_to.strftime('%Y%m%d')}.xlsx"
+
+
+def fleet_report_filename(date_from, date_to):
+    return f"fleet_report_{date_from.strftime('%Y%m%d')}_{date_to.strftime('%Y%m%d')}.xlsx"
@@ -0,0 +1,365 @@
+"""Предрасчитанные итоги расходов по автомобилю
+
+CarRollup - итоги по автомобилю (записи, запчасти, стоимость работ и
+запчастей, последний пробег и дата обслуживания), CarMonthRollup - то же по
+месяцам. Итоги меняются приращениями в той же транзакции, что и данные:
+- save()/delete() записей о ремонте и запчастей - через сигналы (signals.py);
+- bulk_create - явным вызовом rollup_new_objects().
+
+Счетчики и суммы меняются выражениями F(), поэтому параллельные транзакции
+не теряют изменений друг друга. Пробег и дата при добавлении только растут;
+после удаления или изменения записи они пересчитываются по записям месяца и
+автомобиля.
+
+Внутри batch() изменения от сигналов копятся и записываются одним набором
+запросов при выходе - для операций над многими объектами сразу.
+
+check_rollups() сравнивает итоги с исходными таблицами, rebuild_rollups()
+пересчитывает их заново (manage.py rebuild_rollups).
+"""
+import threading
+from contextlib import contextmanager
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least, TruncMonth
+
+from .models import Car, CarMonthRollup, CarRollup, Part, RepairRecord
+from .stats import MONEY_FIELD, ZERO, line_cost
+
+# Для скольких автомобилей пересчитывать итоги за один проход
+ROLLUP_BATCH_SIZE = 500
+
+COUNTERS = ('records_count', 'parts_count', 'work_cost', 'parts_cost')
+
+_local = threading.local()
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _field_value(model, field, value):
+    # Значения из create(date='2024-01-01') и т.п. приводятся к типу поля
+    return model._meta.get_field(field).to_python(value)
+
+
+class RollupChanges:
+    """Приращения итогов по (автомобиль, месяц); apply() записывает их в БД"""
+
+    def __init__(self):
+        self.months = {}
+        # Месяцы и автомобили, где после удаления нужно пересчитать пробег и дату
+        self.stale = set()
+        # (car_id, date) записей о ремонте, уже прочитанные для запчастей
+        self.records = {}
+
+    def _bucket(self, car_id, day):
+        return self.months.setdefault((car_id, month_start(day)), {
+            'records_count': 0, 'parts_count': 0, 'work_cost': ZERO, 'parts_cost': ZERO,
+            'mileages': [], 'dates': [],
+        })
+
+    def add_record(self, car_id, day, mileage, work_cost, sign=1):
+        day = _field_value(RepairRecord, 'date', day)
+        bucket = self._bucket(car_id, day)
+        bucket['records_count'] += sign
+        bucket['work_cost'] += sign * _field_value(RepairRecord, 'work_cost', work_cost)
+        if sign > 0:
+            bucket['mileages'].append(_field_value(RepairRecord, 'mileage', mileage))
+            bucket['dates'].append(day)
+        else:
+            self.stale.add((car_id, month_start(day)))
+
+    def add_parts(self, car_id, day, count, cost, sign=1):
+        """count запчастей общей стоимостью cost (цена * количество)"""
+        bucket = self._bucket(car_id, _field_value(RepairRecord, 'date', day))
+        bucket['parts_count'] += sign * count
+        bucket['parts_cost'] += sign * cost
+
+    def add_part(self, car_id, day, cost, quantity, sign=1):
+        cost = _field_value(Part, 'cost', cost) * _field_value(Part, 'quantity', quantity)
+        self.add_parts(car_id, day, 1, cost, sign)
+
+    def apply(self):
+        cars = {}
+        for (car_id, month), bucket in self.months.items():
+            car = cars.setdefault(car_id, {'records_count': 0, 'parts_count': 0, 'work_cost': ZERO,
+                                           'parts_cost': ZERO, 'mileages': [], 'dates': []})
+            for key in COUNTERS:
+                car[key] += bucket[key]
+            car['mileages'].extend(bucket['mileages'])
+            car['dates'].extend(bucket['dates'])
+
+            updates = _counter_updates(bucket)
+            if bucket['mileages']:
+                low, high = min(bucket['mileages']), max(bucket['mileages'])
+                updates['min_mileage'] = Least(Coalesce(F('min_mileage'), Value(low)), Value(low))
+                updates['max_mileage'] = Greatest(Coalesce(F('max_mileage'), Value(high)), Value(high))
+            _update_or_create(CarMonthRollup, {'car_id': car_id, 'month': month}, updates, _adds(bucket))
+
+        for car_id, car in cars.items():
+            updates = _counter_updates(car)
+            if car['mileages']:
+                mileage, day = max(car['mileages']), max(car['dates'])
+                updates['last_mileage'] = Greatest(Coalesce(F('last_mileage'), Value(mileage)), Value(mileage))
+                updates['last_service_date'] = Greatest(Coalesce(F('last_service_date'), Value(day)), Value(day))
+            _update_or_create(CarRollup, {'car_id': car_id}, updates, _adds(car))
+
+        for car_id, month in self.stale:
+            records = RepairRecord.objects.filter(car_id=car_id, date__gte=month, date__lt=next_month(month))
+            rollups = CarMonthRollup.objects.filter(car_id=car_id, month=month)
+            rollups.update(**records.aggregate(min_mileage=Min('mileage'), max_mileage=Max('mileage')))
+            rollups.filter(records_count__lte=0, parts_count__lte=0).delete()
+        for car_id in {car_id for car_id, _ in self.stale}:
+            CarRollup.objects.filter(car_id=car_id).update(**RepairRecord.objects.filter(car_id=car_id).aggregate(
+                last_mileage=Max('mileage'), last_service_date=Max('date'),
+            ))
+
+
+def _counter_updates(bucket):
+    return {key: F(key) + bucket[key] for key in COUNTERS if bucket[key]}
+
+
+def _adds(bucket):
+    return bucket['records_count'] > 0 or bucket['parts_count'] > 0
+
+
+def _update_or_create(model, lookup, updates, create):
+    """Применяет приращения к строке итогов. Недостающая строка создается
+    только для добавленных данных: вычитать из строки, удаленной вместе с
+    автомобилем, нечего."""
+    if not updates or model.objects.filter(**lookup).update(**updates):
+        return
+    if create:
+        model.objects.bulk_create([model(**lookup)], ignore_conflicts=True)
+        model.objects.filter(**lookup).update(**updates)
+
+
+@contextmanager
+def batch():
+    """Копит изменения итогов от сигналов и rollup_new_objects() и применяет
+    их при выходе. Вложенный batch() входит во внешний; при исключении
+    изменения отбрасываются вместе с транзакцией."""
+    if getattr(_local, 'changes', None) is not None:
+        yield _local.changes
+        return
+    changes = _local.changes = RollupChanges()
+    try:
+        yield changes
+    finally:
+        _local.changes = None
+    changes.apply()
+
+
+def _current_changes():
+    return getattr(_local, 'changes', None) or RollupChanges()
+
+
+def _finish(changes):
+    if changes is not getattr(_local, 'changes', None):
+        changes.apply()
+
+
+def _record_info(changes, record_id):
+    """(car_id, date) записи о ремонте или None"""
+    if record_id not in changes.records:
+        changes.records[record_id] = (
+            RepairRecord.objects.filter(pk=record_id).values_list('car_id', 'date').first()
+        )
+    return changes.records[record_id]
+
+
+def _part_record_info(changes, part):
+    if Part.repair_record.is_cached(part):
+        return part.repair_record.car_id, part.repair_record.date
+    return _record_info(changes, part.repair_record_id)
+
+
+def part_record_info(part):
+    """(car_id, date) записи о ремонте запчасти или None; внутри batch()
+    запись читается из БД один раз на пакет"""
+    return _part_record_info(_current_changes(), part)
+
+
+def previous_state(instance):
+    """Значения объекта в БД до save(), от которых зависят итоги"""
+    if instance._state.adding or instance.pk is None:
+        return None
+    if isinstance(instance, RepairRecord):
+        fields = ('car_id', 'date', 'mileage', 'work_cost')
+    else:
+        fields = ('repair_record_id', 'cost', 'quantity')
+    return type(instance).objects.filter(pk=instance.pk).values_list(*fields).first()
+
+
+def object_saved(instance, previous):
+    """Учитывает в итогах созданную или измененную запись о ремонте или запчасть"""
+    changes = _current_changes()
+    if isinstance(instance, RepairRecord):
+        changes.records.pop(instance.pk, None)
+        current = (instance.car_id, _field_value(RepairRecord, 'date', instance.date),
+                   instance.mileage, _field_value(RepairRecord, 'work_cost', instance.work_cost))
+        if previous == current:
+            return
+        if previous is not None:
+            car_id, day, mileage, work_cost = previous
+            changes.add_record(car_id, day, mileage, work_cost, sign=-1)
+            if (car_id, month_start(day)) != (current[0], month_start(current[1])):
+                # Запчасти записи переходят в итоги другого месяца
+                parts = instance.parts.aggregate(
+                    count=Count('id'), cost=Coalesce(Sum(line_cost(), output_field=MONEY_FIELD), ZERO, output_field=MONEY_FIELD),
+                )
+                changes.add_parts(car_id, day, parts['count'], parts['cost'], sign=-1)
+                changes.add_parts(current[0], current[1], parts['count'], parts['cost'])
+        changes.add_record(instance.car_id, instance.date, instance.mileage, instance.work_cost)
+    else:
+        current = (instance.repair_record_id, _field_value(Part, 'cost', instance.cost),
+                   _field_value(Part, 'quantity', instance.quantity))
+        if previous == current:
+            return
+        record = _part_record_info(changes, instance)
+        if previous is not None:
+            record_id, cost, quantity = previous
+            old_record = record if record_id == instance.repair_record_id else _record_info(changes, record_id)
+            if old_record is not None:
+                changes.add_part(*old_record, cost, quantity, sign=-1)
+        if record is not None:
+            changes.add_part(*record, instance.cost, instance.quantity)
+    _finish(changes)
+
+
+def object_deleted(instance):
+    """Вычитает из итогов удаленную запись о ремонте или запчасть.
+
+    При удалении записи ее запчасти удаляются раньше и вычитаются сами.
+    """
+    changes = _current_changes()
+    if isinstance(instance, RepairRecord):
+        changes.records.pop(instance.pk, None)
+        changes.add_record(instance.car_id, instance.date, instance.mileage, instance.work_cost, sign=-1)
+    else:
+        record = _part_record_info(changes, instance)
+        if record is not None:
+            changes.add_part(*record, instance.cost, instance.quantity, sign=-1)
+    _finish(changes)
+
+
+def rollup_new_objects(records=(), parts=()):
+    """Учитывает записи о ремонте и запчасти, созданные через bulk_create
+    (post_save не отправляется). У запчастей должна быть загружена
+    repair_record."""
+    changes = _current_changes()
+    for record in records:
+        changes.add_record(record.car_id, record.date, record.mileage, record.work_cost)
+    for part in parts:
+        changes.add_part(part.repair_record.car_id, part.repair_record.date, part.cost, part.quantity)
+    _finish(changes)
+
+
+def expected_rollups(car_ids):
+    """Итоги по исходным таблицам: ({car_id: CarRollup}, {(car_id, month): CarMonthRollup})"""
+    months = {}
+    cars = {car_id: CarRollup(car_id=car_id) for car_id in car_ids}
+    records = (
+        RepairRecord.objects
+        .filter(car_id__in=car_ids)
+        .annotate(month=TruncMonth('date'))
+        .values('car_id', 'month')
+        .annotate(
+            records_count=Count('id'),
+            work_cost=Sum('work_cost'),
+            min_mileage=Min('mileage'),
+            max_mileage=Max('mileage'),
+            last_date=Max('date'),
+        )
+        .order_by()
+    )
+    for row in records:
+        months[(row['car_id'], row['month'])] = CarMonthRollup(
+            car_id=row['car_id'], month=row['month'], records_count=row['records_count'],
+            work_cost=row['work_cost'], parts_cost=ZERO, min_mileage=row['min_mileage'], max_mileage=row['max_mileage'],
+        )
+        car = cars[row['car_id']]
+        car.records_count += row['records_count']
+        car.work_cost += row['work_cost']
+        car.last_mileage = max(car.last_mileage or 0, row['max_mileage'])
+        car.last_service_date = max(car.last_service_date or row['last_date'], row['last_date'])
+
+    parts = (
+        Part.objects
+        .filter(repair_record__car_id__in=car_ids)
+        .annotate(car_id=F('repair_record__car_id'), month=TruncMonth('repair_record__date'))
+        .values('car_id', 'month')
+        .annotate(parts_count=Count('id'), parts_cost=Sum(line_cost(), output_field=MONEY_FIELD))
+        .order_by()
+    )
+    for row in parts:
+        month = months[(row['car_id'], row['month'])]
+        month.parts_count = row['parts_count']
+        month.parts_cost = row['parts_cost']
+        car = cars[row['car_id']]
+        car.parts_count += row['parts_count']
+        car.parts_cost += row['parts_cost']
+    return cars, months
+
+
+def _car_id_batches(cars, batch_size):
+    car_ids = list((cars if cars is not None else Car.objects.all()).order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(car_ids), batch_size):
+        yield car_ids[start:start + batch_size]
+
+
+def rebuild_rollups(cars=None, batch_size=ROLLUP_BATCH_SIZE):
+    """Пересчитывает итоги автомобилей (QuerySet) или всех автомобилей.
+
+    Возвращает (число автомобилей, число строк по месяцам).
+    """
+    cars_count = months_count = 0
+    for car_ids in _car_id_batches(cars, batch_size):
+        expected_cars, expected_months = expected_rollups(car_ids)
+        with transaction.atomic():
+            CarMonthRollup.objects.filter(car_id__in=car_ids).delete()
+            CarRollup.objects.filter(car_id__in=car_ids).delete()
+            CarRollup.objects.bulk_create(expected_cars.values())
+            CarMonthRollup.objects.bulk_create(expected_months.values())
+        cars_count += len(expected_cars)
+        months_count += len(expected_months)
+    return cars_count, months_count
+
+
+def _differences(expected, actual, fields, car_id, month=None):
+    return [
+        {'car_id': car_id, 'month': month, 'field': field,
+         'expected': getattr(expected, field), 'actual': getattr(actual, field)}
+        for field in fields if getattr(expected, field) != getattr(actual, field)
+    ]
+
+
+def check_rollups(cars=None, batch_size=ROLLUP_BATCH_SIZE):
+    """Расхождения итогов с исходными таблицами: список
+    {'car_id', 'month' (None - итоги автомобиля), 'field', 'expected', 'actual'}"""
+    car_fields = (*COUNTERS, 'last_mileage', 'last_service_date')
+    month_fields = (*COUNTERS, 'min_mileage', 'max_mileage')
+    problems = []
+    for car_ids in _car_id_batches(cars, batch_size):
+        expected_cars, expected_months = expected_rollups(car_ids)
+        actual_cars = CarRollup.objects.in_bulk(car_ids)
+        actual_months = {
+            (rollup.car_id, rollup.month): rollup
+            for rollup in CarMonthRollup.objects.filter(car_id__in=car_ids)
+        }
+        for car_id, expected in expected_cars.items():
+            # Нет строки итогов - то же, что нулевые итоги
+            actual = actual_cars.get(car_id) or CarRollup(car_id=car_id)
+            problems.extend(_differences(expected, actual, car_fields, car_id))
+        for car_id, month in sorted(expected_months.keys() | actual_months.keys()):
+            expected = expected_months.get((car_id, month)) or CarMonthRollup(car_id=car_id, month=month)
+            actual = actual_months.get((car_id, month)) or CarMonthRollup(car_id=car_id, month=month)
+            problems.extend(_differences(expected, actual, month_fields, car_id, month))
+    return problems
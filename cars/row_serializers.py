@@ -0,0 +1,165 @@
+"""Быстрая сериализация списков только на чтение из строк QuerySet.values()
+
+ModelSerializer на каждую строку создает экземпляр модели и обходит поля
+через get_attribute; для списков в тысячи строк это основная часть времени
+ответа. RowSerializer строится один раз по классу сериализатора и читает
+значения прямо из словарей .values(). Каждое значение проходит через
+to_representation того же поля сериализатора (даты в текущем часовом поясе,
+Decimal с нужным числом знаков), поэтому результат совпадает с
+serializer_class(objects, many=True).data.
+
+Вложенные списки (запчасти записей о ремонте) читаются одним запросом на
+страницу и раскладываются по родителям за один проход. Вложенный
+сериализатор с source='*' (итоги автомобиля) читает поля той же строки.
+Сериализатор с неподдерживаемыми полями (SerializerMethodField, связи и т.п.)
+вызывает UnsupportedSerializer - тогда используется обычный путь DRF.
+"""
+from rest_framework import serializers
+from rest_framework.relations import RelatedField
+
+from .serializers import DynamicFieldsMixin
+
+
+VALUE = 'value'
+INLINE = 'inline'
+NESTED_LIST = 'list'
+
+
+class UnsupportedSerializer(Exception):
+    """Сериализатор нельзя перевести на строки .values()"""
+
+
+def _lookup(model, source, annotations):
+    """Имя для .values() по source поля сериализатора"""
+    if source in annotations:
+        return source
+    # Свойства модели, хранящиеся в связанной таблице (CatalogPartMixin)
+    value_lookups = getattr(model, 'VALUE_LOOKUPS', {})
+    if source in value_lookups:
+        return value_lookups[source]
+    try:
+        field = model._meta.get_field(source)
+    except Exception:
+        raise UnsupportedSerializer(f'{model.__name__}.{source}')
+    if not field.concrete or field.is_relation:
+        raise UnsupportedSerializer(f'{model.__name__}.{source}')
+    return field.attname
+
+
+class RowSerializer:
+    """Сериализация строк .values() по полям сериализатора DRF"""
+
+    def __init__(self, serializer, model, annotations=()):
+        # Колонки в порядке полей сериализатора: (VALUE, ключ ответа, ключ
+        # строки, to_representation), (INLINE, ключ ответа, RowSerializer) для
+        # вложенного source='*' или (NESTED_LIST, ключ ответа) - место
+        # вложенного списка
+        self.columns = []
+        # Вложенные списки: (ключ ответа, RowSerializer, поле связи с родителем, менеджер модели)
+        self.children = []
+        self.lookups = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                self.children.append((name, *self._child(model, field)))
+                self.columns.append((NESTED_LIST, name))
+            elif isinstance(field, serializers.BaseSerializer):
+                if field.source != '*':
+                    raise UnsupportedSerializer(name)
+                nested = RowSerializer(field, model, annotations)
+                if nested.children:
+                    raise UnsupportedSerializer(name)
+                self.columns.append((INLINE, name, nested))
+                self.lookups.extend(nested.lookups)
+            elif isinstance(field, (RelatedField, serializers.SerializerMethodField)) or '.' in field.source:
+                raise UnsupportedSerializer(name)
+            else:
+                if isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone'):
+                    # Часовой пояс запроса определяется один раз, а не для
+                    # каждого значения (поля - копии, сериализатор не меняется)
+                    field.timezone = field.default_timezone()
+                lookup = _lookup(model, field.source, annotations)
+                self.columns.append((VALUE, name, lookup, field.to_representation))
+                self.lookups.append(lookup)
+        if self.children and 'id' not in self.lookups:
+            self.lookups.append('id')
+        self.lookups = list(dict.fromkeys(self.lookups))
+
+    def _child(self, model, field):
+        try:
+            relation = model._meta.get_field(field.source)
+        except Exception:
+            raise UnsupportedSerializer(field.source)
+        if not relation.one_to_many:
+            raise UnsupportedSerializer(field.source)
+        child_model = relation.related_model
+        return RowSerializer(field.child, child_model), relation.field.attname, child_model._default_manager
+
+    @classmethod
+    def for_queryset(cls, serializer_class, queryset, fields=None):
+        """RowSerializer для списка queryset (fields - как ?fields=)"""
+        if issubclass(serializer_class, DynamicFieldsMixin):
+            serializer = serializer_class(fields=fields)
+        else:
+            serializer = serializer_class()
+        return cls(serializer, queryset.model, set(queryset.query.annotations))
+
+    def values(self, queryset, extra=()):
+        """queryset.values() с колонками сериализатора и полями extra
+        (например, сортировки для курсора)"""
+        return queryset.prefetch_related(None).values(*dict.fromkeys([*self.lookups, *extra]))
+
+    def _child_querysets(self, rows):
+        parent_ids = [row['id'] for row in rows]
+        for name, child, parent_field, manager in self.children:
+            queryset = manager.filter(**{f'{parent_field}__in': parent_ids}).values(parent_field, *child.lookups)
+            yield name, child, parent_field, queryset
+
+    def fetch_children(self, rows):
+        """Строки вложенных списков: по запросу на каждый список"""
+        if not rows:
+            return []
+        return [
+            (name, child, parent_field, list(queryset))
+            for name, child, parent_field, queryset in self._child_querysets(rows)
+        ]
+
+    async def afetch_children(self, rows):
+        """fetch_children() для асинхронных представлений"""
+        if not rows:
+            return []
+        return [
+            (name, child, parent_field, [row async for row in queryset])
+            for name, child, parent_field, queryset in self._child_querysets(rows)
+        ]
+
+    def _represent(self, row):
+        data = {}
+        for kind, name, *column in self.columns:
+            if kind == VALUE:
+                lookup, to_representation = column
+                value = row[lookup]
+                data[name] = None if value is None else to_representation(value)
+            elif kind == INLINE:
+                data[name] = column[0]._represent(row)
+            else:
+                # Заполняется в assemble(); ключ ставится сразу ради порядка полей
+                data[name] = None
+        return data
+
+    def assemble(self, rows, children):
+        """Список словарей как у serializer_class(many=True).data; children -
+        результат fetch_children(rows)"""
+        data = [self._represent(row) for row in rows]
+        for name, child, parent_field, child_rows in children:
+            groups = {}
+            for child_row in child_rows:
+                groups.setdefault(child_row[parent_field], []).append(child_row)
+            groups = {parent_id: child.serialize(items) for parent_id, items in groups.items()}
+            for item, row in zip(data, rows):
+                item[name] = groups.get(row['id'], [])
+        return data
+
+    def serialize(self, rows):
+        return self.assemble(rows, self.fetch_children(rows))
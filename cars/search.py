@@ -0,0 +1,227 @@
+"""Полнотекстовый поиск по ремонтам, запчастям и складу
+
+Индекс - таблица SearchEntry: строка на запись о ремонте, запчасть и запчасть
+на складе с исходным текстом и данными для выдачи (автомобиль, запись о
+ремонте, дата), поэтому поиск не обращается к исходным таблицам.
+
+Движок зависит от БД:
+- SQLite: виртуальная таблица FTS5 над SearchEntry.terms (external content),
+  которую синхронизируют триггеры (миграция 0010). В FTS5 нет русского
+  стемминга, поэтому в terms хранятся основы слов (стеммер Snowball), а
+  запрос приводится к основам тем же стеммером;
+- PostgreSQL: GIN-индекс по to_tsvector('russian', text), ранжирование ts_rank.
+
+Строки индекса пишутся сигналами post_save (signals.py) и index_new_objects
+после bulk_create, а удаляются каскадом вместе с объектами. Перестроить
+индекс целиком: manage.py rebuild_search_index.
+"""
+import re
+import threading
+
+import snowballstemmer
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Car, RepairRecord, Part, StockPart, SearchEntry
+
+FTS_TABLE = 'cars_searchentry_fts'
+SEARCH_CONFIG = 'russian'
+
+# Размер выдачи по умолчанию и максимальный
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Сколько строк индекса вставлять за один запрос при перестроении
+INDEX_BATCH_SIZE = 1000
+
+WORD = re.compile(r'\w+')
+CODE_SEPARATORS = re.compile(r'[\W_]+')
+
+_local = threading.local()
+
+
+def _stemmer():
+    # Стеммер Snowball хранит состояние разбора, поэтому свой на каждый поток
+    if not hasattr(_local, 'stemmer'):
+        _local.stemmer = snowballstemmer.stemmer(SEARCH_CONFIG)
+    return _local.stemmer
+
+
+def query_words(query):
+    """Слова запроса в нижнем регистре"""
+    return WORD.findall(query.lower().replace('ё', 'е'))
+
+
+def search_terms(text):
+    """Основы слов текста через пробел"""
+    return ' '.join(_stemmer().stemWords(query_words(text)))
+
+
+def _code_text(*codes):
+    """Коды деталей целиком и без разделителей: '0 986-452' ищется и как 0986452"""
+    values = []
+    for code in codes:
+        if code:
+            values.append(code)
+            compact = CODE_SEPARATORS.sub('', code)
+            if compact != code:
+                values.append(compact)
+    return values
+
+
+def build_entry(obj):
+    """Несохраненная строка индекса для записи о ремонте, запчасти или
+    запчасти на складе"""
+    if isinstance(obj, RepairRecord):
+        entry = SearchEntry(kind=SearchEntry.KIND_REPAIR, car_id=obj.car_id, repair_record_id=obj.pk,
+                            date=obj.date, text=obj.work_description)
+    elif isinstance(obj, Part):
+        record = obj.repair_record
+        entry = SearchEntry(kind=SearchEntry.KIND_PART, car_id=record.car_id, repair_record_id=record.pk,
+                            part_id=obj.pk, date=record.date,
+                            text=' '.join([obj.name, *_code_text(obj.part_code), obj.manufacturer]))
+    elif isinstance(obj, StockPart):
+        entry = SearchEntry(kind=SearchEntry.KIND_STOCK, car_id=obj.car_id, stock_part_id=obj.pk,
+                            date=obj.purchase_date,
+                            text=' '.join([obj.name, *_code_text(obj.part_code), obj.manufacturer, obj.notes or '']))
+    else:
+        raise TypeError(f"Объекты {type(obj).__name__} не индексируются")
+    entry.text = entry.text.strip()
+    entry.terms = search_terms(entry.text)
+    return entry
+
+
+def _entry_lookup(entry):
+    if entry.kind == SearchEntry.KIND_PART:
+        return {'part_id': entry.part_id}
+    if entry.kind == SearchEntry.KIND_STOCK:
+        return {'stock_part_id': entry.stock_part_id}
+    return {'kind': SearchEntry.KIND_REPAIR, 'repair_record_id': entry.repair_record_id}
+
+
+def index_object(obj):
+    """Добавляет или обновляет строку индекса объекта"""
+    entry = build_entry(obj)
+    SearchEntry.objects.update_or_create(
+        **_entry_lookup(entry),
+        defaults={field: getattr(entry, field)
+                  for field in ('kind', 'car_id', 'repair_record_id', 'date', 'text', 'terms')},
+    )
+    if entry.kind == SearchEntry.KIND_REPAIR:
+        # Запчасти выдаются с датой своей записи о ремонте
+        SearchEntry.objects.filter(kind=SearchEntry.KIND_PART, repair_record_id=obj.pk).update(date=obj.date)
+
+
+def index_new_objects(objects, batch_size=INDEX_BATCH_SIZE):
+    """Индексирует объекты, созданные через bulk_create (post_save не отправляется)"""
+    SearchEntry.objects.bulk_create([build_entry(obj) for obj in objects], batch_size=batch_size)
+
+
+def rebuild_index(cars=None, batch_size=INDEX_BATCH_SIZE):
+    """Перестраивает индекс для автомобилей (QuerySet) или целиком.
+
+    Возвращает число строк индекса.
+    """
+    cars = cars if cars is not None else Car.objects.all()
+    SearchEntry.objects.filter(car__in=cars).delete()
+    sources = [
+        RepairRecord.objects.filter(car__in=cars),
+        Part.objects.filter(repair_record__car__in=cars).select_related('repair_record', 'catalog'),
+        StockPart.objects.filter(car__in=cars).select_related('catalog'),
+    ]
+    count = 0
+    for queryset in sources:
+        batch = []
+        for obj in queryset.order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(build_entry(obj))
+            if len(batch) >= batch_size:
+                SearchEntry.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        SearchEntry.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def _fts_match(words):
+    # Каждая основа - префиксный запрос, условия объединяются через AND
+    stems = _stemmer().stemWords(words)
+    return ' '.join(f'"{stem}"*' for stem in stems)
+
+
+def _pg_query(words):
+    from django.contrib.postgres.search import SearchQuery
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), config=SEARCH_CONFIG, search_type='raw')
+
+
+def _pg_vector():
+    from django.contrib.postgres.search import SearchVector
+    # Совпадает с выражением GIN-индекса из миграции 0010
+    return SearchVector('text', config=SEARCH_CONFIG)
+
+
+def matching_entries(query):
+    """Строки индекса, подходящие под запрос (без ранжирования)"""
+    words = query_words(query)
+    if not words:
+        return SearchEntry.objects.none()
+    if connection.vendor == 'postgresql':
+        return SearchEntry.objects.annotate(search_vector=_pg_vector()).filter(search_vector=_pg_query(words))
+    return SearchEntry.objects.filter(
+        id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [_fts_match(words)])
+    )
+
+
+def _sqlite_ranked_ids(words, user, kinds, car_id, limit):
+    conditions = ['c.user_id = %s', 'c.deleting_since IS NULL']
+    params = [_fts_match(words), user.pk]
+    if kinds:
+        conditions.append(f"e.kind IN ({', '.join(['%s'] * len(kinds))})")
+        params.extend(kinds)
+    if car_id is not None:
+        conditions.append('e.car_id = %s')
+        params.append(car_id)
+    params.append(limit)
+    sql = (
+        f'SELECT e.id, -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+        f'JOIN cars_searchentry e ON e.id = {FTS_TABLE}.rowid '
+        f'JOIN cars_car c ON c.id = e.car_id '
+        f'WHERE {FTS_TABLE} MATCH %s AND {" AND ".join(conditions)} '
+        f'ORDER BY bm25({FTS_TABLE}), e.id LIMIT %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search(user, query, kinds=None, car_id=None, limit=SEARCH_LIMIT):
+    """Строки индекса по автомобилям пользователя в порядке релевантности.
+
+    kinds - типы строк (SearchEntry.KIND_*), car_id - один автомобиль.
+    У каждой строки заполнены car (select_related) и rank (чем больше, тем
+    релевантнее).
+    """
+    words = query_words(query)
+    if not words:
+        return []
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchRank
+        pg_query = _pg_query(words)
+        entries = matching_entries(query).filter(car__user=user, car__deleting_since__isnull=True)
+        if kinds:
+            entries = entries.filter(kind__in=kinds)
+        if car_id is not None:
+            entries = entries.filter(car_id=car_id)
+        entries = entries.annotate(rank=SearchRank(_pg_vector(), pg_query)).select_related('car')
+        return list(entries.order_by('-rank', 'id')[:limit])
+
+    ranked = _sqlite_ranked_ids(words, user, kinds, car_id, limit)
+    entries = SearchEntry.objects.select_related('car').in_bulk([entry_id for entry_id, _ in ranked])
+    results = []
+    for entry_id, rank in ranked:
+        entry = entries[entry_id]
+        entry.rank = rank
+        results.append(entry)
+    return results
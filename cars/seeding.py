@@ -0,0 +1,136 @@
+"""Генерация тестовых данных гаража
+
+Создает пользователей × автомобили × записи о ремонте × запчасти через
+bulk_create (с поисковым индексом и итогами расходов). Используется для проверки планов запросов и нагрузочных тестов.
+"""
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .models import Car, RepairRecord, Part, PartCatalog, StockPart
+from .rollups import rebuild_rollups
+from .search import index_new_objects
+
+SEED_PASSWORD = 'seed-password-123'
+
+BRANDS = [
+    ('Lada', ['Vesta', 'Granta', 'Niva']),
+    ('Kia', ['Rio', 'Sportage', 'Ceed']),
+    ('Hyundai', ['Solaris', 'Creta', 'Tucson']),
+    ('Toyota', ['Camry', 'Corolla', 'RAV4']),
+    ('Volkswagen', ['Polo', 'Tiguan', 'Passat']),
+]
+
+WORKS = [
+    'Замена масла и масляного фильтра',
+    'Замена тормозных колодок передних',
+    'Замена ремня ГРМ с роликами',
+    'Плановое ТО, замена воздушного и салонного фильтров',
+    'Шиномонтаж, балансировка колес',
+    'Замена свечей зажигания',
+    'Диагностика подвески, замена стоек стабилизатора',
+    'Замена антифриза',
+]
+
+PARTS = [
+    ('Масло моторное 5W-30 4л', 'Mobil'),
+    ('Фильтр масляный', 'Mann'),
+    ('Колодки тормозные', 'Brembo'),
+    ('Ремень ГРМ', 'Gates'),
+    ('Свеча зажигания', 'NGK'),
+    ('Фильтр воздушный', 'Bosch'),
+    ('Стойка стабилизатора', 'Lemforder'),
+    ('Антифриз G12 5л', 'Felix'),
+]
+
+
+def seed_garage(users=1, cars_per_user=1, repairs_per_car=10, parts_per_repair=2,
+                stock_parts_per_car=5, start_date=date(2015, 1, 1), seed=0, batch_size=2000):
+    """Создает набор данных и возвращает список созданных пользователей.
+
+    Имена пользователей: seed_<seed>_<n>, пароль SEED_PASSWORD.
+    """
+    rng = random.Random(seed)
+    password = make_password(SEED_PASSWORD)
+
+    with transaction.atomic():
+        created_users = User.objects.bulk_create([
+            User(username=f'seed_{seed}_{n}', password=password) for n in range(users)
+        ])
+        if not all(user.pk for user in created_users):
+            created_users = list(User.objects.filter(username__startswith=f'seed_{seed}_').order_by('pk'))
+
+        cars = []
+        for user in created_users:
+            for n in range(cars_per_user):
+                brand, models = rng.choice(BRANDS)
+                cars.append(Car(
+                    user=user,
+                    brand=brand,
+                    model=rng.choice(models),
+                    vin=f'{seed:03d}{user.pk:07d}{n:07d}'[-17:],
+                    year=rng.randint(2005, 2024),
+                    power=rng.randint(80, 250),
+                ))
+        cars = Car.objects.bulk_create(cars, batch_size=batch_size)
+
+        days = max(repairs_per_car, 1)
+        for car in cars:
+            mileage = rng.randint(0, 20000)
+            records = []
+            for n in range(repairs_per_car):
+                mileage += rng.randint(500, 15000)
+                records.append(RepairRecord(
+                    car=car,
+                    date=start_date + timedelta(days=n * 3650 // days),
+                    mileage=mileage,
+                    work_description=rng.choice(WORKS),
+                    work_cost=Decimal(rng.randint(500, 30000)),
+                ))
+            records = RepairRecord.objects.bulk_create(records, batch_size=batch_size)
+            index_new_objects(records, batch_size=batch_size)
+
+            parts = []
+            for record in records:
+                for n in range(parts_per_repair):
+                    name, manufacturer = rng.choice(PARTS)
+                    parts.append(Part(
+                        repair_record=record,
+                        name=name,
+                        part_code=f'{manufacturer[:3].upper()}-{rng.randint(1000, 99999)}',
+                        manufacturer=manufacturer,
+                        quantity=rng.randint(1, 4),
+                        cost=Decimal(rng.randint(100, 15000)),
+                    ))
+                if len(parts) >= batch_size:
+                    PartCatalog.objects.assign(parts)
+                    Part.objects.bulk_create(parts, batch_size=batch_size)
+                    index_new_objects(parts, batch_size=batch_size)
+                    parts = []
+            PartCatalog.objects.assign(parts)
+            Part.objects.bulk_create(parts, batch_size=batch_size)
+            index_new_objects(parts, batch_size=batch_size)
+
+            stock_parts = []
+            for n in range(stock_parts_per_car):
+                name, manufacturer = rng.choice(PARTS)
+                stock_parts.append(StockPart(
+                    car=car,
+                    name=name,
+                    part_code=f'{manufacturer[:3].upper()}-{rng.randint(1000, 99999)}',
+                    manufacturer=manufacturer,
+                    quantity=rng.randint(1, 4),
+                    cost=Decimal(rng.randint(100, 15000)),
+                ))
+            PartCatalog.objects.assign(stock_parts)
+            StockPart.objects.bulk_create(stock_parts, batch_size=batch_size)
+            index_new_objects(stock_parts, batch_size=batch_size)
+
+        # Итоги новых автомобилей считаются агрегатами, а не приращениями по месяцам
+        rebuild_rollups(Car.objects.filter(user__in=created_users))
+
+    return created_users
@@ -1,7 +1,20 @@
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Car, RepairRecord, Part, StockPart
+from .models import Car, RepairRecord, Part, StockPart, ReportJob
 
-class CarSerializer(serializers.ModelSerializer):
+
+class DynamicFieldsMixin:
+    """Позволяет ограничить набор полей: Serializer(..., fields=['id', 'brand'])"""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class CarSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Car
         fields = ['id', 'brand', 'model', 'vin', 'year', 'power', 'tire_front', 'tire_rear', 'wipers', 'notes', 'created_at', 'updated_at']
@@ -20,11 +33,34 @@ class CarSerializer(serializers.ModelSerializer):
         return value
 
 
+class CarSummarySerializer(serializers.Serializer):
+    """Итоги автомобиля из stats.with_summary()"""
+    records_count = serializers.IntegerField(source='summary_records_count')
+    work_cost = serializers.DecimalField(max_digits=14, decimal_places=2, source='summary_work_cost')
+    parts_cost = serializers.DecimalField(max_digits=14, decimal_places=2, source='summary_parts_cost')
+    total_cost = serializers.DecimalField(max_digits=14, decimal_places=2, source='summary_total_cost')
+    last_service_date = serializers.DateField(source='summary_last_service_date')
+    last_mileage = serializers.IntegerField(source='summary_last_mileage')
+    stock_parts_count = serializers.IntegerField(source='summary_stock_parts_count')
+    stock_parts_cost = serializers.DecimalField(max_digits=14, decimal_places=2, source='summary_stock_parts_cost')
+
+
+class CarWithSummarySerializer(CarSerializer):
+    summary = CarSummarySerializer(source='*', read_only=True)
+
+    class Meta(CarSerializer.Meta):
+        fields = [*CarSerializer.Meta.fields, 'summary']
+
+
 class PartSerializer(serializers.ModelSerializer):
+    # Хранятся в каталоге запчастей (PartCatalog), у модели это свойства
+    part_code = serializers.CharField(max_length=100)
+    manufacturer = serializers.CharField(max_length=100)
+
     class Meta:
         model = Part
-        fields = ['id', 'name', 'part_code', 'manufacturer', 'quantity', 'cost', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'name', 'part_code', 'manufacturer', 'quantity', 'cost', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
     
     def validate_cost(self, value):
         """Валидация стоимости"""
@@ -39,7 +75,7 @@ class PartSerializer(serializers.ModelSerializer):
         return value
 
 
-class RepairRecordSerializer(serializers.ModelSerializer):
+class RepairRecordSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     parts = PartSerializer(many=True, read_only=True)
     
     class Meta:
@@ -60,11 +96,15 @@ class RepairRecordSerializer(serializers.ModelSerializer):
         return value
 
 
-class StockPartSerializer(serializers.ModelSerializer):
+class StockPartSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    # Хранятся в каталоге запчастей (PartCatalog), у модели это свойства
+    part_code = serializers.CharField(max_length=100)
+    manufacturer = serializers.CharField(max_length=100)
+
     class Meta:
         model = StockPart
-        fields = ['id', 'name', 'part_code', 'manufacturer', 'quantity', 'cost', 'purchase_date', 'notes', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'name', 'part_code', 'manufacturer', 'quantity', 'cost', 'purchase_date', 'notes', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at']
     
     def validate_cost(self, value):
         """Валидация стоимости"""
@@ -78,3 +118,98 @@ class StockPartSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Количество должно быть не менее 1")
         return value
 
+
+class SyncRepairRecordSerializer(RepairRecordSerializer):
+    """Запись о ремонте для синхронизации: с ID автомобиля, запчасти
+    передаются отдельным списком"""
+    parts = None
+
+    class Meta(RepairRecordSerializer.Meta):
+        fields = ['id', 'car', 'date', 'mileage', 'work_description', 'work_cost', 'created_at', 'updated_at']
+
+
+class SyncPartSerializer(PartSerializer):
+    class Meta(PartSerializer.Meta):
+        fields = ['id', 'repair_record', *PartSerializer.Meta.fields[1:]]
+
+
+class SyncStockPartSerializer(StockPartSerializer):
+    class Meta(StockPartSerializer.Meta):
+        fields = ['id', 'car', *StockPartSerializer.Meta.fields[1:]]
+
+
+class SyncDeletedSerializer(serializers.Serializer):
+    cars = serializers.ListField(child=serializers.IntegerField())
+    repairs = serializers.ListField(child=serializers.IntegerField())
+    parts = serializers.ListField(child=serializers.IntegerField())
+    stock = serializers.ListField(child=serializers.IntegerField())
+
+
+class SyncSerializer(serializers.Serializer):
+    """Ответ /api/sync/ (sync.changes_since)"""
+    cursor = serializers.CharField()
+    reset = serializers.BooleanField()
+    cars = CarSerializer(many=True)
+    repairs = SyncRepairRecordSerializer(many=True)
+    parts = SyncPartSerializer(many=True)
+    stock = SyncStockPartSerializer(many=True)
+    deleted = SyncDeletedSerializer()
+
+
+class CostBreakdownSerializer(serializers.Serializer):
+    """Расходы за месяц ('2024-01') или год ('2024')"""
+    period = serializers.CharField()
+    records_count = serializers.IntegerField()
+    parts_count = serializers.IntegerField()
+    work_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+    parts_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+    total_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class CarStatsSerializer(serializers.Serializer):
+    """Агрегированная статистика расходов по автомобилю"""
+    date_from = serializers.DateField(allow_null=True)
+    date_to = serializers.DateField(allow_null=True)
+    records_count = serializers.IntegerField()
+    parts_count = serializers.IntegerField()
+    total_work_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+    total_parts_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+    total_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+    stock_parts_cost = serializers.DecimalField(max_digits=14, decimal_places=2)
+    mileage_from = serializers.IntegerField(allow_null=True)
+    mileage_to = serializers.IntegerField(allow_null=True)
+    cost_per_km = serializers.DecimalField(max_digits=14, decimal_places=2, allow_null=True)
+    by_month = CostBreakdownSerializer(many=True)
+    by_year = CostBreakdownSerializer(many=True)
+
+
+class ReportJobSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Задание на отчет Excel; download_url - после готовности"""
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'date_from', 'date_to', 'status', 'error', 'created_at', 'started_at', 'finished_at', 'download_url']
+        read_only_fields = ['id', 'status', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def get_download_url(self, obj):
+        if obj.status != ReportJob.STATUS_DONE:
+            return None
+        return reverse('report-job-download', args=[obj.car_id, obj.pk])
+
+    def validate(self, attrs):
+        if attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError("Дата начала периода позже даты окончания")
+        return attrs
+
+
+class SearchResultSerializer(serializers.Serializer):
+    """Результат поиска; id - ID записи о ремонте, запчасти или запчасти на складе"""
+    kind = serializers.CharField()
+    id = serializers.IntegerField(source='object_id')
+    car_id = serializers.IntegerField()
+    car = serializers.CharField()
+    repair_record_id = serializers.IntegerField(allow_null=True)
+    date = serializers.DateField(allow_null=True)
+    text = serializers.CharField()
+    rank = serializers.FloatField()
@@ -0,0 +1,237 @@
+"""Операции над данными гаража, затрагивающие несколько моделей"""
+from django.db import transaction
+from django.db.models.deletion import Collector
+from django.utils import timezone
+from rest_framework import status
+
+from . import rollups, sync
+from .cache import invalidate_car
+from .models import Part, PartCatalog, SearchEntry, StockPart
+from .rollups import rollup_new_objects
+from .search import index_new_objects
+from .serializers import PartSerializer, RepairRecordSerializer
+
+# Сколько операций принимается в одном пакете
+MAX_BATCH_OPERATIONS = 200
+
+OP_UPDATE_RECORD = 'update_record'
+OP_CREATE_PART = 'create_part'
+OP_UPDATE_PART = 'update_part'
+OP_DELETE_PART = 'delete_part'
+BATCH_OPERATIONS = [OP_UPDATE_RECORD, OP_CREATE_PART, OP_UPDATE_PART, OP_DELETE_PART]
+
+# Свойства запчасти, которые хранятся в позиции каталога
+CATALOG_PROPERTIES = {'part_code', 'manufacturer'}
+
+
+class StockPartsUnavailable(Exception):
+    """Часть запчастей со склада не найдена или уже установлена другим запросом"""
+
+    def __init__(self, missing_ids):
+        self.missing_ids = sorted(missing_ids)
+        super().__init__(f"Запчасти со склада недоступны: {self.missing_ids}")
+
+
+def install_stock_parts(record, stock_part_ids):
+    """Перемещает запчасти со склада в запись о ремонте.
+
+    Выполняется в одной транзакции: строки склада блокируются (SELECT ... FOR
+    UPDATE), запчасти создаются одним bulk_create и удаляются со склада одним
+    DELETE. Если какая-то запчасть недоступна, ничего не меняется и
+    выбрасывается StockPartsUnavailable. Возвращает список созданных запчастей.
+    """
+    requested_ids = {int(pk) for pk in stock_part_ids}
+    if not requested_ids:
+        return []
+
+    with transaction.atomic(), sync.batch():
+        stock_parts = list(
+            StockPart.objects
+            .select_for_update(of=('self',))
+            .select_related('catalog')
+            .filter(pk__in=requested_ids, car_id=record.car_id)
+            .order_by('pk')
+        )
+        missing_ids = requested_ids - {stock_part.pk for stock_part in stock_parts}
+        if missing_ids:
+            raise StockPartsUnavailable(missing_ids)
+
+        parts = Part.objects.bulk_create([
+            Part(
+                repair_record=record,
+                name=stock_part.name,
+                catalog=stock_part.catalog,
+                quantity=stock_part.quantity,
+                cost=stock_part.cost
+            )
+            for stock_part in stock_parts
+        ])
+
+        # Если строки успел удалить параллельный запрос (БД без FOR UPDATE),
+        # откатываем транзакцию, чтобы не установить запчасть дважды
+        # В общий счетчик delete() входят и строки поискового индекса
+        _, deleted = StockPart.objects.filter(pk__in=requested_ids, car_id=record.car_id).delete()
+        if deleted.get(StockPart._meta.label, 0) != len(stock_parts):
+            raise StockPartsUnavailable(requested_ids)
+
+        # bulk_create не отправляет post_save
+        index_new_objects(parts)
+        rollup_new_objects(parts=parts)
+        invalidate_car(record.car_id)
+
+    return parts
+
+
+class BatchInvalid(Exception):
+    """Операции пакета не прошли проверку; results - результат по каждой"""
+
+    def __init__(self, results):
+        self.results = results
+        super().__init__("Пакет операций не применен")
+
+
+def _batch_error(operation, status_code, errors):
+    op = operation.get('op') if isinstance(operation, dict) else None
+    return {'op': op, 'status': status_code, 'errors': errors}
+
+
+def _check_operation(record, operation, parts, seen):
+    """Проверяет операцию пакета: (op, serializer или запчасть) либо ошибка"""
+    if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+        return None, _batch_error(operation, status.HTTP_400_BAD_REQUEST,
+                                  {'op': [f"Ожидается одна из операций: {', '.join(BATCH_OPERATIONS)}"]})
+    op = operation['op']
+    data = operation.get('data', {})
+    if op != OP_DELETE_PART and not isinstance(data, dict):
+        return None, _batch_error(operation, status.HTTP_400_BAD_REQUEST, {'data': ['Ожидается объект с полями']})
+
+    if op == OP_UPDATE_RECORD:
+        if 'record' in seen:
+            return None, _batch_error(operation, status.HTTP_400_BAD_REQUEST,
+                                      {'op': ['Запись о ремонте изменяется в пакете только один раз']})
+        seen.add('record')
+        serializer = RepairRecordSerializer(record, data=data, partial=True)
+    elif op == OP_CREATE_PART:
+        serializer = PartSerializer(data=data)
+    else:
+        part_id = operation.get('id')
+        if not isinstance(part_id, int) or isinstance(part_id, bool):
+            return None, _batch_error(operation, status.HTTP_400_BAD_REQUEST, {'id': ['Укажите ID запчасти']})
+        if part_id not in parts:
+            return None, _batch_error(operation, status.HTTP_404_NOT_FOUND, {'id': ['Запчасть не найдена']})
+        if part_id in seen:
+            return None, _batch_error(operation, status.HTTP_400_BAD_REQUEST,
+                                      {'id': ['Запчасть уже есть в другой операции пакета']})
+        seen.add(part_id)
+        if op == OP_DELETE_PART:
+            return (op, parts[part_id]), None
+        serializer = PartSerializer(parts[part_id], data=data, partial=True)
+
+    if not serializer.is_valid():
+        return None, _batch_error(operation, status.HTTP_400_BAD_REQUEST, serializer.errors)
+    return (op, serializer), None
+
+
+def apply_repair_batch(record, operations):
+    """Применяет пакет операций над записью о ремонте и ее запчастями.
+
+    Операции: {'op': 'update_record', 'data': {...}} (частичное изменение
+    записи), {'op': 'create_part', 'data': {...}}, {'op': 'update_part',
+    'id': ..., 'data': {...}} (частичное изменение), {'op': 'delete_part',
+    'id': ...}. Данные проверяются правилами RepairRecordSerializer и
+    PartSerializer. Если хоть одна операция не прошла проверку, ничего не
+    меняется и выбрасывается BatchInvalid.
+
+    Все изменения - одна транзакция: запись сохраняется первой, затем
+    запчасти удаляются, изменяются (bulk_update) и создаются (bulk_create);
+    итоги и поисковый индекс обновляются пакетно. Возвращает результаты в
+    порядке операций.
+    """
+    part_ids = {
+        operation.get('id') for operation in operations
+        if isinstance(operation, dict) and isinstance(operation.get('id'), int)
+    }
+    with transaction.atomic(), rollups.batch() as changes, sync.batch():
+        parts = (
+            Part.objects
+            .select_for_update(of=('self',))
+            .select_related('catalog')
+            .filter(repair_record=record)
+            .in_bulk(part_ids)
+        )
+        checked = []
+        errors = {}
+        seen = set()
+        for index, operation in enumerate(operations):
+            plan, error = _check_operation(record, operation, parts, seen)
+            checked.append(plan)
+            if error is not None:
+                errors[index] = error
+        if errors:
+            # Верные операции не применены из-за ошибок в других
+            raise BatchInvalid([
+                errors.get(index) or {'op': plan[0], 'status': status.HTTP_424_FAILED_DEPENDENCY}
+                for index, plan in enumerate(checked)
+            ])
+
+        for op, serializer in checked:
+            if op == OP_UPDATE_RECORD:
+                serializer.save()
+
+        deleted = [part for op, part in checked if op == OP_DELETE_PART]
+        if deleted:
+            for part in deleted:
+                part.repair_record = record
+            # Сигналы удаления получают эти же объекты с загруженной записью
+            # о ремонте и не читают ее для каждой запчасти
+            collector = Collector(using=Part.objects.db)
+            collector.collect(deleted)
+            collector.delete()
+
+        updated = [serializer for op, serializer in checked if op == OP_UPDATE_PART]
+        if updated:
+            fields = set()
+            for serializer in updated:
+                part = serializer.instance
+                part.repair_record = record
+                changes.add_part(record.car_id, record.date, part.cost, part.quantity, sign=-1)
+                for name, value in serializer.validated_data.items():
+                    setattr(part, name, value)
+                    fields.add('catalog' if name in CATALOG_PROPERTIES else name)
+                changes.add_part(record.car_id, record.date, part.cost, part.quantity)
+            updated_parts = [serializer.instance for serializer in updated]
+            PartCatalog.objects.assign(updated_parts)
+            if fields:
+                # bulk_update не проставляет auto_now
+                now = timezone.now()
+                for part in updated_parts:
+                    part.updated_at = now
+                Part.objects.bulk_update(updated_parts, [*fields, 'updated_at'])
+            # bulk_update не отправляет post_save: строки индекса создаются заново
+            SearchEntry.objects.filter(part__in=updated_parts).delete()
+            index_new_objects(updated_parts)
+
+        created = [
+            Part(repair_record=record, **serializer.validated_data)
+            for op, serializer in checked if op == OP_CREATE_PART
+        ]
+        if created:
+            PartCatalog.objects.assign(created)
+            Part.objects.bulk_create(created)
+            index_new_objects(created)
+            rollup_new_objects(parts=created)
+        invalidate_car(record.car_id)
+
+    created = iter(created)
+    results = []
+    for operation, (op, plan) in zip(operations, checked):
+        if op == OP_UPDATE_RECORD:
+            results.append({'op': op, 'status': status.HTTP_200_OK})
+        elif op == OP_DELETE_PART:
+            # После удаления pk объекта сброшен
+            results.append({'op': op, 'status': status.HTTP_204_NO_CONTENT, 'id': operation['id']})
+        else:
+            part = next(created) if op == OP_CREATE_PART else plan.instance
+            code = status.HTTP_201_CREATED if op == OP_CREATE_PART else status.HTTP_200_OK
+            results.append({'op': op, 'status': code, 'id': part.pk, 'data': PartSerializer(part).data})
+    return results
@@ -0,0 +1,93 @@
+"""Сброс кэша ответов API, обновление поискового индекса, итогов расходов и
+отметок об удалении для синхронизации при изменении данных гаража; сброс
+кэша аутентификации при изменении пользователей и токенов API"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .cache import invalidate_car
+from .models import ApiToken, Car, RepairRecord, Part, StockPart, ReportJob
+from . import authentication, rollups, sync
+from .search import index_object
+
+
+@receiver([post_save, post_delete], sender=Car)
+def car_changed(sender, instance, **kwargs):
+    invalidate_car(instance.pk, instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=RepairRecord)
+@receiver([post_save, post_delete], sender=StockPart)
+def car_data_changed(sender, instance, **kwargs):
+    invalidate_car(instance.car_id)
+
+
+@receiver([post_save, post_delete], sender=Part)
+def part_changed(sender, instance, **kwargs):
+    # Внутри rollups.batch() запись читается один раз и для итогов
+    record = rollups.part_record_info(instance)
+    if record is not None:
+        invalidate_car(record[0])
+
+
+@receiver(post_save, sender=RepairRecord)
+@receiver(post_save, sender=Part)
+@receiver(post_save, sender=StockPart)
+def search_object_saved(sender, instance, **kwargs):
+    # Строки индекса удаленных объектов удаляются каскадом (SearchEntry)
+    index_object(instance)
+
+
+@receiver(pre_save, sender=RepairRecord)
+@receiver(pre_save, sender=Part)
+def rollup_object_saving(sender, instance, **kwargs):
+    # Прежние значения вычитаются из итогов после сохранения
+    instance._rollup_previous = rollups.previous_state(instance)
+
+
+@receiver(post_save, sender=RepairRecord)
+@receiver(post_save, sender=Part)
+def rollup_object_saved(sender, instance, **kwargs):
+    rollups.object_saved(instance, instance.__dict__.pop('_rollup_previous', None))
+
+
+@receiver(post_delete, sender=RepairRecord)
+@receiver(post_delete, sender=Part)
+def rollup_object_deleted(sender, instance, **kwargs):
+    rollups.object_deleted(instance)
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Car)
+@receiver(pre_delete, sender=RepairRecord)
+def sync_object_deleting(sender, instance, **kwargs):
+    sync.object_deleting(instance)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Car)
+@receiver(post_delete, sender=RepairRecord)
+@receiver(post_delete, sender=Part)
+@receiver(post_delete, sender=StockPart)
+def sync_object_deleted(sender, instance, **kwargs):
+    sync.object_deleted(instance)
+
+
+@receiver(post_delete, sender=ReportJob)
+def report_job_deleted(sender, instance, **kwargs):
+    # Файл отчета удаляется, только если удаление задания зафиксировано
+    if instance.file:
+        file = instance.file
+        transaction.on_commit(lambda: file.delete(save=False))
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Смена пароля, блокировка и удаление действуют сразу в этом процессе
+    authentication.forget_user(instance.pk)
+
+
+@receiver(post_delete, sender=ApiToken)
+def api_token_deleted(sender, instance, **kwargs):
+    authentication.forget_token(instance.key_hash)
@@ -10,15 +10,35 @@ class CarDetailManager {
         this.selectedStockPartsInPartsModal = [];
         this.currentRepairId = null;
         this.apiUrl = `/api/cars/${carId}/`;
+        this.repairsPageSize = 50;
+        this.nextRepairsUrl = null;
+        this.isLoadingMoreRepairs = false;
         this.init();
     }
 
     async init() {
         await this.loadRepairs();
-        await this.loadStockParts(); // Загружаем запчасти на складе для расчета общей стоимости
+        await this.loadStockParts();
         this.renderRepairs();
-        this.updateTotalCost(); // Обновляем общую стоимость после загрузки данных
         this.setupEventListeners();
+        this.setupInfiniteScroll();
+    }
+
+    setupInfiniteScroll() {
+        // Следующая страница записей загружается при прокрутке до конца таблицы
+        const container = document.getElementById('repairs-table-container');
+        if (!container || !('IntersectionObserver' in window)) {
+            return;
+        }
+        const sentinel = document.createElement('div');
+        sentinel.id = 'repairs-table-sentinel';
+        container.after(sentinel);
+        const observer = new IntersectionObserver((entries) => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                this.loadMoreRepairs();
+            }
+        }, { rootMargin: '200px' });
+        observer.observe(sentinel);
     }
 
     setupEventListeners() {
@@ -221,7 +241,7 @@ class CarDetailManager {
 
     async loadRepairs() {
         try {
-            const response = await fetch(`${this.apiUrl}repairs/`, {
+            const response = await fetch(`${this.apiUrl}repairs/?page_size=${this.repairsPageSize}`, {
                 credentials: 'include'
             });
             if (!response.ok) {
@@ -231,10 +251,36 @@ class CarDetailManager {
                 }
                 throw new Error(`Ошибка ${response.status}`);
             }
-            this.repairs = await response.json();
+            const data = await response.json();
+            this.repairs = data.results;
+            this.nextRepairsUrl = data.next;
         } catch (error) {
             console.error('Error loading repairs:', error);
             this.repairs = [];
+            this.nextRepairsUrl = null;
+        }
+    }
+
+    async loadMoreRepairs() {
+        if (!this.nextRepairsUrl || this.isLoadingMoreRepairs) {
+            return;
+        }
+        this.isLoadingMoreRepairs = true;
+        try {
+            const response = await fetch(this.nextRepairsUrl, {
+                credentials: 'include'
+            });
+            if (!response.ok) {
+                throw new Error(`Ошибка ${response.status}`);
+            }
+            const data = await response.json();
+            this.repairs = this.repairs.concat(data.results);
+            this.nextRepairsUrl = data.next;
+            this.renderRepairs();
+        } catch (error) {
+            console.error('Error loading more repairs:', error);
+        } finally {
+            this.isLoadingMoreRepairs = false;
         }
     }
 
@@ -359,39 +405,39 @@ class CarDetailManager {
         this.updateTotalCost();
     }
 
-    updateTotalCost() {
+    async loadStats(dateFrom = null, dateTo = null) {
+        const params = new URLSearchParams();
+        if (dateFrom) params.append('date_from', dateFrom);
+        if (dateTo) params.append('date_to', dateTo);
+        const query = params.toString();
+        const response = await fetch(`${this.apiUrl}stats/${query ? `?${query}` : ''}`, {
+            credentials: 'include'
+        });
+        if (!response.ok) {
+            throw new Error(`Ошибка ${response.status}`);
+        }
+        return response.json();
+    }
+
+    async updateTotalCost() {
+        // Итоги считаются на сервере
+        let stats;
+        try {
+            stats = await this.loadStats();
+        } catch (error) {
+            console.error('Error loading stats:', error);
+            return;
+        }
+
         // Общая стоимость работ
-        const totalWorkCost = this.repairs.reduce((sum, repair) => {
-            return sum + parseFloat(repair.work_cost || 0);
-        }, 0);
+        const totalWorkCost = parseFloat(stats.total_work_cost || 0);
         const totalWorkCostElement = document.getElementById('total-work-cost');
         if (totalWorkCostElement) {
             totalWorkCostElement.textContent = totalWorkCost.toLocaleString('ru-RU', {minimumFractionDigits: 2});
         }
 
         // Общая стоимость запчастей (в ремонтах + на складе)
-        let totalPartsCost = 0;
-        
-        // Запчасти в ремонтах
-        this.repairs.forEach(repair => {
-            if (repair.parts && repair.parts.length > 0) {
-                repair.parts.forEach(part => {
-                    const quantity = parseInt(part.quantity) || 1;
-                    const unitCost = parseFloat(part.cost || 0);
-                    totalPartsCost += unitCost * quantity;
-                });
-            }
-        });
-        
-        // Запчасти на складе
-        if (this.stockParts && this.stockParts.length > 0) {
-            this.stockParts.forEach(part => {
-                const quantity = parseInt(part.quantity) || 1;
-                const unitCost = parseFloat(part.cost || 0);
-                totalPartsCost += unitCost * quantity;
-            });
-        }
-        
+        const totalPartsCost = parseFloat(stats.total_parts_cost || 0) + parseFloat(stats.stock_parts_cost || 0);
         const totalPartsCostElement = document.getElementById('total-parts-cost');
         if (totalPartsCostElement) {
             totalPartsCostElement.textContent = totalPartsCost.toLocaleString('ru-RU', {minimumFractionDigits: 2});
@@ -632,6 +678,32 @@ class CarDetailManager {
         document.getElementById('part-modal').classList.remove('show');
     }
 
+    // Изменения записи о ремонте и ее запчастей применяются одним запросом;
+    // в ответе - запись с запчастями, ее не нужно перечитывать
+    async applyRepairBatch(repairId, operations) {
+        const response = await fetch(`${this.apiUrl}repairs/${repairId}/batch/`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': this.getCsrfToken()
+            },
+            credentials: 'include',
+            body: JSON.stringify({ operations: operations })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            const failed = (data.results || []).find(result => result.errors);
+            const details = failed ? Object.values(failed.errors).flat().join(' ') : '';
+            throw new Error(details || data.error || 'Ошибка при сохранении');
+        }
+
+        const index = this.repairs.findIndex(r => r.id === repairId);
+        if (index !== -1) {
+            this.repairs[index] = data.record;
+        }
+        return data.results;
+    }
+
     async savePart() {
         const formData = {
             name: document.getElementById('part-name').value.trim(),
@@ -642,37 +714,11 @@ class CarDetailManager {
         };
 
         try {
-            const csrfToken = this.getCsrfToken();
-            const headers = {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken
-            };
-
             const partId = document.getElementById('part-id').value;
-            let response;
-            if (partId) {
-                response = await fetch(`${this.apiUrl}repairs/${this.currentRepairId}/parts/${partId}/`, {
-                    method: 'PUT',
-                    headers: headers,
-                    credentials: 'include',
-                    body: JSON.stringify(formData)
-                });
-            } else {
-                response = await fetch(`${this.apiUrl}repairs/${this.currentRepairId}/parts/`, {
-                    method: 'POST',
-                    headers: headers,
-                    credentials: 'include',
-                    body: JSON.stringify(formData)
-                });
-            }
-
-            if (!response.ok) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || 'Ошибка при сохранении');
-            }
-
-            // Reload repairs to get updated parts
-            await this.loadRepairs();
+            const operation = partId
+                ? { op: 'update_part', id: parseInt(partId), data: formData }
+                : { op: 'create_part', data: formData };
+            await this.applyRepairBatch(this.currentRepairId, [operation]);
             this.renderRepairs();
             // If parts modal is open, reload parts
             if (this.currentRepairId && document.getElementById('parts-modal').classList.contains('show')) {
@@ -724,20 +770,7 @@ class CarDetailManager {
                 if (repairId) {
                     this.currentRepairId = repairId;
                 }
-                const csrfToken = this.getCsrfToken();
-                const response = await fetch(`${this.apiUrl}repairs/${this.currentRepairId}/parts/${partId}/`, {
-                    method: 'DELETE',
-                    headers: {
-                        'X-CSRFToken': csrfToken
-                    },
-                    credentials: 'include'
-                });
-
-                if (!response.ok) {
-                    throw new Error('Ошибка при удалении');
-                }
-
-                await this.loadRepairs();
+                await this.applyRepairBatch(this.currentRepairId, [{ op: 'delete_part', id: partId }]);
                 this.renderRepairs();
                 if (this.currentRepairId) {
                     await this.loadParts(this.currentRepairId);
@@ -780,7 +813,7 @@ class CarDetailManager {
         document.getElementById('report-modal').classList.remove('show');
     }
 
-    generateReport() {
+    async generateReport() {
         const dateFrom = document.getElementById('report-date-from').value;
         const dateTo = document.getElementById('report-date-to').value;
 
@@ -789,42 +822,39 @@ class CarDetailManager {
             return;
         }
 
-        const fromDate = new Date(dateFrom);
-        const toDate = new Date(dateTo);
-        toDate.setHours(23, 59, 59, 999); // Include the entire end date
-
-        // Filter repairs by date range
-        const filteredRepairs = this.repairs.filter(repair => {
-            const repairDate = new Date(repair.date);
-            return repairDate >= fromDate && repairDate <= toDate;
-        });
-
-        // Calculate totals
-        let totalWorkCost = 0;
-        let totalPartsCost = 0;
-        let recordsCount = filteredRepairs.length;
-
-        filteredRepairs.forEach(repair => {
-            totalWorkCost += parseFloat(repair.work_cost || 0);
-            
-            // Calculate parts cost
-            if (repair.parts && repair.parts.length > 0) {
-                repair.parts.forEach(part => {
-                    totalPartsCost += parseFloat(part.cost || 0);
-                });
+        // Записи и итоги за период загружаются с сервера: в таблице может быть
+        // загружена только часть истории
+        let stats;
+        let filteredRepairs;
+        try {
+            const params = new URLSearchParams({
+                date_from: dateFrom,
+                date_to: dateTo,
+                fields: 'id,date,mileage,work_description,work_cost,parts'
+            });
+            const [statsData, repairsResponse] = await Promise.all([
+                this.loadStats(dateFrom, dateTo),
+                fetch(`${this.apiUrl}repairs/?${params}`, { credentials: 'include' })
+            ]);
+            if (!repairsResponse.ok) {
+                throw new Error(`Ошибка ${repairsResponse.status}`);
             }
-        });
-
-        const totalCost = totalWorkCost + totalPartsCost;
+            stats = statsData;
+            filteredRepairs = await repairsResponse.json();
+        } catch (error) {
+            alert('Ошибка при формировании отчета');
+            console.error('Error loading stats:', error);
+            return;
+        }
 
         // Update summary
-        document.getElementById('report-records-count').textContent = recordsCount;
+        document.getElementById('report-records-count').textContent = stats.records_count;
         document.getElementById('report-total-work-cost').textContent = 
-            totalWorkCost.toLocaleString('ru-RU', {minimumFractionDigits: 2});
+            parseFloat(stats.total_work_cost).toLocaleString('ru-RU', {minimumFractionDigits: 2});
         document.getElementById('report-total-parts-cost').textContent = 
-            totalPartsCost.toLocaleString('ru-RU', {minimumFractionDigits: 2});
+            parseFloat(stats.total_parts_cost).toLocaleString('ru-RU', {minimumFractionDigits: 2});
         document.getElementById('report-total-cost').textContent = 
-            totalCost.toLocaleString('ru-RU', {minimumFractionDigits: 2});
+            parseFloat(stats.total_cost).toLocaleString('ru-RU', {minimumFractionDigits: 2});
 
         // Generate report details
         const detailsDiv = document.getElementById('report-details');
@@ -871,7 +901,7 @@ class CarDetailManager {
         document.getElementById('export-excel-btn').style.display = 'flex';
     }
 
-    exportToExcel() {
+    async exportToExcel() {
         const dateFrom = document.getElementById('report-date-from').value;
         const dateTo = document.getElementById('report-date-to').value;
 
@@ -880,16 +910,50 @@ class CarDetailManager {
             return;
         }
 
-        // Create download URL
-        const url = `${this.apiUrl}export-report/?date_from=${dateFrom}&date_to=${dateTo}`;
-        
-        // Create temporary link and trigger download
-        const link = document.createElement('a');
-        link.href = url;
-        link.download = '';
-        document.body.appendChild(link);
-        link.click();
-        document.body.removeChild(link);
+        try {
+            // Отчет строится в фоне: ставим задание и ждем его готовности
+            const response = await fetch(`${this.apiUrl}report-jobs/`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': this.getCsrfToken()
+                },
+                credentials: 'include',
+                body: JSON.stringify({ date_from: dateFrom, date_to: dateTo })
+            });
+            if (!response.ok) {
+                throw new Error('Не удалось поставить отчет в очередь');
+            }
+            const job = await this.waitForReportJob(await response.json());
+
+            // Create temporary link and trigger download
+            const link = document.createElement('a');
+            link.href = job.download_url;
+            link.download = '';
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+        } catch (error) {
+            alert(`Ошибка: ${error.message}`);
+            console.error('Error exporting report:', error);
+        }
+    }
+
+    async waitForReportJob(job) {
+        while (job.status === 'pending' || job.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const response = await fetch(`${this.apiUrl}report-jobs/${job.id}/`, {
+                credentials: 'include'
+            });
+            if (!response.ok) {
+                throw new Error('Не удалось получить статус отчета');
+            }
+            job = await response.json();
+        }
+        if (job.status !== 'done') {
+            throw new Error(job.error || 'Не удалось построить отчет');
+        }
+        return job;
     }
 
     // Stock Parts Methods
@@ -1305,43 +1369,23 @@ class CarDetailManager {
                 'X-CSRFToken': csrfToken
             };
 
-            // Create parts from stock parts
-            for (const stockPartId of this.selectedStockPartsInPartsModal) {
-                const stockPart = this.stockParts.find(p => p.id === stockPartId);
-                if (!stockPart) continue;
-
-                // Create part in repair
-                const partData = {
-                    name: stockPart.name,
-                    part_code: stockPart.part_code,
-                    manufacturer: stockPart.manufacturer || null,
-                    quantity: parseInt(stockPart.quantity) || 1,
-                    cost: stockPart.cost
-                };
-
-                const response = await fetch(`${this.apiUrl}repairs/${this.currentRepairId}/parts/`, {
-                    method: 'POST',
-                    headers: headers,
-                    credentials: 'include',
-                    body: JSON.stringify(partData)
-                });
-
-                if (!response.ok) {
-                    throw new Error('Ошибка при добавлении запчасти');
-                }
-
-                // Delete stock part
-                const deleteResponse = await fetch(`${this.apiUrl}stock/${stockPartId}/`, {
-                    method: 'DELETE',
-                    headers: {
-                        'X-CSRFToken': csrfToken
-                    },
-                    credentials: 'include'
-                });
+            // Все выбранные запчасти переносятся со склада одним запросом
+            const response = await fetch(`${this.apiUrl}repairs/${this.currentRepairId}/install-stock/`, {
+                method: 'POST',
+                headers: headers,
+                credentials: 'include',
+                body: JSON.stringify({ stock_part_ids: this.selectedStockPartsInPartsModal })
+            });
 
-                if (!deleteResponse.ok) {
-                    console.warn('Не удалось удалить запчасть со склада');
+            if (!response.ok) {
+                let errorMessage = 'Ошибка при добавлении запчастей';
+                try {
+                    const errorData = await response.json();
+                    errorMessage = errorData.error || errorMessage;
+                } catch (e) {
+                    console.error('Error parsing JSON:', e);
                 }
+                throw new Error(errorMessage);
             }
 
             // Reload data
@@ -9,6 +9,9 @@ class CarManager {
         this.currentRepairId = null;
         this.repairs = [];
         this.parts = [];
+        this.pageSize = 24;
+        this.nextPageUrl = null;
+        this.isLoadingMore = false;
         this.init();
     }
 
@@ -16,6 +19,24 @@ class CarManager {
         await this.loadCars();
         this.renderCars();
         this.setupEventListeners();
+        this.setupInfiniteScroll();
+    }
+
+    setupInfiniteScroll() {
+        // Следующая страница загружается, когда пользователь докрутил до конца списка
+        const container = document.getElementById('cars-list');
+        if (!container || !('IntersectionObserver' in window)) {
+            return;
+        }
+        const sentinel = document.createElement('div');
+        sentinel.id = 'cars-list-sentinel';
+        container.after(sentinel);
+        const observer = new IntersectionObserver((entries) => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                this.loadMoreCars();
+            }
+        }, { rootMargin: '200px' });
+        observer.observe(sentinel);
     }
 
     setupEventListeners() {
@@ -447,6 +468,7 @@ class CarManager {
                             ` : ''}
                         </div>
                     ` : ''}
+                    ${this.renderSummary(car.summary)}
                     ${car.notes ? `
                         <div class="car-info-section">
                             <div class="car-info-section-title">Заметки</div>
@@ -469,6 +491,50 @@ class CarManager {
         return card;
     }
 
+    renderSummary(summary) {
+        if (!summary || (!summary.records_count && !summary.stock_parts_count)) {
+            return '';
+        }
+        const money = (value) => `${parseFloat(value).toLocaleString('ru-RU', {minimumFractionDigits: 2})} ₽`;
+        const lastService = summary.last_service_date ? new Date(summary.last_service_date).toLocaleDateString('ru-RU', {
+            year: 'numeric',
+            month: 'short',
+            day: 'numeric'
+        }) : '';
+        return `
+            <div class="car-info-section">
+                <div class="car-info-section-title">Обслуживание</div>
+                ${lastService ? `
+                    <div class="car-info-item">
+                        <span class="material-symbols-outlined">build</span>
+                        <div class="car-info-item-content">
+                            <div class="car-info-item-label">Последнее обслуживание</div>
+                            <div class="car-info-item-value">${lastService}, ${summary.last_mileage.toLocaleString('ru-RU')} км</div>
+                        </div>
+                    </div>
+                ` : ''}
+                ${summary.records_count ? `
+                    <div class="car-info-item">
+                        <span class="material-symbols-outlined">payments</span>
+                        <div class="car-info-item-content">
+                            <div class="car-info-item-label">Потрачено (записей: ${summary.records_count})</div>
+                            <div class="car-info-item-value">${money(summary.total_cost)}</div>
+                        </div>
+                    </div>
+                ` : ''}
+                ${summary.stock_parts_count ? `
+                    <div class="car-info-item">
+                        <span class="material-symbols-outlined">inventory_2</span>
+                        <div class="car-info-item-content">
+                            <div class="car-info-item-label">Ждут установки на складе</div>
+                            <div class="car-info-item-value">${summary.stock_parts_count} шт. на ${money(summary.stock_parts_cost)}</div>
+                        </div>
+                    </div>
+                ` : ''}
+            </div>
+        `;
+    }
+
     escapeHtml(text) {
         const div = document.createElement('div');
         div.textContent = text;
@@ -477,7 +543,8 @@ class CarManager {
 
     async loadCars() {
         try {
-            const response = await fetch(this.apiUrl, {
+            // Итоги по ремонтам и складу приходят в том же ответе (summary)
+            const response = await fetch(`${this.apiUrl}?with_summary=1&page_size=${this.pageSize}`, {
                 credentials: 'include'
             });
             if (!response.ok) {
@@ -487,7 +554,9 @@ class CarManager {
                 }
                 throw new Error('Ошибка при загрузке данных');
             }
-            this.cars = await response.json();
+            const data = await response.json();
+            this.cars = data.results;
+            this.nextPageUrl = data.next;
         } catch (error) {
             console.error('Error loading cars:', error);
             if (error.message.includes('401')) {
@@ -496,6 +565,36 @@ class CarManager {
                 alert('Ошибка при загрузке данных. Проверьте, что сервер запущен.');
             }
             this.cars = [];
+            this.nextPageUrl = null;
+        }
+    }
+
+    async loadMoreCars() {
+        if (!this.nextPageUrl || this.isLoadingMore) {
+            return;
+        }
+        this.isLoadingMore = true;
+        try {
+            const response = await fetch(this.nextPageUrl, {
+                credentials: 'include'
+            });
+            if (!response.ok) {
+                throw new Error(`Ошибка ${response.status}`);
+            }
+            const data = await response.json();
+            this.cars = this.cars.concat(data.results);
+            this.nextPageUrl = data.next;
+
+            const container = document.getElementById('cars-list');
+            if (container) {
+                data.results.forEach(car => {
+                    container.appendChild(this.createCarCard(car));
+                });
+            }
+        } catch (error) {
+            console.error('Error loading more cars:', error);
+        } finally {
+            this.isLoadingMore = false;
         }
     }
 
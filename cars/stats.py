@@ -0,0 +1,164 @@
+"""Агрегированная статистика расходов по автомобилю
+
+Итоги и разбивка по годам собираются из помесячных строк. Если период
+состоит из целых месяцев (или не задан), строки берутся из предрасчитанных
+итогов CarMonthRollup (см. rollups.py), иначе записи о ремонте и запчасти
+группируются по месяцам (TruncMonth) в БД. Количество запросов не зависит
+от объема истории.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, IntegerField, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from .models import CarMonthRollup, RepairRecord, Part, StockPart
+
+ZERO = Decimal('0.00')
+
+MONEY_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+def line_cost():
+    """Выражение стоимости строки запчасти: цена за единицу * количество"""
+    return F('cost') * F('quantity')
+
+
+def filter_period(queryset, date_field, date_from=None, date_to=None):
+    if date_from is not None:
+        queryset = queryset.filter(**{f'{date_field}__gte': date_from})
+    if date_to is not None:
+        queryset = queryset.filter(**{f'{date_field}__lte': date_to})
+    return queryset
+
+
+def _empty_bucket(period):
+    return {
+        'period': period,
+        'records_count': 0,
+        'parts_count': 0,
+        'work_cost': ZERO,
+        'parts_cost': ZERO,
+        'total_cost': ZERO,
+    }
+
+
+def _add_to_bucket(bucket, other):
+    for key in ('records_count', 'parts_count', 'work_cost', 'parts_cost', 'total_cost'):
+        bucket[key] += other[key]
+
+
+def covers_whole_months(date_from, date_to):
+    """Период начинается первым и заканчивается последним числом месяца"""
+    return (date_from is None or date_from.day == 1) and (date_to is None or (date_to + timedelta(days=1)).day == 1)
+
+
+def _monthly_rows(car, date_from, date_to):
+    """Строки по месяцам: month, records_count, work_cost, min_mileage,
+    max_mileage, parts_count, parts_cost"""
+    if covers_whole_months(date_from, date_to):
+        return filter_period(CarMonthRollup.objects.filter(car=car), 'month', date_from, date_to).values(
+            'month', 'records_count', 'work_cost', 'min_mileage', 'max_mileage', 'parts_count', 'parts_cost',
+        )
+
+    records = filter_period(RepairRecord.objects.filter(car=car), 'date', date_from, date_to)
+    monthly_records = (
+        records
+        .annotate(month=TruncMonth('date'))
+        .values('month')
+        .annotate(
+            records_count=Count('id'),
+            work_cost=Sum('work_cost'),
+            min_mileage=Min('mileage'),
+            max_mileage=Max('mileage'),
+        )
+        .order_by('month')
+    )
+
+    parts = filter_period(Part.objects.filter(repair_record__car=car), 'repair_record__date', date_from, date_to)
+    monthly_parts = {
+        row['month']: row
+        for row in parts
+        .annotate(month=TruncMonth('repair_record__date'))
+        .values('month')
+        .annotate(
+            parts_count=Count('id'),
+            parts_cost=Sum(line_cost(), output_field=MONEY_FIELD),
+        )
+        .order_by('month')
+    }
+    rows = []
+    for row in monthly_records:
+        row_parts = monthly_parts.get(row['month'], {})
+        rows.append({**row, 'parts_count': row_parts.get('parts_count', 0), 'parts_cost': row_parts.get('parts_cost')})
+    return rows
+
+
+def compute_car_stats(car, date_from=None, date_to=None):
+    """Статистика расходов по автомобилю за период (границы включительно)"""
+    stock_parts_cost = StockPart.objects.filter(car=car).aggregate(
+        total=Coalesce(Sum(line_cost(), output_field=MONEY_FIELD), ZERO, output_field=MONEY_FIELD)
+    )['total']
+
+    months = {}
+    mileages = []
+    for row in _monthly_rows(car, date_from, date_to):
+        bucket = months.setdefault(row['month'], _empty_bucket(row['month'].strftime('%Y-%m')))
+        bucket['records_count'] = row['records_count']
+        bucket['work_cost'] = row['work_cost'] or ZERO
+        bucket['parts_count'] = row['parts_count']
+        bucket['parts_cost'] = row['parts_cost'] or ZERO
+        mileages.extend([row['min_mileage'], row['max_mileage']])
+
+    by_month = [months[month] for month in sorted(months)]
+    totals = _empty_bucket(None)
+    years = {}
+    for bucket in by_month:
+        bucket['total_cost'] = bucket['work_cost'] + bucket['parts_cost']
+        _add_to_bucket(totals, bucket)
+        year = bucket['period'][:4]
+        _add_to_bucket(years.setdefault(year, _empty_bucket(year)), bucket)
+
+    mileage_from = min(mileages) if mileages else None
+    mileage_to = max(mileages) if mileages else None
+    distance = mileage_to - mileage_from if mileages else 0
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'records_count': totals['records_count'],
+        'parts_count': totals['parts_count'],
+        'total_work_cost': totals['work_cost'],
+        'total_parts_cost': totals['parts_cost'],
+        'total_cost': totals['total_cost'],
+        'stock_parts_cost': stock_parts_cost,
+        'mileage_from': mileage_from,
+        'mileage_to': mileage_to,
+        'cost_per_km': totals['total_cost'] / distance if distance > 0 else None,
+        'by_month': by_month,
+        'by_year': [years[year] for year in sorted(years)],
+    }
+
+
+def with_summary(cars):
+    """Автомобили с итогами для списка (поля summary_*): записи о ремонте,
+    расходы и последнее обслуживание из CarRollup, запчасти на складе -
+    подзапросами. Весь список - один запрос независимо от числа автомобилей.
+    """
+    stock_parts = StockPart.objects.filter(car=OuterRef('pk')).order_by().values('car')
+    return cars.annotate(
+        summary_records_count=Coalesce(F('rollup__records_count'), 0),
+        summary_work_cost=Coalesce(F('rollup__work_cost'), ZERO, output_field=MONEY_FIELD),
+        summary_parts_cost=Coalesce(F('rollup__parts_cost'), ZERO, output_field=MONEY_FIELD),
+        summary_last_service_date=F('rollup__last_service_date'),
+        summary_last_mileage=F('rollup__last_mileage'),
+        summary_stock_parts_count=Coalesce(
+            Subquery(stock_parts.annotate(count=Count('id')).values('count'), output_field=IntegerField()), 0,
+        ),
+        summary_stock_parts_cost=Coalesce(
+            Subquery(stock_parts.annotate(total=Sum(line_cost(), output_field=MONEY_FIELD)).values('total')),
+            ZERO, output_field=MONEY_FIELD,
+        ),
+    ).annotate(
+        summary_total_cost=ExpressionWrapper(F('summary_work_cost') + F('summary_parts_cost'), output_field=MONEY_FIELD),
+    )
@@ -0,0 +1,180 @@
+"""Инкрементальная синхронизация данных гаража с клиентами
+
+Клиент хранит копию своих автомобилей, записей о ремонте, запчастей и склада
+и запрашивает /api/sync/?since=<cursor>: в ответе только строки, созданные
+или измененные после курсора (по updated_at), ID удаленных объектов и новый
+курсор. Без курсора, а также с курсором старше TOMBSTONE_TTL отдаются все
+данные с признаком reset - клиент заменяет ими свою копию.
+
+Удаления записываются в Tombstone сигналами post_delete (signals.py). Объекты,
+удаленные каскадом вместе с автомобилем или записью о ремонте, отметок не
+получают: клиент удаляет их вместе с родителем. При удалении пользователя
+отметки не пишутся вовсе. Внутри batch() отметки
+копятся и записываются одним bulk_create при выходе.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .cache import car_owner
+from .models import Car, Part, RepairRecord, StockPart, Tombstone
+
+# Изменения за столько времени до курсора отдаются повторно: updated_at
+# проставляется до фиксации транзакции, и строки медленной транзакции иначе
+# попали бы между курсорами. Клиент применяет строки по ID, повтор безвреден.
+SYNC_OVERLAP = timedelta(seconds=5)
+
+# Сколько хранятся отметки об удалении (manage.py prune_tombstones)
+TOMBSTONE_TTL = timedelta(days=30)
+
+KINDS = {
+    Car: Tombstone.KIND_CAR,
+    RepairRecord: Tombstone.KIND_REPAIR,
+    Part: Tombstone.KIND_PART,
+    StockPart: Tombstone.KIND_STOCK,
+}
+
+# Разделы ответа по типам объектов
+SECTIONS = {
+    Tombstone.KIND_CAR: 'cars',
+    Tombstone.KIND_REPAIR: 'repairs',
+    Tombstone.KIND_PART: 'parts',
+    Tombstone.KIND_STOCK: 'stock',
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+_local = threading.local()
+
+
+class InvalidCursor(ValueError):
+    """Курсор не получен из ответа /api/sync/"""
+
+
+def make_cursor(moment):
+    """Курсор - время в микросекундах от начала эпохи (строка без символов,
+    требующих кодирования в URL)"""
+    delta = moment - _EPOCH
+    return str((delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds)
+
+
+def parse_cursor(cursor):
+    try:
+        return _EPOCH + timedelta(microseconds=int(cursor))
+    except (TypeError, ValueError, OverflowError):
+        raise InvalidCursor(cursor)
+
+
+@contextmanager
+def batch():
+    """Копит отметки об удалении и записывает их одним запросом при выходе.
+    Вложенный batch() входит во внешний."""
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    pending = _local.pending = []
+    try:
+        yield
+    finally:
+        _local.pending = None
+    Tombstone.objects.bulk_create(pending)
+
+
+def _deleting():
+    if not hasattr(_local, 'deleting'):
+        _local.deleting = set()
+    return _local.deleting
+
+
+def _parent_key(instance):
+    if isinstance(instance, Car):
+        return User, instance.user_id
+    if isinstance(instance, Part):
+        return RepairRecord, instance.repair_record_id
+    return Car, instance.car_id
+
+
+def _owner_id(instance):
+    if isinstance(instance, Car):
+        return instance.user_id
+    if isinstance(instance, Part):
+        if Part.repair_record.is_cached(instance):
+            car_id = instance.repair_record.car_id
+        else:
+            car_id = RepairRecord.objects.filter(pk=instance.repair_record_id).values_list('car_id', flat=True).first()
+        return car_owner(car_id) if car_id is not None else None
+    return car_owner(instance.car_id)
+
+
+def object_deleting(instance):
+    """pre_delete пользователя, автомобиля или записи о ремонте: каскадно
+    удаляемые дочерние объекты не получают отдельных отметок (у удаленного
+    пользователя отметки удаляются вместе с ним)"""
+    _deleting().add((type(instance), instance.pk))
+
+
+def object_deleted(instance):
+    """post_delete: отметка об удалении объекта для клиентов"""
+    deleting = _deleting()
+    deleting.discard((type(instance), instance.pk))
+    if type(instance) not in KINDS or _parent_key(instance) in deleting:
+        return
+    user_id = _owner_id(instance)
+    if user_id is None:
+        return
+    tombstone = Tombstone(user_id=user_id, kind=KINDS[type(instance)], object_id=instance.pk)
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.append(tombstone)
+    else:
+        tombstone.save()
+
+
+def changes_since(user, since=None):
+    """Данные пользователя, измененные с момента since (None - все).
+
+    Возвращает словарь: cursor для следующего запроса, reset (True - это все
+    данные, а не изменения), списки объектов cars, repairs, parts, stock и
+    deleted - ID удаленных объектов по тем же разделам.
+    """
+    now = timezone.now()
+    # Отметки старше TOMBSTONE_TTL могли быть удалены
+    reset = since is None or since - SYNC_OVERLAP < now - TOMBSTONE_TTL
+    # История автомобилей, удаляемых в фоне, скрыта вместе с ними (deletion.py)
+    querysets = {
+        'cars': Car.objects.filter(user=user),
+        'repairs': RepairRecord.objects.filter(car__user=user, car__deleting_since__isnull=True),
+        'parts': Part.objects.filter(
+            repair_record__car__user=user, repair_record__car__deleting_since__isnull=True,
+        ).select_related('catalog'),
+        'stock': StockPart.objects.filter(car__user=user, car__deleting_since__isnull=True).select_related('catalog'),
+    }
+    deleted = {section: [] for section in SECTIONS.values()}
+    if not reset:
+        start = since - SYNC_OVERLAP
+        querysets = {section: queryset.filter(updated_at__gte=start) for section, queryset in querysets.items()}
+        tombstones = (
+            Tombstone.objects
+            .filter(user=user, deleted_at__gte=start)
+            .order_by('deleted_at', 'pk')
+            .values_list('kind', 'object_id')
+        )
+        for kind, object_id in tombstones:
+            deleted[SECTIONS[kind]].append(object_id)
+
+    return {
+        'cursor': make_cursor(now),
+        'reset': reset,
+        **{section: list(queryset) for section, queryset in querysets.items()},
+        'deleted': deleted,
+    }
+
+
+def prune_tombstones():
+    """Удаляет отметки старше TOMBSTONE_TTL; клиенты с таким старым курсором
+    получат все данные заново. Возвращает число удаленных отметок."""
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - TOMBSTONE_TTL).delete()
+    return deleted
@@ -1,3 +1,1764 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+from importlib import import_module
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+
+from rest_framework.renderers import JSONRenderer
+
+from .authentication import CachedModelBackend
+from . import deletion
+from .deletion import delete_car, delete_hidden_cars, delete_user
+from .benchmark import compare_reports, run_benchmark, run_serialization_benchmark, run_server_benchmark
+from .metrics import registry
+from .jobs import claim_job, process_next_job, process_report_job, purge_report_jobs
+from .models import (
+    ApiToken, Car, CarMonthRollup, CarRollup, RepairRecord, Part, PartCatalog, StockPart, ReportJob, SearchEntry, Tombstone,
+    prefetch_parts,
+)
+from .ownership import NotOwned, get_owned
+from .query_audit import analyze
+from .renderers import render_json
+from .rollups import check_rollups
+from .row_serializers import RowSerializer, UnsupportedSerializer
+from .seeding import seed_garage
+from .serializers import (
+    CarSerializer, CarWithSummarySerializer, RepairRecordSerializer, ReportJobSerializer, StockPartSerializer,
+)
+from .stats import with_summary
+from .sync import make_cursor
+
+
+class GarageTestCase(TestCase):
+    """Базовый класс: пользователь с автомобилем и авторизованный клиент"""
+    # Чтение сессии из БД на каждом запросе, если сессии не кэшируются (SHARED_CACHE)
+    session_queries = 0 if settings.SHARED_CACHE else 1
+
+    def setUp(self):
+        # Кэш ответов API живет в памяти процесса и переживает откат БД между тестами
+        caches[settings.API_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(username='owner', password='secret-pass-123')
+        self.car = Car.objects.create(user=self.user, brand='Lada', model='Vesta', vin='XTA00000000000001')
+        self.client.force_login(self.user)
+        # Пользователь сессии - в кэше процесса, как после первого запроса:
+        # число SQL-запросов одинаково у всех запросов теста
+        CachedModelBackend().get_user(self.user.pk)
+
+    def create_records(self, count, parts_per_record=2, car=None):
+        car = car or self.car
+        records = []
+        for i in range(count):
+            record = RepairRecord.objects.create(
+                car=car,
+                date=date(2024, 1 + i % 12, 1 + i % 28),
+                mileage=10000 + i * 1000,
+                work_description=f'Работа {i}',
+                work_cost=Decimal('1000.00'),
+            )
+            for j in range(parts_per_record):
+                Part.objects.create(
+                    repair_record=record,
+                    name=f'Деталь {i}-{j}',
+                    part_code=f'P{i}-{j}',
+                    manufacturer='Bosch',
+                    quantity=2,
+                    cost=Decimal('150.50'),
+                )
+            records.append(record)
+        return records
+
+
+class RepairRecordQueryCountTests(GarageTestCase):
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_repair_list_query_count_is_constant(self):
+        url = reverse('repair-record-list', args=[self.car.id])
+        self.create_records(1)
+        small_count, data = self.count_queries(url)
+        self.assertEqual(len(data), 1)
+
+        self.create_records(25)
+        large_count, data = self.count_queries(url)
+        self.assertEqual(len(data), 26)
+        self.assertEqual(small_count, large_count)
+
+    def test_delete_query_count_does_not_depend_on_parts(self):
+        for parts in (1, 10):
+            record = self.create_records(1, parts_per_record=parts)[0]
+            url = reverse('repair-record-detail', args=[self.car.id, record.id])
+            # Запись и ее запчасти; итоги и отметки об удалении - одним набором
+            # запросов на запись, а не на каждую запчасть
+            with self.assertNumQueries(17 + self.session_queries):
+                response = self.client.delete(url)
+            self.assertEqual(response.status_code, 204)
+            self.assertFalse(Part.objects.filter(repair_record_id=record.id).exists())
+        self.assertEqual(check_rollups(), [])
+        self.assertEqual(CarRollup.objects.get(car=self.car).parts_count, 0)
+
+    def test_repair_list_keeps_nested_parts(self):
+        self.create_records(3, parts_per_record=2)
+        response = self.client.get(reverse('repair-record-list', args=[self.car.id]))
+        for record in response.json():
+            self.assertEqual(len(record['parts']), 2)
+            self.assertEqual(
+                set(record['parts'][0]),
+                {'id', 'name', 'part_code', 'manufacturer', 'quantity', 'cost', 'created_at', 'updated_at'},
+            )
+
+
+# Поток пула отчетов не видит незафиксированных данных TestCase
+@override_settings(REPORT_WORKERS=0)
+class ExportReportTests(GarageTestCase):
+    def export(self, date_from='2024-01-01', date_to='2024-12-31'):
+        url = reverse('export-report', args=[self.car.id])
+        return self.client.get(url, {'date_from': date_from, 'date_to': date_to})
+
+    def test_export_streams_report_with_totals(self):
+        self.create_records(3, parts_per_record=2)
+        response = self.export()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="report_Lada_Vesta_20240101_20241231.xlsx"', response['Content-Disposition'])
+
+        ws = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        self.assertEqual(ws['A1'].value, 'Отчет о ремонте: Lada Vesta')
+        self.assertEqual(ws['A2'].value, 'VIN: XTA00000000000001')
+        self.assertEqual(ws['A5'].value, 'Дата')
+        self.assertEqual([ws.cell(row=row, column=4).value for row in range(6, 9)], [1000.0] * 3)
+        self.assertEqual(ws['F6'].value, 602.0)
+        self.assertEqual(ws['C10'].value, 'ИТОГО:')
+        self.assertEqual(ws['D10'].value, 3000.0)
+        self.assertEqual(ws['F10'].value, 1806.0)
+        self.assertEqual(ws['E11'].value, 4806.0)
+        self.assertEqual(
+            {str(cells) for cells in ws.merged_cells.ranges},
+            {'A1:F1', 'A2:F2', 'A3:F3', 'C11:D11', 'E11:F11'},
+        )
+
+    def test_export_query_count_is_constant(self):
+        self.create_records(2)
+        with CaptureQueriesContext(connection) as small:
+            b''.join(self.export().streaming_content)
+        self.create_records(20)
+        with CaptureQueriesContext(connection) as large:
+            b''.join(self.export().streaming_content)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_export_requires_period(self):
+        response = self.client.get(reverse('export-report', args=[self.car.id]))
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(REPORT_WORKERS=0)
+class FleetReportTests(GarageTestCase):
+    def fleet_report(self, **params):
+        return self.client.get(reverse('fleet-report'), {'date_from': '2024-01-01', 'date_to': '2024-12-31', **params})
+
+    def load(self, response):
+        self.assertEqual(response.status_code, 200)
+        return load_workbook(BytesIO(b''.join(response.streaming_content)))
+
+    def add_car(self, number, records=0, user=None):
+        car = Car.objects.create(user=user or self.user, brand='Kia', model='Rio', vin=f'Z94CB41AAGR{number:06d}')
+        self.create_records(records, parts_per_record=1, car=car)
+        return car
+
+    def test_sheet_per_car_and_summary(self):
+        self.create_records(3, parts_per_record=2)
+        empty_car = self.add_car(1)
+        self.add_car(2, records=2, user=User.objects.create_user(username='other', password='secret-pass-123'))
+
+        response = self.fleet_report()
+        self.assertIn('fleet_report_20240101_20241231.xlsx', response['Content-Disposition'])
+        wb = self.load(response)
+        self.assertEqual(wb.sheetnames, ['Сводка', f'{self.car.pk} Lada Vesta', f'{empty_car.pk} Kia Rio'])
+
+        summary = wb['Сводка']
+        self.assertEqual([summary.cell(row=6, column=col).value for col in range(1, 7)],
+                         ['Lada Vesta', 'XTA00000000000001', 3, 3000.0, 1806.0, 4806.0])
+        self.assertEqual(summary['C7'].value, 0)
+        self.assertEqual(summary['A9'].value, 'ИТОГО:')
+        self.assertEqual(summary['F9'].value, 4806.0)
+
+        car_sheet = wb[f'{self.car.pk} Lada Vesta']
+        self.assertEqual([car_sheet.cell(row=row, column=3).value for row in range(6, 9)],
+                         ['Работа 0', 'Работа 1', 'Работа 2'])
+        self.assertEqual(car_sheet['E11'].value, 4806.0)
+        self.assertEqual(wb[f'{empty_car.pk} Kia Rio']['C7'].value, 'ИТОГО:')
+
+    def test_selected_cars(self):
+        car = self.add_car(1, records=1)
+        wb = self.load(self.fleet_report(car_ids=str(car.pk)))
+        self.assertEqual(wb.sheetnames, ['Сводка', f'{car.pk} Kia Rio'])
+
+        other = self.add_car(2, user=User.objects.create_user(username='other', password='secret-pass-123'))
+        response = self.fleet_report(car_ids=f'{car.pk},{other.pk}')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['car_ids'], [other.pk])
+        self.assertEqual(self.fleet_report(car_ids='1,x').status_code, 400)
+
+    def test_query_count_does_not_depend_on_fleet_size(self):
+        self.create_records(2)
+        with CaptureQueriesContext(connection) as small:
+            self.load(self.fleet_report())
+        for number in range(1, 6):
+            self.add_car(number, records=3)
+        with CaptureQueriesContext(connection) as large:
+            self.load(self.fleet_report())
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class SearchTests(GarageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.timing = RepairRecord.objects.create(car=self.car, date=date(2024, 3, 1), mileage=60000,
+                                                  work_description='Замена ремня ГРМ', work_cost=Decimal('9000.00'))
+        self.service = RepairRecord.objects.create(
+            car=self.car, date=date(2024, 5, 1), mileage=70000, work_cost=Decimal('5000.00'),
+            work_description='Плановое ТО: замена масляного фильтра, проверка ремня и тормозных колодок',
+        )
+        self.part = Part.objects.create(repair_record=self.timing, name='Ремень ГРМ', part_code='0 986-452-041',
+                                        manufacturer='Bosch', cost=Decimal('3000.00'))
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('search'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(hit['kind'], hit['id']) for hit in response.json()]
+
+    def test_russian_word_forms_and_ranking(self):
+        self.assertEqual(self.search('масляный фильтр'), [('repair', self.service.id)])
+        self.assertEqual(self.search('тормозные'), [('repair', self.service.id)])
+        # Короткий текст с тем же словом релевантнее
+        self.assertEqual(self.search('ремня', kind='repair'), [('repair', self.timing.id), ('repair', self.service.id)])
+
+    def test_part_codes(self):
+        for q in ('0986452041', '986-452', 'bosch'):
+            self.assertEqual(self.search(q), [('part', self.part.id)])
+        hit = self.client.get(reverse('search'), {'q': 'bosch'}).json()[0]
+        self.assertEqual(hit['car'], 'Lada Vesta')
+        self.assertEqual(hit['repair_record_id'], self.timing.id)
+        self.assertEqual(hit['date'], '2024-03-01')
+
+    def test_filters_and_other_users(self):
+        other = User.objects.create_user(username='other', password='secret-pass-123')
+        other_car = Car.objects.create(user=other, brand='Kia', model='Rio', vin='Z94CB41AAGR000001')
+        RepairRecord.objects.create(car=other_car, date=date(2024, 1, 1), mileage=1, work_description='Замена ремня ГРМ',
+                                    work_cost=Decimal('1.00'))
+        self.assertEqual(self.search('грм'), [('repair', self.timing.id), ('part', self.part.id)])
+        self.assertEqual(self.search('грм', kind='part'), [('part', self.part.id)])
+        self.assertEqual(self.search('грм', car_id=other_car.id), [])
+        self.assertEqual(self.search('грм', limit=1), [('repair', self.timing.id)])
+
+    def test_index_follows_changes(self):
+        self.timing.work_description = 'Замена помпы'
+        self.timing.date = date(2024, 4, 1)
+        self.timing.save()
+        self.assertEqual(self.search('помпа'), [('repair', self.timing.id)])
+        self.assertEqual(self.search('ремня', kind='repair'), [('repair', self.service.id)])
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'bosch'}).json()[0]['date'], '2024-04-01')
+
+        self.part.delete()
+        self.assertEqual(self.search('bosch'), [])
+        self.timing.delete()
+        self.assertEqual(SearchEntry.objects.count(), 1)
+
+        stock_part = StockPart.objects.create(car=self.car, name='Свеча зажигания', part_code='BKR6E',
+                                              manufacturer='NGK', cost=Decimal('350.00'))
+        self.assertEqual(self.search('свечи'), [('stock', stock_part.id)])
+        self.client.post(reverse('repair-record-install-stock', args=[self.car.id, self.service.id]),
+                         {'stock_part_ids': [stock_part.id]}, content_type='application/json')
+        self.assertEqual([kind for kind, _ in self.search('свечи')], ['part'])
+
+    def test_rebuild_command(self):
+        SearchEntry.objects.all().delete()
+        self.assertEqual(self.search('грм'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.search('грм')), 2)
+        self.assertEqual(SearchEntry.objects.count(), 3)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(reverse('search')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'грм', 'kind': 'car'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'грм', 'limit': 'x'}).status_code, 400)
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_admin_uses_index(self):
+        admin_user = User.objects.create_superuser(username='admin', password='secret-pass-123')
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse('admin:cars_part_changelist'), {'q': '0986452041'})
+        self.assertEqual(list(response.context['cl'].queryset), [self.part])
+
+
+class PartCatalogTests(GarageTestCase):
+    def test_same_code_and_manufacturer_share_catalog_entry(self):
+        record = self.create_records(1, parts_per_record=0)[0]
+        part = Part.objects.create(repair_record=record, name='Фильтр', part_code='W712', manufacturer='Mann', cost=Decimal('1.00'))
+        stock_part = StockPart.objects.create(car=self.car, name='Фильтр масляный', part_code=' W712 ', manufacturer='Mann',
+                                              cost=Decimal('1.00'))
+        self.assertEqual(part.catalog_id, stock_part.catalog_id)
+        self.assertEqual(PartCatalog.objects.count(), 1)
+        self.assertEqual(stock_part.name, 'Фильтр масляный')
+
+    def test_install_reuses_catalog_entry(self):
+        record = self.create_records(1, parts_per_record=0)[0]
+        stock_part = StockPart.objects.create(car=self.car, name='Свеча', part_code='BKR6E', manufacturer='NGK', cost=Decimal('1.00'))
+        url = reverse('repair-record-install-stock', args=[self.car.id, record.id])
+        response = self.client.post(url, {'stock_part_ids': [stock_part.id]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['parts'][0]['part_code'], 'BKR6E')
+        self.assertEqual(record.parts.get().catalog_id, stock_part.catalog_id)
+        self.assertEqual(PartCatalog.objects.count(), 1)
+
+    def test_api_changes_catalog_entry(self):
+        record = self.create_records(1, parts_per_record=1)[0]
+        part = record.parts.get()
+        url = reverse('part-detail', args=[self.car.id, record.id, part.id])
+        data = {'name': part.name, 'part_code': 'NEW-1', 'manufacturer': 'Mann', 'quantity': 1, 'cost': '5.00'}
+        response = self.client.put(url, data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['part_code'], response.json()['manufacturer']), ('NEW-1', 'Mann'))
+        part.refresh_from_db()
+        self.assertEqual(str(part.catalog), 'Mann NEW-1')
+        # Прежняя позиция остается в каталоге
+        self.assertTrue(PartCatalog.objects.filter(part_code='P0-0', manufacturer='Bosch').exists())
+
+    def test_bulk_assign_resolves_catalog_in_constant_queries(self):
+        PartCatalog.objects.create(part_code='F1', manufacturer='Mann')
+        stock_parts = [
+            StockPart(car=self.car, name=f'Деталь {i}', part_code=f'F{i % 5}', manufacturer='Mann', cost=Decimal('1.00'))
+            for i in range(20)
+        ]
+        with self.assertNumQueries(3):
+            PartCatalog.objects.assign(stock_parts)
+        self.assertEqual(PartCatalog.objects.count(), 5)
+        self.assertEqual(len({stock_part.catalog_id for stock_part in stock_parts}), 5)
+        StockPart.objects.bulk_create(stock_parts)
+        self.assertEqual(StockPart.objects.filter(catalog__part_code='F1').count(), 4)
+
+
+class RollupTests(GarageTestCase):
+    def assertRollupsConsistent(self):
+        self.assertEqual(check_rollups(), [])
+
+    def test_rollups_follow_records_and_parts(self):
+        records = self.create_records(3, parts_per_record=2)
+        rollup = CarRollup.objects.get(car=self.car)
+        self.assertEqual((rollup.records_count, rollup.parts_count), (3, 6))
+        self.assertEqual(rollup.work_cost, Decimal('3000.00'))
+        self.assertEqual(rollup.parts_cost, Decimal('1806.00'))
+        self.assertEqual((rollup.last_mileage, rollup.last_service_date), (12000, date(2024, 3, 3)))
+        self.assertRollupsConsistent()
+
+        # Запись переезжает в другой месяц вместе с запчастями
+        record = records[2]
+        record.date = date(2023, 12, 31)
+        record.mileage = 9000
+        record.save()
+        part = records[0].parts.first()
+        part.quantity = 5
+        part.save()
+        self.assertRollupsConsistent()
+        self.assertFalse(CarMonthRollup.objects.filter(car=self.car, month=date(2024, 3, 1)).exists())
+
+        records[1].parts.first().delete()
+        records[1].delete()
+        self.assertRollupsConsistent()
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.records_count, rollup.last_mileage, rollup.last_service_date), (2, 10000, date(2024, 1, 1)))
+
+    def test_api_changes_update_rollups(self):
+        record = self.create_records(1, parts_per_record=0)[0]
+        stock_part = StockPart.objects.create(car=self.car, name='Свеча', part_code='S1', manufacturer='NGK', quantity=4, cost=Decimal('300.00'))
+        url = reverse('repair-record-install-stock', args=[self.car.id, record.id])
+        self.assertEqual(self.client.post(url, {'stock_part_ids': [stock_part.id]}, content_type='application/json').status_code, 200)
+        url = reverse('repair-record-detail', args=[self.car.id, record.id])
+        data = {'date': '2024-05-10', 'mileage': 15000, 'work_description': 'Замена свечей', 'work_cost': '700.00'}
+        self.assertEqual(self.client.put(url, data, content_type='application/json').status_code, 200)
+        self.assertRollupsConsistent()
+        rollup = CarRollup.objects.get(car=self.car)
+        self.assertEqual((rollup.parts_cost, rollup.work_cost, rollup.last_mileage), (Decimal('1200.00'), Decimal('700.00'), 15000))
+
+    def test_rebuild_command_fixes_drift(self):
+        self.create_records(2)
+        CarMonthRollup.objects.filter(car=self.car).update(work_cost=0)
+        CarRollup.objects.filter(car=self.car).delete()
+        self.assertTrue(check_rollups())
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+        out = StringIO()
+        call_command('rebuild_rollups', '--car', str(self.car.id), stdout=out)
+        self.assertIn('строк по месяцам: 2', out.getvalue())
+        self.assertRollupsConsistent()
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+    def test_stats_for_whole_months_read_rollups(self):
+        self.create_records(3)
+        url = reverse('car-stats', args=[self.car.id])
+        with CaptureQueriesContext(connection) as ctx:
+            rollup_stats = self.client.get(url, {'date_from': '2024-01-01', 'date_to': '2024-12-31'}).json()
+        self.assertTrue(any('cars_carmonthrollup' in query['sql'] for query in ctx.captured_queries))
+        self.assertEqual(rollup_stats['records_count'], 3)
+
+        # Тот же период с границами внутри месяцев считается по исходным таблицам
+        source_stats = self.client.get(url, {'date_from': '2024-01-01', 'date_to': '2024-12-30'}).json()
+        self.assertEqual(rollup_stats['by_month'], source_stats['by_month'])
+        self.assertEqual(rollup_stats['cost_per_km'], source_stats['cost_per_km'])
+
+
+class SyncTests(GarageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.records = self.create_records(2, parts_per_record=2)
+        self.stock_part = StockPart.objects.create(car=self.car, name='Свеча', part_code='BKR6E', manufacturer='NGK',
+                                                   cost=Decimal('350.00'))
+
+    def sync(self, since=None):
+        response = self.client.get(reverse('sync'), {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def synced_cursor(self):
+        """Курсор после синхронизации; прежние изменения старше окна повтора"""
+        hour_ago = timezone.now() - timedelta(hours=1)
+        for model in (Car, RepairRecord, Part, StockPart):
+            model.objects.update(updated_at=hour_ago)
+        Tombstone.objects.update(deleted_at=hour_ago)
+        return self.sync()['cursor']
+
+    def ids(self, rows):
+        return sorted(row['id'] for row in rows)
+
+    def test_full_sync(self):
+        other = User.objects.create_user(username='other', password='secret-pass-123')
+        Car.objects.create(user=other, brand='Kia', model='Rio', vin='XTA00000000000002')
+        data = self.sync()
+        self.assertTrue(data['reset'])
+        self.assertEqual(self.ids(data['cars']), [self.car.id])
+        self.assertEqual(self.ids(data['repairs']), sorted(record.id for record in self.records))
+        self.assertEqual(len(data['parts']), 4)
+        self.assertIn(data['parts'][0]['repair_record'], {record.id for record in self.records})
+        self.assertEqual(data['stock'][0]['car'], self.car.id)
+        self.assertEqual(data['stock'][0]['part_code'], 'BKR6E')
+        self.assertNotIn('parts', data['repairs'][0])
+        self.assertEqual(data['deleted'], {'cars': [], 'repairs': [], 'parts': [], 'stock': []})
+
+    def test_changes_since_cursor(self):
+        cursor = self.synced_cursor()
+        self.assertEqual(self.sync(cursor)['parts'], [])
+
+        kept, removed = self.records
+        part, deleted_part = kept.parts.order_by('pk')
+        response = self.client.put(
+            reverse('part-detail', args=[self.car.id, kept.id, part.id]),
+            {'name': 'Фильтр', 'part_code': 'W712', 'manufacturer': 'Mann', 'quantity': 1, 'cost': '450.00'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        deleted_part_id, removed_id = deleted_part.pk, removed.pk
+        removed_parts = list(removed.parts.values_list('pk', flat=True))
+        deleted_part.delete()
+        removed.delete()
+        new_stock = StockPart.objects.create(car=self.car, name='Масло', part_code='5W30', manufacturer='Shell',
+                                             cost=Decimal('900.00'))
+
+        data = self.sync(cursor)
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['cars'], [])
+        self.assertEqual(data['repairs'], [])
+        self.assertEqual(self.ids(data['parts']), [part.id])
+        self.assertEqual(data['parts'][0]['part_code'], 'W712')
+        self.assertEqual(self.ids(data['stock']), [new_stock.id])
+        # Запчасти удаленной записи о ремонте клиент удаляет вместе с ней
+        self.assertEqual(data['deleted'], {'cars': [], 'repairs': [removed_id], 'parts': [deleted_part_id], 'stock': []})
+        self.assertFalse(Tombstone.objects.filter(kind=Tombstone.KIND_PART, object_id__in=removed_parts).exists())
+
+    def test_car_delete_records_single_tombstone(self):
+        cursor = self.synced_cursor()
+        response = self.client.delete(f"{reverse('car-list')}{self.car.id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Tombstone.objects.count(), 1)
+        data = self.sync(cursor)
+        self.assertEqual(data['deleted'], {'cars': [self.car.id], 'repairs': [], 'parts': [], 'stock': []})
+
+    def test_user_delete_writes_no_tombstones(self):
+        self.user.delete()
+        self.assertFalse(Car.objects.exists())
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_batch_and_stock_install_are_tracked(self):
+        cursor = self.synced_cursor()
+        record = self.records[0]
+        part = record.parts.order_by('pk').first()
+        response = self.client.post(reverse('repair-record-batch', args=[self.car.id, record.id]), {'operations': [
+            {'op': 'update_part', 'id': part.id, 'data': {'quantity': 5}},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(reverse('repair-record-install-stock', args=[self.car.id, record.id]),
+                                    {'stock_part_ids': [self.stock_part.id]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        data = self.sync(cursor)
+        self.assertEqual(len(data['parts']), 2)
+        self.assertIn(part.id, self.ids(data['parts']))
+        self.assertEqual(data['deleted']['stock'], [self.stock_part.id])
+
+    def test_cursor_validation(self):
+        response = self.client.get(reverse('sync'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        old_cursor = make_cursor(timezone.now() - timedelta(days=60))
+        data = self.sync(old_cursor)
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['repairs']), 2)
+
+    def test_prune_tombstones(self):
+        self.stock_part.delete()
+        Tombstone.objects.update(deleted_at=timezone.now() - timedelta(days=31))
+        self.records[0].delete()
+        out = StringIO()
+        call_command('prune_tombstones', stdout=out)
+        self.assertIn('Удалено отметок: 1', out.getvalue())
+        self.assertEqual(list(Tombstone.objects.values_list('kind', flat=True)), [Tombstone.KIND_REPAIR])
+
+
+class RequestMetricsTests(GarageTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.create_records(3)
+
+    def server_timing(self, response):
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            entries[name] = dict(param.split('=', 1) for param in params)
+        return entries
+
+    def test_server_timing_counts_queries(self):
+        url = reverse('repair-record-list', args=[self.car.id])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        timing = self.server_timing(response)
+        self.assertEqual(timing['db']['desc'], f'"{len(ctx.captured_queries)} queries"')
+        self.assertIn('serialize', timing)
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['db']['dur']))
+
+        # Ответы DRF тоже учитываются, отрисовка - как сериализация
+        response = self.client.post(reverse('car-list'), {'brand': 'Kia', 'model': 'Rio', 'vin': 'XTA00000000000002'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('serialize', self.server_timing(response))
+
+    def test_metrics_endpoint_histograms_by_route(self):
+        url = reverse('repair-record-list', args=[self.car.id])
+        for _ in range(3):
+            self.client.get(url)
+        self.client.get(f'/car/{self.car.id}/')
+
+        self.assertEqual(self.client.get(reverse('request-metrics')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        data = self.client.get(reverse('request-metrics')).json()
+        route = data['routes']['GET repair-record-list']
+        self.assertEqual(route['requests'], 3)
+        self.assertEqual(sum(route['duration_ms']['buckets'].values()), 3)
+        self.assertEqual(route['db_queries']['count'], 3)
+        self.assertGreater(route['response_bytes'], 0)
+        self.assertEqual(data['routes']['GET car-page']['requests'], 1)
+
+    def test_structured_request_log(self):
+        with self.assertLogs('cars.requests', 'INFO') as logs:
+            self.client.get(reverse('car-list'))
+        entry = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((entry['event'], entry['route'], entry['method'], entry['status']),
+                         ('request', 'car-list', 'GET', 200))
+        self.assertGreater(entry['db_queries'], 0)
+        self.assertEqual(entry['response_bytes'], len(self.client.get(reverse('car-list')).content))
+
+    @override_settings(SLOW_QUERY_MS=0, SLOW_REQUEST_MS=0)
+    def test_slow_query_and_request_logs(self):
+        with self.assertLogs('cars', 'WARNING') as logs:
+            self.client.get(reverse('car-list'))
+        events = [(record.name, json.loads(record.getMessage())) for record in logs.records]
+        self.assertIn('cars.db', {name for name, _ in events})
+        slow_query = next(entry for name, entry in events if name == 'cars.db')
+        self.assertEqual(slow_query['event'], 'slow_query')
+        self.assertIn('SELECT', slow_query['sql'])
+        self.assertEqual(events[-1][1]['event'], 'request')
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_disabled(self):
+        self.assertFalse(self.client.get(reverse('car-list')).has_header('Server-Timing'))
+
+
+class CarListSummaryTests(GarageTestCase):
+    def car_list(self, **params):
+        response = self.client.get(reverse('car-list'), {'with_summary': '1', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_summary_figures(self):
+        self.create_records(3, parts_per_record=2)
+        StockPart.objects.create(car=self.car, name='Свеча', part_code='S1', manufacturer='NGK', quantity=4, cost=Decimal('300.00'))
+        empty_car = Car.objects.create(user=self.user, brand='Kia', model='Rio', vin='XTA00000000000002')
+        summaries = {car['id']: car['summary'] for car in self.car_list()}
+        self.assertEqual(summaries[self.car.id], {
+            'records_count': 3, 'work_cost': '3000.00', 'parts_cost': '1806.00', 'total_cost': '4806.00',
+            'last_service_date': '2024-03-03', 'last_mileage': 12000,
+            'stock_parts_count': 1, 'stock_parts_cost': '1200.00',
+        })
+        self.assertEqual(summaries[empty_car.id]['records_count'], 0)
+        self.assertEqual(summaries[empty_car.id]['total_cost'], '0.00')
+        self.assertIsNone(summaries[empty_car.id]['last_service_date'])
+        self.assertNotIn('summary', self.client.get(reverse('car-list')).json()[0])
+
+    def count_queries(self, **params):
+        caches[settings.API_CACHE_ALIAS].clear()
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.car_list(**params)
+        return len(ctx.captured_queries), data
+
+    def test_query_count_does_not_depend_on_fleet_size(self):
+        self.create_records(2)
+        small_count, data = self.count_queries()
+        self.assertEqual(len(data), 1)
+        for n in range(10):
+            car = Car.objects.create(user=self.user, brand='Lada', model='Granta', vin=f'XTA0000000000010{n}')
+            self.create_records(2, car=car)
+            StockPart.objects.create(car=car, name='Свеча', part_code='S1', manufacturer='NGK', cost=Decimal('1.00'))
+        large_count, data = self.count_queries()
+        self.assertEqual(len(data), 11)
+        self.assertEqual(small_count, large_count)
+        page_count, data = self.count_queries(page_size=5)
+        self.assertEqual(len(data['results']), 5)
+        self.assertIn('with_summary=1', data['next'])
+        self.assertEqual(page_count, small_count)
+
+    def test_child_changes_refresh_cached_summary(self):
+        self.assertEqual(self.car_list()[0]['summary']['records_count'], 0)
+        record = self.create_records(1, parts_per_record=0)[0]
+        self.assertEqual(self.car_list()[0]['summary']['records_count'], 1)
+        StockPart.objects.create(car=self.car, name='Свеча', part_code='S1', manufacturer='NGK', cost=Decimal('1.00'))
+        self.assertEqual(self.car_list()[0]['summary']['stock_parts_count'], 1)
+        Part.objects.create(repair_record=record, name='Фильтр', part_code='F1', manufacturer='Mann', cost=Decimal('10.00'))
+        self.assertEqual(self.car_list()[0]['summary']['parts_cost'], '10.00')
+
+
+class RepairBatchTests(GarageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.record = self.create_records(1, parts_per_record=4)[0]
+        self.parts = list(self.record.parts.order_by('pk'))
+        self.url = reverse('repair-record-batch', args=[self.car.id, self.record.id])
+
+    def batch(self, operations):
+        return self.client.post(self.url, {'operations': operations}, content_type='application/json')
+
+    def test_mixed_operations_applied_together(self):
+        response = self.batch([
+            {'op': 'update_record', 'data': {'work_cost': '1500.00', 'date': '2024-02-10'}},
+            {'op': 'create_part', 'data': {'name': 'Фильтр', 'part_code': 'W712', 'manufacturer': 'Mann', 'quantity': 2, 'cost': '450.00'}},
+            {'op': 'update_part', 'id': self.parts[0].id, 'data': {'part_code': 'NEW-1', 'quantity': 3}},
+            {'op': 'delete_part', 'id': self.parts[1].id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([result['status'] for result in data['results']], [200, 201, 200, 204])
+        created_id = data['results'][1]['id']
+        self.assertEqual(data['results'][1]['data']['part_code'], 'W712')
+        self.assertEqual(data['results'][2]['data']['part_code'], 'NEW-1')
+        self.assertEqual(data['results'][3]['id'], self.parts[1].id)
+        self.assertEqual(data['record']['work_cost'], '1500.00')
+        self.assertEqual(len(data['record']['parts']), 4)
+
+        self.assertFalse(Part.objects.filter(pk=self.parts[1].id).exists())
+        part = Part.objects.get(pk=self.parts[0].id)
+        self.assertEqual((part.part_code, part.quantity, part.name), ('NEW-1', 3, self.parts[0].name))
+        self.assertEqual(check_rollups(), [])
+        self.assertEqual(CarRollup.objects.get(car=self.car).work_cost, Decimal('1500.00'))
+        self.assertEqual(
+            set(SearchEntry.objects.filter(kind=SearchEntry.KIND_PART).values_list('part_id', flat=True)),
+            {created_id, self.parts[0].id, self.parts[2].id, self.parts[3].id},
+        )
+        self.assertIn('NEW-1', SearchEntry.objects.get(part_id=self.parts[0].id).text)
+
+    def test_invalid_operation_rejects_whole_batch(self):
+        other_record = self.create_records(1, parts_per_record=1)[0]
+        response = self.batch([
+            {'op': 'delete_part', 'id': self.parts[0].id},
+            {'op': 'create_part', 'data': {'name': 'Фильтр', 'part_code': 'W712', 'manufacturer': 'Mann', 'cost': '-1'}},
+            {'op': 'update_part', 'id': other_record.parts.get().id, 'data': {'quantity': 2}},
+            {'op': 'delete_part', 'id': self.parts[0].id},
+            {'op': 'rename'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], [424, 400, 404, 400, 400])
+        self.assertIn('cost', results[1]['errors'])
+        self.assertEqual(self.record.parts.count(), 4)
+        self.assertFalse(Part.objects.filter(name='Фильтр').exists())
+
+    def test_bad_payload(self):
+        self.assertEqual(self.batch([]).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'operations': 'x'}, content_type='application/json').status_code, 400)
+        # Список операций без объекта-обертки
+        response = self.client.post(self.url, [{'op': 'delete_part', 'id': self.parts[0].id}], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Укажите непустой список operations'})
+        self.assertEqual(self.record.parts.count(), 4)
+        url = reverse('repair-record-batch', args=[self.car.id, 999999])
+        self.assertEqual(self.client.post(url, {'operations': [{'op': 'delete_part', 'id': 1}]},
+                                          content_type='application/json').status_code, 404)
+
+    def count_batch_queries(self, size):
+        record = self.create_records(1, parts_per_record=size * 2)[0]
+        parts = list(record.parts.all())
+        operations = (
+            [{'op': 'create_part', 'data': {'name': f'Новая {n}', 'part_code': f'N{n}', 'manufacturer': 'Mann', 'cost': '1.00'}}
+             for n in range(size)]
+            + [{'op': 'update_part', 'id': part.id, 'data': {'cost': '2.00', 'part_code': f'U{part.id}'}} for part in parts[:size]]
+            + [{'op': 'delete_part', 'id': part.id} for part in parts[size:]]
+        )
+        url = reverse('repair-record-batch', args=[self.car.id, record.id])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, {'operations': operations}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        self.assertEqual(self.count_batch_queries(2), self.count_batch_queries(15))
+        self.assertEqual(check_rollups(), [])
+
+
+class CarStatsTests(GarageTestCase):
+    def get_stats(self, **params):
+        response = self.client.get(reverse('car-stats', args=[self.car.id]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_stats_totals_and_breakdowns(self):
+        # 14 записей: январь-декабрь 2024 и январь-февраль 2025
+        for i in range(14):
+            record = RepairRecord.objects.create(
+                car=self.car,
+                date=date(2024 + i // 12, i % 12 + 1, 10),
+                mileage=10000 + i * 1000,
+                work_description=f'Работа {i}',
+                work_cost=Decimal('1000.00'),
+            )
+            Part.objects.create(repair_record=record, name='Фильтр', part_code='F1', manufacturer='Mann', quantity=2, cost=Decimal('250.00'))
+        StockPart.objects.create(car=self.car, name='Свеча', part_code='S1', manufacturer='NGK', quantity=4, cost=Decimal('300.00'))
+
+        data = self.get_stats()
+        self.assertEqual(data['records_count'], 14)
+        self.assertEqual(data['parts_count'], 14)
+        self.assertEqual(data['total_work_cost'], '14000.00')
+        self.assertEqual(data['total_parts_cost'], '7000.00')
+        self.assertEqual(data['total_cost'], '21000.00')
+        self.assertEqual(data['stock_parts_cost'], '1200.00')
+        self.assertEqual(data['cost_per_km'], '1.62')
+        self.assertEqual(len(data['by_month']), 14)
+        self.assertEqual(data['by_month'][0]['period'], '2024-01')
+        self.assertEqual(data['by_month'][0]['total_cost'], '1500.00')
+        self.assertEqual([year['period'] for year in data['by_year']], ['2024', '2025'])
+        self.assertEqual(data['by_year'][1]['records_count'], 2)
+
+        data = self.get_stats(date_from='2025-01-01', date_to='2025-01-31')
+        self.assertEqual(data['records_count'], 1)
+        self.assertEqual(data['total_cost'], '1500.00')
+        self.assertIsNone(data['cost_per_km'])
+
+    def test_stats_query_count_is_constant(self):
+        url = reverse('car-stats', args=[self.car.id])
+        self.create_records(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        self.create_records(30)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(url)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_stats_rejects_invalid_date(self):
+        response = self.client.get(reverse('car-stats', args=[self.car.id]), {'date_from': '01.01.2024'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ListPaginationTests(GarageTestCase):
+    def fetch_all_pages(self, url, params):
+        items, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            items.extend(data['results'])
+            pages += 1
+            if not data['next']:
+                return items, pages
+            response = self.client.get(data['next'])
+
+    def test_repairs_cursor_pagination_follows_ordering(self):
+        # Несколько записей с одной датой проверяют переход курсора внутри даты
+        for i in range(7):
+            RepairRecord.objects.create(
+                car=self.car, date=date(2024, 5, 1 + i // 3), mileage=i,
+                work_description=f'Работа {i}', work_cost=Decimal('10.00'),
+            )
+        url = reverse('repair-record-list', args=[self.car.id])
+        items, pages = self.fetch_all_pages(url, {'page_size': 2})
+        self.assertEqual(pages, 4)
+        self.assertEqual([item['id'] for item in items], [item['id'] for item in self.client.get(url).json()])
+
+    def test_unpaginated_list_is_unchanged(self):
+        self.create_records(3)
+        data = self.client.get(reverse('repair-record-list', args=[self.car.id])).json()
+        self.assertIsInstance(data, list)
+        self.assertEqual(len(data), 3)
+
+    def test_fields_projection(self):
+        Car.objects.create(user=self.user, brand='Kia', model='Rio', vin='Z9400000000000001')
+        response = self.client.get(reverse('car-list'), {'fields': 'id,brand', 'page_size': 1})
+        data = response.json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(set(data['results'][0]), {'id', 'brand'})
+        self.assertIsNotNone(data['next'])
+
+    def test_repairs_without_parts_field_skip_parts_query(self):
+        self.create_records(3)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('repair-record-list', args=[self.car.id]), {'fields': 'id,date'})
+        self.assertEqual(set(response.json()[0]), {'id', 'date'})
+        self.assertFalse(any('cars_part' in query['sql'] for query in ctx.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('stock-part-list', args=[self.car.id]), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class RowSerializerTests(GarageTestCase):
+    """Быстрый путь списков дает те же байты, что сериализатор DRF с JSONRenderer"""
+
+    def setUp(self):
+        super().setUp()
+        records = self.create_records(3)
+        records[0].work_description = 'Замена\u2028масла "5W-30" </script>'
+        records[0].save()
+        StockPart.objects.create(car=self.car, name='Свеча', part_code='S1', manufacturer='NGK', cost=Decimal('99.90'),
+                                 purchase_date=date(2024, 3, 1), notes='Ящик №2')
+        StockPart.objects.create(car=self.car, name='Фильтр', part_code='F1', manufacturer='Mann', quantity=3,
+                                 cost=Decimal('450.00'))
+        Car.objects.create(user=self.user, brand='Kia', model='Rio', vin='Z9400000000000001', year=2019)
+
+    def drf_content(self, serializer_class, queryset, **kwargs):
+        return JSONRenderer().render(serializer_class(list(queryset), many=True, **kwargs).data)
+
+    def test_lists_match_drf_output(self):
+        cars = Car.objects.filter(user=self.user)
+        records = RepairRecord.objects.filter(car=self.car).prefetch_related(prefetch_parts())
+        stock = StockPart.objects.filter(car=self.car).select_related('catalog')
+        cases = [
+            (reverse('car-list'), {}, self.drf_content(CarSerializer, cars)),
+            (reverse('car-list'), {'with_summary': '1'}, self.drf_content(CarWithSummarySerializer, with_summary(cars))),
+            (reverse('repair-record-list', args=[self.car.id]), {}, self.drf_content(RepairRecordSerializer, records)),
+            (reverse('repair-record-list', args=[self.car.id]), {'fields': 'id,parts,date'},
+             self.drf_content(RepairRecordSerializer, records, fields=['id', 'parts', 'date'])),
+            (reverse('stock-part-list', args=[self.car.id]), {}, self.drf_content(StockPartSerializer, stock)),
+        ]
+        for url, params, expected in cases:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, expected, (url, params))
+
+    def test_paginated_pages_match_full_list(self):
+        url = reverse('repair-record-list', args=[self.car.id])
+        full = self.client.get(url).json()
+        data = self.client.get(url, {'page_size': 2}).json()
+        self.assertEqual(data['results'], full[:2])
+        self.assertEqual(self.client.get(data['next']).json()['results'], full[2:])
+
+    def test_single_query_per_nested_list(self):
+        self.create_records(5)
+        with self.assertNumQueries(3 + self.session_queries):
+            # Пользователь - из кэша; автомобиль, записи и запчасти
+            self.client.get(reverse('repair-record-list', args=[self.car.id]))
+
+    def test_unsupported_serializer(self):
+        with self.assertRaises(UnsupportedSerializer):
+            RowSerializer.for_queryset(ReportJobSerializer, ReportJob.objects.all())
+
+    def test_render_json_matches_drf(self):
+        data = {
+            'text': 'строка\u2028\u2029 "кавычки" \\ \n',
+            'decimal': Decimal('10.50'),
+            'date': date(2024, 1, 2),
+            'moment': timezone.now(),
+            'nested': [None, True, 1, {'x': []}],
+        }
+        self.assertEqual(render_json(data), JSONRenderer().render(data))
+        self.assertEqual(render_json(None), b'')
+        # Ключи не строки orjson не принимает - работает JSONRenderer
+        self.assertEqual(render_json({1: 'a'}), JSONRenderer().render({1: 'a'}))
+
+    def test_serialization_benchmark(self):
+        report = run_serialization_benchmark(self.car, iterations=1)
+        self.assertEqual(set(report['lists']), {'cars', 'cars:with_summary', 'repairs', 'stock'})
+        for name, result in report['lists'].items():
+            self.assertTrue(result['identical'], name)
+            self.assertGreater(result['rows'], 0, name)
+
+
+class OwnershipTests(GarageTestCase):
+    """Вложенные объекты загружаются с проверкой владельца одним запросом"""
+
+    def setUp(self):
+        super().setUp()
+        self.record = self.create_records(1)[0]
+        self.part = self.record.parts.first()
+        self.stock_part = StockPart.objects.create(car=self.car, name='Свеча', part_code='S1', manufacturer='NGK',
+                                                   cost=Decimal('1.00'))
+        self.other = User.objects.create_user(username='other', password='secret-pass-123')
+        self.other_car = Car.objects.create(user=self.other, brand='Kia', model='Rio', vin='Z9400000000000001')
+        self.other_record = RepairRecord.objects.create(car=self.other_car, date=date(2024, 1, 1), mileage=1,
+                                                        work_description='Чужая', work_cost=Decimal('1.00'))
+
+    def test_single_query_with_parents(self):
+        with self.assertNumQueries(1):
+            part = get_owned(Part, self.user, self.car.id, self.part.id, record_id=self.record.id)
+            self.assertEqual(part.repair_record.car.user_id, self.user.id)
+        with self.assertNumQueries(1):
+            record = get_owned(RepairRecord, self.user, self.car.id, self.record.id)
+            self.assertEqual(record.car, self.car)
+
+    def test_foreign_objects_not_found(self):
+        cases = [
+            (Car, self.other_car.id, None, None, 'Автомобиль не найден'),
+            (RepairRecord, self.other_car.id, self.other_record.id, None, 'Автомобиль не найден'),
+            # Чужая запись через свой автомобиль
+            (RepairRecord, self.car.id, self.other_record.id, None, 'Запись о ремонте не найдена'),
+            (StockPart, self.car.id, 0, None, 'Запчасть на складе не найдена'),
+            (Part, self.other_car.id, self.part.id, self.record.id, 'Не найдено'),
+            (Part, self.car.id, self.part.id, self.other_record.id, 'Не найдено'),
+        ]
+        for model, car_id, pk, record_id, message in cases:
+            with self.assertRaises(NotOwned) as ctx:
+                get_owned(model, self.user, car_id, pk, record_id=record_id)
+            self.assertEqual(ctx.exception.message, message, (model, car_id, pk))
+
+    def test_routes_keep_404_messages(self):
+        repair_url = reverse('repair-record-detail', args=[self.car.id, self.other_record.id])
+        foreign_repair_url = reverse('repair-record-detail', args=[self.other_car.id, self.other_record.id])
+        part_url = reverse('part-detail', args=[self.car.id, self.other_record.id, self.part.id])
+        cases = [
+            ('get', repair_url, 'Запись о ремонте не найдена'),
+            ('put', repair_url, 'Запись о ремонте не найдена'),
+            ('get', foreign_repair_url, 'Автомобиль не найден'),
+            ('delete', foreign_repair_url, 'Автомобиль не найден'),
+            ('post', reverse('part-create', args=[self.other_car.id, self.other_record.id]), 'Автомобиль не найден'),
+            ('put', part_url, 'Не найдено'),
+            ('get', reverse('stock-part-detail', args=[self.other_car.id, self.stock_part.id]), 'Автомобиль не найден'),
+            ('delete', reverse('stock-part-detail', args=[self.car.id, 0]), 'Запчасть на складе не найдена'),
+            ('get', reverse('report-job-detail', args=[self.car.id, 0]), 'Задание не найдено'),
+        ]
+        for method, url, message in cases:
+            response = getattr(self.client, method)(url, {}, content_type='application/json')
+            self.assertEqual(response.status_code, 404, (method, url))
+            self.assertEqual(response.json(), {'error': message}, (method, url))
+        self.assertTrue(RepairRecord.objects.filter(pk=self.other_record.pk).exists())
+
+    def test_part_update_resolves_in_one_query(self):
+        url = reverse('part-detail', args=[self.car.id, self.record.id, self.part.id])
+        data = {'name': 'Фильтр', 'part_code': 'F1', 'manufacturer': 'Mann', 'quantity': 1, 'cost': '10.00'}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(url, data, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        selects = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        # Автомобиль и запись о ремонте не читаются отдельными запросами
+        self.assertFalse([sql for sql in selects if sql.startswith(('SELECT "cars_car".', 'SELECT "cars_repairrecord".'))])
+        part_lookup = next(sql for sql in selects if sql.startswith('SELECT "cars_part".'))
+        self.assertIn('INNER JOIN "cars_car"', part_lookup)
+
+
+@override_settings(REPORT_WORKERS=0)
+class DeletionTests(GarageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_records(5, parts_per_record=3)
+        StockPart.objects.create(car=self.car, name='Свеча', part_code='BKR6E', manufacturer='NGK', cost=Decimal('350.00'))
+        self.car_url = f"{reverse('car-list')}{self.car.id}/"
+
+    def assertHistoryDeleted(self, car_id):
+        self.assertFalse(Car.all_objects.filter(pk=car_id).exists())
+        self.assertFalse(RepairRecord.objects.filter(car_id=car_id).exists())
+        self.assertFalse(Part.objects.filter(repair_record__car_id=car_id).exists())
+        self.assertFalse(StockPart.objects.filter(car_id=car_id).exists())
+        self.assertFalse(CarRollup.objects.filter(car_id=car_id).exists())
+        self.assertFalse(CarMonthRollup.objects.filter(car_id=car_id).exists())
+        self.assertFalse(SearchEntry.objects.exists())
+
+    def test_batches_do_not_load_history(self):
+        car_id = self.car.id
+        with CaptureQueriesContext(connection) as small:
+            delete_car(self.car, batch_size=10)
+        self.assertHistoryDeleted(car_id)
+        self.assertEqual(list(Tombstone.objects.values_list('kind', 'object_id')), [(Tombstone.KIND_CAR, car_id)])
+
+        car = Car.objects.create(user=self.user, brand='Kia', model='Rio', vin='XTA00000000000002')
+        self.create_records(20, parts_per_record=3, car=car)
+        car_id = car.id
+        with CaptureQueriesContext(connection) as large:
+            delete_car(car, batch_size=10)
+        self.assertHistoryDeleted(car_id)
+        # Лишние запросы - только на второй пакет записей о ремонте
+        self.assertLessEqual(len(large), len(small) + 6)
+
+    def test_delete_endpoint(self):
+        response = self.client.delete(self.car_url)
+        self.assertEqual(response.status_code, 204)
+        self.assertHistoryDeleted(self.car.id)
+
+    def test_background_delete_hides_car(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'{self.car_url}?background=1')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'status': 'deleting'})
+        # Автомобиль скрыт до удаления истории
+        self.assertTrue(RepairRecord.objects.filter(car=self.car).exists())
+        self.assertEqual(self.client.get(self.car_url).status_code, 404)
+        self.assertEqual(self.client.get(reverse('car-list')).json(), [])
+        self.assertEqual(self.client.get(reverse('repair-record-list', args=[self.car.id])).status_code, 404)
+        data = self.client.get(reverse('sync')).json()
+        self.assertEqual((data['cars'], data['repairs'], data['stock']), ([], [], []))
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'Работа'}).json(), [])
+
+        self.assertEqual(delete_hidden_cars(), 1)
+        self.assertHistoryDeleted(self.car.id)
+        self.assertEqual(delete_hidden_cars(), 0)
+
+    @override_settings(CAR_DELETE_BACKGROUND_ROWS=10)
+    def test_large_history_deleted_in_background(self):
+        response = self.client.delete(self.car_url)
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNotNone(Car.all_objects.get(pk=self.car.pk).deleting_since)
+        call_command('report_worker', '--once', stdout=StringIO())
+        self.assertHistoryDeleted(self.car.id)
+
+    def test_admin_delete(self):
+        admin_user = User.objects.create_superuser(username='admin', password='secret-pass-123')
+        self.client.force_login(admin_user)
+        url = reverse('admin:cars_car_delete', args=[self.car.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Записи о ремонте')
+        car_id = self.car.id
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.client.post(url, {'post': 'yes'}).status_code, 302)
+        # До фиксации транзакции админки автомобиль только скрыт
+        self.assertIsNotNone(Car.all_objects.get(pk=car_id).deleting_since)
+        self.assertTrue(RepairRecord.objects.filter(car_id=car_id).exists())
+        for callback in callbacks:
+            callback()
+        self.assertHistoryDeleted(car_id)
+
+        url = reverse('admin:auth_user_delete', args=[self.user.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(url, {'post': 'yes'}).status_code, 302)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+    def test_delete_user(self):
+        other_car = Car.objects.create(user=self.user, brand='Kia', model='Rio', vin='XTA00000000000002')
+        self.create_records(2, car=other_car)
+        ApiToken.objects.issue(self.user, 'ci')
+        delete_user(self.user)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(ApiToken.objects.exists())
+        self.assertHistoryDeleted(self.car.id)
+        self.assertHistoryDeleted(other_car.id)
+
+
+class AdminDeletionTransactionTests(TransactionTestCase):
+    """Удаление в админке: пакеты истории фиксируются отдельными транзакциями,
+    а не точками сохранения транзакции админки"""
+
+    def setUp(self):
+        caches[settings.API_CACHE_ALIAS].clear()
+        self.admin_user = User.objects.create_superuser(username='admin', password='secret-pass-123')
+        self.client.force_login(self.admin_user)
+        self.user = User.objects.create_user(username='owner', password='secret-pass-123')
+        self.car = Car.objects.create(user=self.user, brand='Lada', model='Vesta', vin='XTA00000000000001')
+        for i in range(5):
+            record = RepairRecord.objects.create(car=self.car, date=date(2024, 1, 1 + i), mileage=i,
+                                                 work_description=f'Работа {i}', work_cost=Decimal('100.00'))
+            Part.objects.create(repair_record=record, name='Фильтр', part_code='F1', manufacturer='Mann',
+                                cost=Decimal('10.00'))
+
+    def delete_through_admin(self, url):
+        nested = []
+        raw_delete = deletion._raw_delete
+
+        def recording_raw_delete(queryset):
+            # Точки сохранения есть только внутри внешней транзакции
+            nested.append(bool(connection.savepoint_ids))
+            return raw_delete(queryset)
+
+        with mock.patch.object(deletion, '_raw_delete', recording_raw_delete):
+            self.assertEqual(self.client.post(url, {'post': 'yes'}).status_code, 302)
+        return nested
+
+    def test_car_batches_commit_separately(self):
+        car_id = self.car.id
+        nested = self.delete_through_admin(reverse('admin:cars_car_delete', args=[car_id]))
+        self.assertTrue(nested)
+        self.assertFalse(any(nested))
+        self.assertFalse(Car.all_objects.filter(pk=car_id).exists())
+        self.assertFalse(RepairRecord.objects.filter(car_id=car_id).exists())
+
+    def test_user_batches_commit_separately(self):
+        nested = self.delete_through_admin(reverse('admin:auth_user_delete', args=[self.user.id]))
+        self.assertTrue(nested)
+        self.assertFalse(any(nested))
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Car.all_objects.exists())
+
+
+class AdminTests(GarageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin_user = User.objects.create_superuser(username='admin', password='secret-pass-123')
+        self.client.force_login(self.admin_user)
+
+    def changelist(self, model, params=None):
+        response = self.client.get(reverse(f'admin:cars_{model}_changelist'), params or {})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_changelist_query_count_is_constant(self):
+        self.create_records(2, parts_per_record=1)
+        StockPart.objects.create(car=self.car, name='Свеча', part_code='BKR6E', manufacturer='NGK', cost=Decimal('350.00'))
+        # Первый запрос загружает пользователя сессии
+        self.changelist('car')
+        counts = {}
+        for model in ('car', 'repairrecord', 'part', 'stockpart'):
+            with CaptureQueriesContext(connection) as queries:
+                self.changelist(model)
+            counts[model] = len(queries)
+
+        car = Car.objects.create(user=self.user, brand='Kia', model='Rio', vin='XTA00000000000002')
+        self.create_records(5, parts_per_record=3, car=car)
+        StockPart.objects.create(car=car, name='Масло', part_code='5W30', manufacturer='Shell', cost=Decimal('900.00'))
+        for model, expected in counts.items():
+            with self.assertNumQueries(expected):
+                self.changelist(model)
+
+    def test_manufacturer_filter(self):
+        self.create_records(1, parts_per_record=1)
+        StockPart.objects.create(car=self.car, name='Свеча', part_code='BKR6E', manufacturer='NGK', cost=Decimal('350.00'))
+        response = self.changelist('part', {'manufacturer': 'Bosch'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertContains(self.changelist('stockpart'), '?manufacturer=NGK')
+        self.assertEqual(self.changelist('stockpart', {'manufacturer': 'Bosch'}).context['cl'].result_count, 0)
+
+    def test_date_hierarchy(self):
+        self.create_records(3, parts_per_record=1)
+        response = self.changelist('repairrecord', {'date__year': 2024, 'date__month': 2})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_estimated_count_without_filters(self):
+        self.create_records(4, parts_per_record=1)
+        analyze()
+        self.create_records(2, parts_per_record=1)
+        with self.settings(ADMIN_EXACT_COUNT_LIMIT=0):
+            self.assertEqual(self.changelist('part').context['cl'].result_count, 4)
+            # С фильтром - точный COUNT(*)
+            self.assertEqual(self.changelist('part', {'manufacturer': 'Bosch'}).context['cl'].result_count, 6)
+        self.assertEqual(self.changelist('part').context['cl'].result_count, 6)
+
+    def test_repair_record_autocomplete(self):
+        self.create_records(3, parts_per_record=1)
+        params = {'app_label': 'cars', 'model_name': 'part', 'field_name': 'repair_record', 'term': ''}
+        with self.assertNumQueries(4 + self.session_queries):
+            response = self.client.get(reverse('admin:autocomplete'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertTrue(response.json()['results'][0]['text'].startswith('Lada Vesta'))
+
+
+class AuthenticationTests(GarageTestCase):
+    """Сессии и токены API проверяются без запросов к БД после первого запроса"""
+
+    def setUp(self):
+        super().setUp()
+        self.token, self.key = ApiToken.objects.issue(self.user, 'integration')
+        # Интеграция не передает cookie и CSRF-токен
+        self.token_client = Client(enforce_csrf_checks=True, headers={'Authorization': f'Bearer {self.key}'})
+
+    def auth_queries(self, client, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries
+                if any(table in q['sql'] for table in ('"django_session"', '"auth_user"', '"cars_apitoken"'))]
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_session_auth_is_cached(self):
+        # Движок сессий с общим кэшем (SHARED_CACHE)
+        url = reverse('car-list')
+        self.client.get(url)
+        self.assertEqual(self.auth_queries(self.client, url), [])
+        # Синхронные представления DRF тоже
+        self.client.get(f'/car/{self.car.id}/')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(f'/car/{self.car.id}/')
+        self.assertFalse([q for q in ctx.captured_queries if '"auth_user"' in q['sql']])
+
+    def test_session_user_is_cached(self):
+        url = reverse('car-list')
+        self.client.get(url)
+        queries = self.auth_queries(self.client, url)
+        self.assertEqual(len(queries), self.session_queries)
+        self.assertTrue(all('"django_session"' in sql for sql in queries))
+
+    def test_logout_revokes_session_in_other_workers(self):
+        engine = import_module(settings.SESSION_ENGINE)
+        # Кэш другого процесса: общий бэкенд - новое подключение к тому же
+        # серверу, память процесса - отдельное хранилище
+        if settings.SHARED_CACHE:
+            other_cache = caches.create_connection(settings.SESSION_CACHE_ALIAS)
+        else:
+            other_cache = LocMemCache('other-worker', {})
+
+        def other_worker_session(session_key):
+            store = engine.SessionStore(session_key)
+            if hasattr(store, '_cache'):
+                store._cache = other_cache
+            return store.load()
+
+        session_key = self.client.session.session_key
+        self.assertEqual(other_worker_session(session_key).get('_auth_user_id'), str(self.user.pk))
+        self.client.logout()
+        self.assertEqual(other_worker_session(session_key), {})
+
+    def test_token_reads_and_writes_without_csrf(self):
+        url = reverse('car-list')
+        response = self.token_client.get(url)
+        self.assertEqual([car['vin'] for car in response.json()], [self.car.vin])
+        self.assertEqual(self.auth_queries(self.token_client, url), [])
+        response = self.token_client.post(url, {'brand': 'Kia', 'model': 'Rio', 'vin': 'Z94CB41AAGR000001'},
+                                          content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Car.objects.get(vin='Z94CB41AAGR000001').user, self.user)
+        # Сессия без CSRF-токена по-прежнему отклоняется
+        session_client = Client(enforce_csrf_checks=True)
+        session_client.force_login(self.user)
+        response = session_client.post(url, {'brand': 'Kia', 'model': 'Rio', 'vin': 'Z94CB41AAGR000002'},
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_and_revoked_tokens(self):
+        url = reverse('car-list')
+        for header in ('Bearer wrong', 'Bearer', 'Bearer a b'):
+            client = Client(headers={'Authorization': header})
+            self.assertEqual(client.get(url).status_code, 403, header)
+            self.assertEqual(client.post(url, {}, content_type='application/json').status_code, 403, header)
+
+        self.assertEqual(self.token_client.get(url).status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.token_client.get(url).status_code, 403)
+
+    def test_user_changes_apply_immediately(self):
+        url = reverse('car-list')
+        self.assertEqual(self.token_client.get(url).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.token_client.get(url).status_code, 403)
+
+        self.user.is_active = True
+        self.user.set_password('new-secret-pass-456')
+        self.user.save()
+        # Сессия, созданная до смены пароля, больше не действует
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.token_client.get(url).status_code, 200)
+
+    async def test_async_client_with_token(self):
+        response = await self.async_client.get(reverse('repair-record-list', args=[self.car.id]),
+                                               headers={'Authorization': f'Bearer {self.key}'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_create_api_token_command(self):
+        out = StringIO()
+        call_command('create_api_token', self.user.username, '--name', 'cli', stdout=out, stderr=StringIO())
+        key = out.getvalue().strip()
+        client = Client(headers={'Authorization': f'Bearer {key}'})
+        self.assertEqual(client.get(reverse('car-list')).status_code, 200)
+        self.assertEqual(ApiToken.objects.get(name='cli').prefix, key[:ApiToken.PREFIX_LENGTH])
+        self.assertFalse(ApiToken.objects.filter(key_hash=key).exists())
+
+
+class InstallStockPartsTests(GarageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.record = self.create_records(1, parts_per_record=0)[0]
+        self.stock_parts = [
+            StockPart.objects.create(car=self.car, name=f'Склад {i}', part_code=f'S{i}', manufacturer='NGK', quantity=i + 1, cost=Decimal('10.00'))
+            for i in range(50)
+        ]
+        self.url = reverse('repair-record-install-stock', args=[self.car.id, self.record.id])
+
+    def install(self, ids):
+        return self.client.post(self.url, {'stock_part_ids': ids}, content_type='application/json')
+
+    def test_install_moves_parts_in_constant_queries(self):
+        ids = [stock_part.id for stock_part in self.stock_parts]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.install(ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['parts']), 50)
+        self.assertFalse(StockPart.objects.filter(car=self.car).exists())
+        # Включая обновление итогов расходов (месяц и автомобиль)
+        self.assertLess(len(ctx.captured_queries), 18)
+
+    def test_second_install_of_same_parts_conflicts(self):
+        ids = [self.stock_parts[0].id, self.stock_parts[1].id]
+        self.assertEqual(self.install(ids).status_code, 200)
+        response = self.install(ids)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['stock_part_ids'], sorted(ids))
+        self.assertEqual(self.record.parts.count(), 2)
+
+    def test_partial_availability_changes_nothing(self):
+        other_car = Car.objects.create(user=self.user, brand='Kia', model='Rio', vin='Z9400000000000001')
+        foreign = StockPart.objects.create(car=other_car, name='Чужая', part_code='X', manufacturer='X', cost=Decimal('1.00'))
+        response = self.install([self.stock_parts[0].id, foreign.id])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.record.parts.count(), 0)
+        self.assertTrue(StockPart.objects.filter(pk=self.stock_parts[0].id).exists())
+
+    def test_create_record_with_stock_parts_is_atomic(self):
+        url = reverse('repair-record-list', args=[self.car.id])
+        payload = {
+            'date': '2024-06-01', 'mileage': 50000, 'work_description': 'ТО', 'work_cost': '500.00',
+            'stock_part_ids': [self.stock_parts[0].id, 999999],
+        }
+        response = self.client.post(url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(RepairRecord.objects.filter(mileage=50000).exists())
+
+        payload['stock_part_ids'] = [self.stock_parts[0].id]
+        response = self.client.post(url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['parts']), 1)
+
+    def test_invalid_payload(self):
+        self.assertEqual(self.install([]).status_code, 400)
+        self.assertEqual(self.install('1,2').status_code, 400)
+
+
+class ImportHistoryTests(GarageTestCase):
+    CSV = (
+        'date;mileage;work_description;work_cost;part_name;part_code;manufacturer;quantity;part_cost\n'
+        '2024-01-10;10000;Замена масла;1500,00;Масло;OIL-1;Mobil;4;800\n'
+        ';;;;Фильтр;F-1;Mann;1;450.50\n'
+        '15.02.2024;12000;Замена колодок;2000;;;;;\n'
+        '2024-03-01;-5;Ошибка пробега;100;Деталь;X;Y;1;1\n'
+        ';;;;Деталь;X;Y;1;1\n'
+        '2024-04-01;13000;ТО;900;Свеча;S-1;NGK;0;300\n'
+    )
+
+    def upload(self, content, name='history.csv', **params):
+        url = reverse('import-repair-history', args=[self.car.id])
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, {'file': SimpleUploadedFile(name, content)})
+
+    def test_csv_import_with_row_errors(self):
+        response = self.upload(self.CSV.encode('utf-8'))
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['rows_processed'], 6)
+        self.assertEqual(result['records_created'], 3)
+        self.assertEqual(result['parts_created'], 2)
+        self.assertEqual([error['row'] for error in result['errors']], [5, 6, 7])
+        self.assertIn('mileage', result['errors'][0]['errors'])
+        self.assertIn('quantity', result['errors'][2]['errors'])
+
+        oil_change = RepairRecord.objects.get(car=self.car, mileage=10000)
+        self.assertEqual(oil_change.work_cost, Decimal('1500.00'))
+        self.assertEqual(oil_change.parts.count(), 2)
+        self.assertEqual(RepairRecord.objects.get(car=self.car, mileage=12000).date, date(2024, 2, 15))
+
+    def test_dry_run_saves_nothing(self):
+        result = self.upload(self.CSV.encode('utf-8'), dry_run=1).json()
+        self.assertEqual(result['records_created'], 3)
+        self.assertFalse(RepairRecord.objects.filter(car=self.car).exists())
+
+    def test_xlsx_import_in_batches(self):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['Дата', 'Пробег (км)', 'Выполненные работы', 'Стоимость работ', 'Наименование', 'Код детали', 'Производитель', 'Количество', 'Стоимость за единицу'])
+        for i in range(25):
+            ws.append([date(2023, 1, 1 + i), 1000 * i, f'Работа {i}', 100, f'Деталь {i}', f'P{i}', 'Bosch', 1, 10])
+            ws.append([None, None, None, None, f'Доп {i}', f'D{i}', 'Bosch', 2, 5])
+        content = BytesIO()
+        wb.save(content)
+
+        car = self.car
+        with open(os.devnull, 'w') as devnull, tempfile.NamedTemporaryFile(suffix='.xlsx') as file:
+            file.write(content.getvalue())
+            file.flush()
+            call_command('import_history', car.id, file.name, batch_size=4, stdout=devnull, stderr=devnull)
+
+        self.assertEqual(RepairRecord.objects.filter(car=car).count(), 25)
+        self.assertEqual(Part.objects.filter(repair_record__car=car).count(), 50)
+        record = RepairRecord.objects.get(car=car, mileage=24000)
+        self.assertEqual(sorted(record.parts.values_list('catalog__part_code', flat=True)), ['D24', 'P24'])
+
+    def test_rejects_unknown_format_and_header(self):
+        self.assertEqual(self.upload(b'data', name='history.txt').status_code, 400)
+        self.assertEqual(self.upload(b'foo,bar\n1,2\n').status_code, 400)
+
+
+# Тесты выполняются в одном процессе: кэш процесса ведет себя как общий
+@override_settings(API_CACHE_ENABLED=True)
+class ResponseCacheTests(GarageTestCase):
+    def test_etag_and_not_modified(self):
+        url = reverse('repair-record-list', args=[self.car.id])
+        self.create_records(2)
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('cars_' in query['sql'] for query in ctx.captured_queries))
+
+    def assert_fresh(self, url, mutate, check):
+        self.client.get(url)
+        mutate()
+        check(self.client.get(url).json())
+
+    def test_invalidation_on_every_model_change(self):
+        repairs_url = reverse('repair-record-list', args=[self.car.id])
+        stock_url = reverse('stock-part-list', args=[self.car.id])
+        record = self.create_records(1, parts_per_record=1)[0]
+        part = record.parts.get()
+
+        def rename_car():
+            self.car.brand = 'Lada Sport'
+            self.car.save()
+        self.assert_fresh(reverse('car-list'), rename_car, lambda data: self.assertEqual(data[0]['brand'], 'Lada Sport'))
+
+        def change_record():
+            record.mileage = 777
+            record.save()
+        self.assert_fresh(repairs_url, change_record, lambda data: self.assertEqual(data[0]['mileage'], 777))
+
+        def change_part():
+            part.name = 'Новая деталь'
+            part.save()
+        self.assert_fresh(repairs_url, change_part, lambda data: self.assertEqual(data[0]['parts'][0]['name'], 'Новая деталь'))
+
+        self.assert_fresh(repairs_url, part.delete, lambda data: self.assertEqual(data[0]['parts'], []))
+
+        stock_part = StockPart.objects.create(car=self.car, name='Свеча', part_code='S1', manufacturer='NGK', cost=Decimal('1.00'))
+        self.assert_fresh(stock_url, stock_part.delete, lambda data: self.assertEqual(data, []))
+
+        self.assert_fresh(repairs_url, record.delete, lambda data: self.assertEqual(data, []))
+
+    def test_bulk_operations_invalidate(self):
+        record = self.create_records(1, parts_per_record=0)[0]
+        stock_part = StockPart.objects.create(car=self.car, name='Свеча', part_code='S1', manufacturer='NGK', cost=Decimal('1.00'))
+        repairs_url = reverse('repair-record-list', args=[self.car.id])
+        self.assertEqual(self.client.get(repairs_url).json()[0]['parts'], [])
+
+        self.client.post(
+            reverse('repair-record-install-stock', args=[self.car.id, record.id]),
+            {'stock_part_ids': [stock_part.id]}, content_type='application/json',
+        )
+        self.assertEqual(len(self.client.get(repairs_url).json()[0]['parts']), 1)
+
+    def test_cache_is_per_user(self):
+        self.client.get(reverse('car-list'))
+        other = User.objects.create_user(username='other', password='secret-pass-123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('car-list')).json(), [])
+        response = self.client.get(reverse('repair-record-list', args=[self.car.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(API_CACHE_ENABLED=False)
+class ResponseCacheDisabledTests(GarageTestCase):
+    """Без общего кэша ответы не кэшируются: запись в другом процессе не
+    меняет версии в кэше этого процесса"""
+
+    def test_change_in_other_process_is_visible(self):
+        record = self.create_records(1, parts_per_record=0)[0]
+        url = reverse('repair-record-list', args=[self.car.id])
+        self.assertEqual(self.client.get(url).json()[0]['mileage'], record.mileage)
+        # UPDATE без сигналов - как сохранение в другом процессе
+        RepairRecord.objects.filter(pk=record.pk).update(mileage=777)
+        self.assertEqual(self.client.get(url).json()[0]['mileage'], 777)
+
+    def test_etag_and_not_modified(self):
+        url = reverse('repair-record-list', args=[self.car.id])
+        self.create_records(2)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        RepairRecord.objects.filter(car=self.car).update(mileage=777)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class QueryPlanAuditTests(TestCase):
+    def test_api_queries_use_indexes(self):
+        call_command('audit_query_plans', users=3, cars=2, repairs=200, parts=2, stdout=StringIO())
+
+
+class ConcurrentWritesTests(TransactionTestCase):
+    """Несколько сотрудников одновременно сохраняют записи о ремонте"""
+
+    writers = 8
+    records_per_writer = 25
+
+    def setUp(self):
+        caches[settings.API_CACHE_ALIAS].clear()
+        user = User.objects.create_user(username='owner', password='secret-pass-123')
+        self.car = Car.objects.create(user=user, brand='Lada', model='Vesta', vin='XTA00000000000001')
+
+    def write_records(self, errors, barrier):
+        try:
+            barrier.wait()
+            for n in range(self.records_per_writer):
+                with transaction.atomic():
+                    # Чтение перед записью: в режиме DEFERRED здесь получали бы
+                    # "database is locked" при повышении блокировки
+                    RepairRecord.objects.filter(car=self.car).count()
+                    record = RepairRecord.objects.create(
+                        car=self.car, date=date(2024, 1, 1), mileage=n,
+                        work_description='Замена масла', work_cost=Decimal('100.00'),
+                    )
+                    Part.objects.create(repair_record=record, name='Фильтр', part_code='F1',
+                                        manufacturer='Mann', cost=Decimal('10.00'))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_parallel_writers(self):
+        if connection.vendor == 'sqlite':
+            if connection.is_in_memory_db():
+                self.skipTest('Общая база в памяти не поддерживает параллельную запись')
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+
+        errors = []
+        barrier = threading.Barrier(self.writers)
+        threads = [threading.Thread(target=self.write_records, args=(errors, barrier)) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        total = self.writers * self.records_per_writer
+        self.assertEqual(RepairRecord.objects.filter(car=self.car).count(), total)
+        self.assertEqual(Part.objects.filter(repair_record__car=self.car).count(), total)
+
+
+class BenchmarkTests(GarageTestCase):
+    def test_report_covers_all_routes(self):
+        self.create_records(3)
+        for n in range(3):
+            StockPart.objects.create(car=self.car, name='Свеча', part_code=f'S{n}', manufacturer='NGK', cost=Decimal('1.00'))
+
+        report = run_benchmark(self.car, iterations=1, warmup=0)
+
+        self.assertEqual(report['not_measured'], ['/admin/', '/logout/'])
+        for name, result in report['routes'].items():
+            self.assertLess(result['status'], 400, name)
+            self.assertGreater(result['peak_memory_kb'], 0, name)
+        # Изменяющие запросы откатываются
+        self.assertEqual(self.car.repair_records.count(), 3)
+        self.assertEqual(self.car.stock_parts.count(), 3)
+
+        self.assertEqual(compare_reports(report, report), [])
+        slower = json.loads(json.dumps(report))
+        slower['routes']['car-stats']['queries']['max'] += 1
+        slower['routes']['export-report']['latency_ms']['p95'] += 1000
+        del slower['routes']['car-list']
+        regressions = {(r['route'], r['metric']) for r in compare_reports(report, slower)}
+        self.assertEqual(regressions, {
+            ('car-stats', 'queries'), ('export-report', 'latency_p95_ms'), ('car-list', 'missing'),
+        })
+
+
+class AsyncViewsTests(GarageTestCase):
+    def test_read_requires_session(self):
+        self.client.logout()
+        response = self.client.get(reverse('car-list'))
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('detail', response.json())
+
+    def test_writes_go_to_drf_views(self):
+        response = self.client.post(reverse('car-list'), {'brand': 'Kia', 'model': 'Rio', 'vin': 'Z94CB41AAGR000001'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(reverse('car-stats', args=[self.car.id]))
+        self.assertEqual(response.status_code, 405)
+
+    async def test_async_client(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('car-list'))
+        self.assertEqual([car['vin'] for car in response.json()], [self.car.vin])
+        response = await self.async_client.get(reverse('repair-record-list', args=[self.car.id]), {'page_size': 1})
+        self.assertEqual(response.json(), {'next': None, 'results': []})
+
+
+class ExportPoolTests(TransactionTestCase):
+    """Отчет строится в пуле потоков и отдается под ASGI по частям"""
+
+    def setUp(self):
+        caches[settings.API_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(username='owner', password='secret-pass-123')
+        self.car = Car.objects.create(user=self.user, brand='Lada', model='Vesta', vin='XTA00000000000001')
+        for i in range(3):
+            RepairRecord.objects.create(car=self.car, date=date(2024, 1, 1 + i), mileage=10000 + i,
+                                        work_description=f'Работа {i}', work_cost=Decimal('1000.00'))
+
+    async def test_export_in_pool(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Поток пула не видит базу в памяти')
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(reverse('export-report', args=[self.car.id]),
+                                    {'date_from': '2024-01-01', 'date_to': '2024-12-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content), int(response['Content-Length']))
+        ws = load_workbook(BytesIO(content)).active
+        self.assertEqual([ws.cell(row=row, column=3).value for row in range(6, 9)],
+                         ['Работа 0', 'Работа 1', 'Работа 2'])
+
+
+class ReportJobTests(GarageTestCase):
+    """Фоновые задания на отчеты Excel"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        # Задания выполняются в тесте явно, а не пулом потоков
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, REPORT_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.create_records(3, parts_per_record=1)
+        self.url = reverse('report-job-list', args=[self.car.id])
+        self.period = {'date_from': '2024-01-01', 'date_to': '2024-12-31'}
+
+    def create_job(self):
+        response = self.client.post(self.url, self.period, content_type='application/json')
+        self.assertIn(response.status_code, (200, 201))
+        return response
+
+    def test_same_request_reuses_job_until_data_changes(self):
+        first = self.create_job()
+        self.assertEqual(first.status_code, 201)
+        second = self.create_job()
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['id'], first.json()['id'])
+
+        RepairRecord.objects.create(car=self.car, date=date(2024, 6, 1), mileage=50000,
+                                    work_description='Новая работа', work_cost=Decimal('100.00'))
+        third = self.create_job()
+        self.assertEqual(third.status_code, 201)
+        self.assertNotEqual(third.json()['id'], first.json()['id'])
+
+    def test_change_in_other_process_creates_new_job(self):
+        first = self.create_job()
+        # UPDATE без сигналов и сброса кэша - как сохранение в другом процессе
+        Part.objects.filter(repair_record__car=self.car).update(cost=Decimal('1.00'), updated_at=timezone.now())
+        second = self.create_job()
+        self.assertEqual(second.status_code, 201)
+        self.assertNotEqual(second.json()['id'], first.json()['id'])
+
+    def test_invalid_period(self):
+        response = self.client.post(self.url, {'date_from': '2024-12-31', 'date_to': '2024-01-01'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReportJob.objects.exists())
+
+    def test_job_is_processed_and_downloaded(self):
+        job_id = self.create_job().json()['id']
+        download_url = reverse('report-job-download', args=[self.car.id, job_id])
+        self.assertEqual(self.client.get(download_url).status_code, 409)
+
+        job = process_next_job()
+        self.assertEqual(job.pk, job_id)
+        self.assertIsNone(process_next_job())
+
+        detail = self.client.get(reverse('report-job-detail', args=[self.car.id, job_id])).json()
+        self.assertEqual(detail['status'], ReportJob.STATUS_DONE)
+        self.assertEqual(detail['download_url'], download_url)
+        self.assertEqual([item['id'] for item in self.client.get(self.url).json()], [job_id])
+
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        ws = load_workbook(BytesIO(content)).active
+        self.assertEqual(ws.cell(row=6, column=3).value, 'Работа 0')
+
+    def test_job_is_claimed_once(self):
+        job_id = self.create_job().json()['id']
+        self.assertTrue(claim_job(job_id))
+        self.assertFalse(claim_job(job_id))
+        self.assertIsNone(process_report_job(job_id))
+
+    def test_purge_deletes_file(self):
+        self.create_job()
+        job = process_next_job()
+        path = job.file.path
+        self.assertTrue(os.path.exists(path))
+
+        self.assertEqual(purge_report_jobs(max_age=3600), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(purge_report_jobs(max_age=0), 1)
+        self.assertFalse(ReportJob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_worker_command(self):
+        self.create_job()
+        call_command('report_worker', once=True, stdout=StringIO())
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.STATUS_DONE)
+
+
+class ServerBenchmarkTests(TransactionTestCase):
+    def test_wsgi_and_asgi_serve_the_same_requests(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Запросы ASGI выполняются в других потоках')
+        user = seed_garage(users=1, repairs_per_car=5)[0]
+        report = run_server_benchmark(user.cars.first(), requests=14, concurrency=4, wsgi_workers=2)
+        self.assertEqual(report['wsgi']['statuses'], {'200': 14})
+        self.assertEqual(report['asgi']['statuses'], {'200': 14})